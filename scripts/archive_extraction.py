@@ -0,0 +1,257 @@
+"""
+Streaming, filtered extraction of submission archives.
+
+Archive members are screened by name and declared size before anything is
+written: system files (__MACOSX, .DS_Store), unsupported types (.npy, .pkl, ...)
+and files over the size limit of their category are never extracted. Members
+are streamed to disk in chunks and cut off when they grow past their declared
+size, so a forged header cannot smuggle in more data than was screened.
+
+Zip bombs are stopped by three limits: a total extracted size per submission,
+a maximum compression ratio per member and for the archive as a whole, and a
+maximum member count. Archives inside archives are extracted like any other
+member; the caller expands them up to a depth limit.
+
+extract_archive runs in the CPU pool, so its arguments and result are plain
+picklable values.
+"""
+
+import bz2
+import gzip
+import lzma
+import zipfile
+import tarfile
+import logging
+from functools import partial
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+
+class MemberRules:
+    """The name and size rules of SubmissionPreprocessor.should_process_file, applied to archive members."""
+
+    def __init__(self, categories: Dict[str, str], skip_files: Set[str], skip_extensions: Set[str],
+                 size_limits_mb: Dict[str, float]):
+        self.categories = categories
+        self.skip_files = skip_files
+        self.skip_extensions = skip_extensions
+        self.size_limits_mb = size_limits_mb
+
+    def size_limit(self, name: str) -> int:
+        # Members of unknown type are only kept if they turn out to be text
+        category = self.categories.get(PurePosixPath(name).suffix.lower(), 'textual')
+        return int(self.size_limits_mb.get(category, 100) * MB)
+
+    def screen(self, name: str, size: Optional[int]) -> Optional[str]:
+        """Reason to skip a member (size None: not declared), or None to extract it."""
+        path = PurePosixPath(name)
+        file_name = path.name
+        if (file_name.startswith('._') or
+                file_name.startswith('.') and not file_name.startswith('..') or
+                any(part in self.skip_files for part in path.parts)):
+            return 'System/hidden file'
+        if path.suffix.lower() in self.skip_extensions:
+            return 'Unsupported file type'
+        if size == 0:
+            return 'Empty file'
+        limit = self.size_limit(name)
+        if size is not None and size > limit:
+            return f'File too large ({size / MB:.1f}MB > {limit / MB:.0f}MB)'
+        return None
+
+
+class ExtractionLimits:
+    """Bomb limits of the archives of one submission."""
+
+    def __init__(self, max_total_bytes: int = 500 * MB, max_ratio: float = 100, max_depth: int = 3,
+                 max_members: int = 10000):
+        self.max_total_bytes = max_total_bytes
+        self.max_ratio = max_ratio
+        self.max_depth = max_depth
+        self.max_members = max_members
+
+
+class MemberTooLarge(Exception):
+    """A member grew past its declared size or the remaining extraction budget."""
+
+
+def member_path(extract_dir: Path, name: str) -> Optional[Path]:
+    """Target of a member, or None for names that would land outside extract_dir."""
+    path = PurePosixPath(name.replace('\\', '/'))
+    parts = [part for part in path.parts if part not in ('', '.')]
+    if not parts or path.is_absolute() or '..' in parts:
+        return None
+    return extract_dir.joinpath(*parts)
+
+
+def _copy_member(source, target: Path, max_bytes: int) -> int:
+    written = 0
+    with open(target, 'wb') as out:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                raise MemberTooLarge()
+            out.write(chunk)
+    return written
+
+
+def _skip_reason(name: str, size: Optional[int], compressed: Optional[int], extract_dir: Path,
+                 rules: MemberRules, limits: ExtractionLimits) -> Optional[str]:
+    reason = rules.screen(name, size)
+    if reason is None and member_path(extract_dir, name) is None:
+        reason = 'Path outside the archive'
+    # Small members of repetitive text compress well without being bombs
+    if reason is None and size and compressed and size > CHUNK_SIZE and size / compressed > limits.max_ratio:
+        reason = f"Compression ratio {size / compressed:.0f} above {limits.max_ratio:.0f}"
+    return reason
+
+
+def extract_members(members: Iterable[Tuple[str, Optional[int], Optional[int], Callable]], extract_dir: Path,
+                    rules: MemberRules, limits: ExtractionLimits, max_bytes: int, archive_size: int) -> Dict:
+    """
+    Extract the (name, declared size, compressed size, open) members that pass the rules.
+    Members over CHUNK_SIZE are also skipped once the archive as a whole expands past its ratio
+    limit. Stops when max_bytes are written.
+    Returns {'files', 'skipped': [(name, reason)], 'bytes', 'stopped': reason or None}.
+    """
+    result = {'files': [], 'skipped': [], 'bytes': 0, 'stopped': None}
+    ratio_budget = limits.max_ratio * max(archive_size, 1)
+    ratio_bytes = 0
+    for index, (name, size, compressed, open_member) in enumerate(members):
+        if index >= limits.max_members:
+            result['stopped'] = f"more than {limits.max_members} members"
+            break
+        reason = _skip_reason(name, size, compressed, extract_dir, rules, limits)
+        # Like the per-member ratio check, small members do not count against the archive ratio
+        counted = size is None or size > CHUNK_SIZE
+        if reason is None and counted and size is not None and size > ratio_budget - ratio_bytes:
+            reason = f"Archive compression ratio above {limits.max_ratio:.0f}"
+        if reason is None and size is not None and result['bytes'] + size > max_bytes:
+            result['stopped'] = f"extraction limit of {max_bytes / MB:.0f}MB reached"
+            break
+        if reason:
+            result['skipped'].append((name, reason))
+            continue
+
+        target = member_path(extract_dir, name)
+        remaining = max_bytes - result['bytes']
+        ratio_remaining = ratio_budget - ratio_bytes if counted else remaining
+        cap = min(size if size is not None else rules.size_limit(name), remaining, ratio_remaining)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with open_member() as source:
+                written = _copy_member(source, target, cap)
+        except MemberTooLarge:
+            target.unlink(missing_ok=True)
+            if size is not None and cap == size:
+                result['skipped'].append((name, 'Larger than declared'))
+                continue
+            if cap == remaining:
+                result['stopped'] = f"extraction limit of {max_bytes / MB:.0f}MB reached"
+                break
+            if cap == ratio_remaining:
+                result['skipped'].append((name, f"Archive compression ratio above {limits.max_ratio:.0f}"))
+                continue
+            result['skipped'].append((name, f"File too large (over {cap / MB:.0f}MB)"))
+            continue
+        except Exception as e:
+            # Encrypted or corrupt member: the rest of the archive may still be readable
+            target.unlink(missing_ok=True)
+            result['skipped'].append((name, f"Unreadable: {str(e)[:80]}"))
+            continue
+        result['bytes'] += written
+        if counted:
+            ratio_bytes += written
+        result['files'].append(str(target))
+    return result
+
+
+def extract_archive(path: str, extract_dir: str, rules: MemberRules, limits: ExtractionLimits,
+                    max_bytes: int) -> Dict:
+    """Extract a zip, tar (any compression), rar or single compressed file member by member (see extract_members)."""
+    source = Path(path)
+    target_dir = Path(extract_dir)
+    archive_size = source.stat().st_size
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, 'r') as archive:
+            members = ((info.filename, info.file_size, info.compress_size, partial(archive.open, info))
+                       for info in archive.infolist() if not info.is_dir())
+            return extract_members(members, target_dir, rules, limits, max_bytes, archive_size)
+
+    if source.suffix.lower() == '.rar':
+        import rarfile
+        with rarfile.RarFile(path, 'r') as archive:
+            members = ((info.filename, info.file_size, info.compress_size, partial(archive.open, info))
+                       for info in archive.infolist() if not info.is_dir())
+            return extract_members(members, target_dir, rules, limits, max_bytes, archive_size)
+
+    if tarfile.is_tarfile(path):
+        # Iterating reads the archive once (compressed tars are not seekable); links are never extracted
+        with tarfile.open(path, 'r:*') as archive:
+            members = ((info.name, info.size, None, partial(archive.extractfile, info))
+                       for info in archive if info.isfile())
+            return extract_members(members, target_dir, rules, limits, max_bytes, archive_size)
+
+    opener = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}.get(source.suffix.lower())
+    if opener:
+        # A single compressed file; its size is only known once decompressed
+        members = [(source.stem, None, None, partial(opener, path, 'rb'))]
+        return extract_members(members, target_dir, rules, limits, max_bytes, archive_size)
+
+    raise ValueError(f"Unsupported archive format: {source.name}")
+
+
+def parse_7z_listing(listing: str) -> List[Tuple[str, Optional[int], Optional[int]]]:
+    """(name, size, packed size) of the files in `7z l -slt` output."""
+    members = []
+    for block in listing.split('\n\n'):
+        fields = {}
+        for line in block.splitlines():
+            key, sep, value = line.partition(' = ')
+            if sep:
+                fields[key.strip()] = value.strip()
+        if 'Path' not in fields or 'Size' not in fields or 'D' in fields.get('Attributes', ''):
+            continue
+        size = int(fields['Size']) if fields['Size'].isdigit() else None
+        packed = int(fields['Packed Size']) if fields.get('Packed Size', '').isdigit() else None
+        members.append((fields['Path'], size, packed))
+    return members
+
+
+def screen_members(members: Iterable[Tuple[str, Optional[int], Optional[int]]], extract_dir: Path,
+                   rules: MemberRules, limits: ExtractionLimits, max_bytes: int, archive_size: int) -> Dict:
+    """
+    Select members for an extractor that cannot stream (7z): the same rules as extract_members,
+    applied to declared sizes only. Returns {'names', 'skipped', 'bytes', 'stopped'}.
+    """
+    result = {'names': [], 'skipped': [], 'bytes': 0, 'stopped': None}
+    ratio_budget = limits.max_ratio * max(archive_size, 1)
+    ratio_bytes = 0
+    for index, (name, size, compressed) in enumerate(members):
+        if index >= limits.max_members:
+            result['stopped'] = f"more than {limits.max_members} members"
+            break
+        reason = _skip_reason(name, size, compressed, extract_dir, rules, limits)
+        counted = size is None or size > CHUNK_SIZE
+        if reason is None and counted and size is not None and size > ratio_budget - ratio_bytes:
+            reason = f"Archive compression ratio above {limits.max_ratio:.0f}"
+        if reason is None and result['bytes'] + (size or 0) > max_bytes:
+            result['stopped'] = f"extraction limit of {max_bytes / MB:.0f}MB reached"
+            break
+        if reason:
+            result['skipped'].append((name, reason))
+            continue
+        result['names'].append(name)
+        result['bytes'] += size or 0
+        if counted:
+            ratio_bytes += size or 0
+    return result
@@ -0,0 +1,196 @@
+"""
+Content-addressed cache of preprocessing artifacts.
+
+Converted PDFs, page images and page text are stored under a key made of the
+SHA-256 of the input file, the kind of conversion and the converter settings
+(dpi, maximum resolution, ...). Identical inputs - the course template every
+student hands in, a resubmitted PDF, the files of a submission whose run failed
+halfway - are then converted once and restored on later hits with hardlinks
+(a copy when the cache is on another filesystem).
+
+Artifact names are stored relative to the stem of the input file, so a hit for
+a file with another name restores names derived from that name.
+
+Each entry is a directory written under a temporary name and renamed into place,
+so readers never see a partial entry. The cache is kept under max_bytes by
+evicting the least recently used entries.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pdf_analysis import file_digest
+
+logger = logging.getLogger(__name__)
+
+# Bump when converter output changes so old entries are no longer used
+CACHE_VERSION = 1
+STEM_PLACEHOLDER = '{stem}'
+
+
+def _link_or_copy(source: Path, target: Path):
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class CacheEntry:
+    """A cached conversion: files per output role and the data stored with them."""
+
+    def __init__(self, path: Path, meta: Dict):
+        self.path = path
+        self.files: Dict[str, List[str]] = meta['files']
+        self.data = meta.get('data')
+
+    def restore(self, stem: str, output_dirs: Dict[str, Path]) -> Dict[str, List[Path]]:
+        """Hardlink the files of every role into its output directory, named after `stem`."""
+        restored: Dict[str, List[Path]] = {}
+        try:
+            for role, names in self.files.items():
+                restored[role] = []
+                for name in names:
+                    target = output_dirs[role] / name.replace(STEM_PLACEHOLDER, stem, 1)
+                    _link_or_copy(self.path / role / name, target)
+                    restored[role].append(target)
+        except OSError:
+            # Entry evicted by another process while restoring: leave nothing behind
+            for paths in restored.values():
+                for target in paths:
+                    target.unlink(missing_ok=True)
+            raise
+        return restored
+
+
+class ArtifactCache:
+    """On-disk cache of conversion outputs, limited to max_bytes with LRU eviction."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = root / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._size = sum(self._entry_size(entry) for entry in self._entries())
+
+    def _entries(self) -> List[Path]:
+        return [entry for entry in self.objects_dir.glob('*/*') if (entry / 'meta.json').exists()]
+
+    @staticmethod
+    def _entry_size(entry: Path) -> int:
+        try:
+            with open(entry / 'meta.json', 'r', encoding='utf-8') as f:
+                return json.load(f).get('bytes', 0)
+        except (OSError, ValueError):
+            return 0
+
+    def digest(self, file_path: Path) -> str:
+        """SHA-256 of a file, remembered while its size and mtime are unchanged."""
+        stat = file_path.stat()
+        identity = (str(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(identity)
+        if digest is None:
+            digest = file_digest(file_path)
+            with self._lock:
+                if len(self._digests) > 4096:
+                    self._digests.clear()
+                self._digests[identity] = digest
+        return digest
+
+    def key(self, file_path: Path, kind: str, settings: Dict) -> str:
+        material = json.dumps({
+            'version': CACHE_VERSION,
+            'input': self.digest(file_path),
+            'kind': kind,
+            'settings': settings
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.objects_dir / key[:2] / key
+
+    def contains(self, key: str) -> bool:
+        return (self._entry_path(key) / 'meta.json').exists()
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entry_path(key)
+        meta_path = entry / 'meta.json'
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            # Last use for LRU eviction
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(entry, meta)
+
+    def store(self, key: str, stem: str, outputs: Dict[str, List[Path]], data=None):
+        """Copy the output files of a conversion (per role) into the cache."""
+        entry = self._entry_path(key)
+        if entry.exists():
+            return
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = Path(tempfile.mkdtemp(prefix=f".{key[:16]}_", dir=entry.parent))
+        try:
+            files: Dict[str, List[str]] = {}
+            total = 0
+            for role, paths in outputs.items():
+                (temp_dir / role).mkdir()
+                files[role] = []
+                for path in paths:
+                    name = path.name
+                    if name.startswith(stem):
+                        name = STEM_PLACEHOLDER + name[len(stem):]
+                    # A copy: outputs may still be replaced or deleted after they are cached
+                    shutil.copy2(path, temp_dir / role / name)
+                    files[role].append(name)
+                    total += path.stat().st_size
+            with open(temp_dir / 'meta.json', 'w', encoding='utf-8') as f:
+                json.dump({'files': files, 'data': data, 'bytes': total, 'created': time.time()}, f)
+            os.rename(temp_dir, entry)
+        except OSError as e:
+            # Another process stored the same entry first, or the disk is full
+            logger.debug(f"Not caching {key[:16]}: {e}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            self._size += total
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache is under max_bytes."""
+        with self._lock:
+            entries = []
+            for entry in self._entries():
+                try:
+                    entries.append(((entry / 'meta.json').stat().st_mtime, entry))
+                except OSError:
+                    continue
+            entries.sort()
+            self._size = sum(self._entry_size(entry) for _, entry in entries)
+            for _, entry in entries:
+                if self._size <= self.max_bytes:
+                    break
+                size = self._entry_size(entry)
+                shutil.rmtree(entry, ignore_errors=True)
+                self._size -= size
+                logger.debug(f"Evicted cache entry {entry.name[:16]} ({size} bytes)")
+
+    def stats(self) -> Tuple[int, int]:
+        """(entries, bytes) currently in the cache."""
+        with self._lock:
+            return len(self._entries()), self._size
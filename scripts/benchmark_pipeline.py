@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the parse + grade pipeline.
+
+Builds a synthetic tree of preprocessed submissions and a processed model
+solution, then runs process_submissions against the deterministic fake backend
+for every requested --parallel value. Reports throughput, per-stage latency
+percentiles, retry counts and thread utilization without spending API money.
+"""
+
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from typing import List, Dict, Any
+
+from fake_backend import FakeBackend
+import process_submissions
+
+logger = logging.getLogger(__name__)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark parse + grade throughput using a fake LLM backend.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument('--submissions', type=int, default=40,
+                        help='Number of synthetic submissions')
+    parser.add_argument('--textual_files', type=int, default=2,
+                        help='Textual files per submission')
+    parser.add_argument('--visual_files', type=int, default=6,
+                        help='Visual files per submission')
+    parser.add_argument('--parallel', default='1,2,4,8',
+                        help='Comma separated list of --parallel values to benchmark')
+    parser.add_argument('--retry_count', type=int, default=3,
+                        help='Number of retries for API calls')
+    parser.add_argument('--retry_delay', type=float, default=0.5,
+                        help='Initial retry delay in seconds')
+    parser.add_argument('--parse_latency', default='lognormal:2.0:0.5',
+                        help='Latency distribution of parse generate calls')
+    parser.add_argument('--grade_latency', default='lognormal:1.5:0.5',
+                        help='Latency distribution of grade generate calls')
+    parser.add_argument('--upload_latency', default='constant:0.05',
+                        help='Latency distribution of uploads')
+    parser.add_argument('--rate_429', type=float, default=0.05,
+                        help='Probability of a 429 error per generate call')
+    parser.add_argument('--rate_500', type=float, default=0.01,
+                        help='Probability of a 500 error per generate call')
+    parser.add_argument('--time_scale', type=float, default=0.1,
+                        help='Multiplier applied to all simulated latencies')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the fake backend and the synthetic tree')
+    parser.add_argument('--output', type=Path, default=Path('benchmark_pipeline_results.json'),
+                        help='Path of the JSON results file')
+
+    return parser.parse_args()
+
+
+def create_synthetic_tree(root: Path, args) -> Path:
+    """Create a processed solution and preprocessed submissions. Returns the solution dir."""
+    rng = random.Random(args.seed)
+
+    solution_dir = root / "solution"
+    solution_dir.mkdir(parents=True)
+    hint_path = solution_dir / "structure_hint.txt"
+    hint_path.write_text("Exercise 1.1:\ni) 2 points\nii) 2 points\n", encoding='utf-8')
+    parsed_solution = solution_dir / "parsed_solution.md"
+    parsed_solution.write_text("## Exercise 1.1 (Synthetic Exercise). (Total: 4 points)\n" * 20, encoding='utf-8')
+    with open(solution_dir / "processed_solution_info.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            'parsed_solution_path': str(parsed_solution),
+            'structure_hint_path': str(hint_path)
+        }, f, indent=2)
+
+    submissions_dir = root / "submissions"
+    for i in range(args.submissions):
+        submission_dir = submissions_dir / f"Student_{i:04d}_{100000 + i}_{rng.randint(1000000, 9999999)}"
+        textual_dir = submission_dir / "processed" / "textual"
+        visual_dir = submission_dir / "processed" / "visual"
+        textual_dir.mkdir(parents=True)
+        visual_dir.mkdir(parents=True)
+
+        textual_files = []
+        for j in range(args.textual_files):
+            path = textual_dir / f"solution_{j}.py"
+            path.write_text("x = 1\n" * rng.randint(50, 500), encoding='utf-8')
+            textual_files.append(str(path.relative_to(submission_dir)))
+
+        visual_files = []
+        for j in range(args.visual_files):
+            path = visual_dir / f"page_{j + 1}.jpg"
+            path.write_bytes(rng.randbytes(rng.randint(50_000, 300_000)))
+            visual_files.append(str(path.relative_to(submission_dir)))
+
+        preprocess_info = {
+            'submission_name': submission_dir.name,
+            'textual_files': textual_files,
+            'visual_files': visual_files,
+            'summary': {
+                'total_original_files': len(textual_files) + len(visual_files),
+                'textual_outputs': len(textual_files),
+                'visual_outputs': len(visual_files)
+            }
+        }
+        with open(submission_dir / "processed" / "preprocess_info.json", 'w', encoding='utf-8') as f:
+            json.dump(preprocess_info, f, indent=2)
+
+    return solution_dir
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Return p50/p95/p99 (nearest rank) of a list of values."""
+    if not values:
+        return {'count': 0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {'count': len(ordered), 'p50': rank(50), 'p95': rank(95), 'p99': rank(99)}
+
+
+def collect_stage_times(submissions_dir: Path) -> Dict[str, List[float]]:
+    """Read per-stage processing times (including retries) from grading_metadata.json files."""
+    stage_times = {'parsing': [], 'grading': []}
+    for metadata_path in submissions_dir.glob("*/grading_metadata.json"):
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        for stage in stage_times:
+            if stage in metadata:
+                stage_times[stage].append(metadata[stage]['processing_time_seconds'])
+    return stage_times
+
+
+def run_benchmark(template_dir: Path, parallel: int, args) -> Dict[str, Any]:
+    """Run the pipeline once over a fresh copy of the synthetic tree."""
+    with tempfile.TemporaryDirectory(prefix="bench_run_") as run_dir_str:
+        run_dir = Path(run_dir_str) / "tree"
+        shutil.copytree(template_dir, run_dir)
+        submissions_dir = run_dir / "submissions"
+
+        parse_backend = FakeBackend(
+            stage='parse', generate_latency=args.parse_latency, upload_latency=args.upload_latency,
+            rate_429=args.rate_429, rate_500=args.rate_500, seed=args.seed, time_scale=args.time_scale
+        )
+        grade_backend = FakeBackend(
+            stage='grade', generate_latency=args.grade_latency, upload_latency=args.upload_latency,
+            rate_429=args.rate_429, rate_500=args.rate_500, seed=args.seed, time_scale=args.time_scale
+        )
+
+        run_args = argparse.Namespace(
+            submissions_dir=submissions_dir,
+            solution_dir=run_dir / "solution",
+            parallel=parallel,
+            retry_count=args.retry_count,
+            retry_delay=args.retry_delay,
+            regrade=False,
+            parse_chunk_pages=20,
+            parse_chunk_workers=4
+        )
+
+        start = time.perf_counter()
+        results = process_submissions.process_submissions(run_args, parse_backend, grade_backend)
+        wall = time.perf_counter() - start
+
+        stage_times = collect_stage_times(submissions_dir)
+        calls = parse_backend.calls + grade_backend.calls
+
+    completed = sum(1 for r in results.values() if r['grading'] == 'success')
+    busy = sum(c['end'] - c['start'] for c in calls)
+    threads = len({c['thread'] for c in calls})
+
+    latency = {
+        'parse_stage': percentiles(stage_times['parsing']),
+        'grade_stage': percentiles(stage_times['grading']),
+        'upload_call': percentiles([c['end'] - c['start'] for c in calls if c['kind'] == 'upload']),
+        'parse_generate_call': percentiles([c['end'] - c['start'] for c in parse_backend.calls if c['kind'] == 'generate']),
+        'grade_generate_call': percentiles([c['end'] - c['start'] for c in grade_backend.calls if c['kind'] == 'generate'])
+    }
+
+    retries = {}
+    for backend in (parse_backend, grade_backend):
+        errors = [c for c in backend.calls if c['kind'] == 'generate' and c['outcome'] != 'ok']
+        retries[backend.stage] = {
+            'total': len(errors),
+            '429': sum(1 for c in errors if c['outcome'] == '429'),
+            '500': sum(1 for c in errors if c['outcome'] == '500')
+        }
+
+    tokens = {
+        'prompt': sum(c.get('prompt_tokens', 0) for c in calls),
+        'completion': sum(c.get('completion_tokens', 0) for c in calls)
+    }
+
+    return {
+        'parallel': parallel,
+        'wall_seconds': wall,
+        'submissions': len(results),
+        'completed': completed,
+        'failed': len(results) - completed,
+        'throughput_per_minute': completed / wall * 60 if wall > 0 else 0.0,
+        'latency_seconds': latency,
+        'retries': retries,
+        'tokens': tokens,
+        'threads_used': threads,
+        'thread_utilization': busy / (parallel * wall) if wall > 0 else 0.0
+    }
+
+
+def print_report(runs: List[Dict[str, Any]]):
+    """Print a compact table of the benchmark runs."""
+    print(f"\n{'parallel':>8} {'wall(s)':>9} {'subs/min':>9} {'parse p50/p95/p99 (s)':>24} "
+          f"{'grade p50/p95/p99 (s)':>24} {'retries':>8} {'util':>6}")
+    for run in runs:
+        parse = run['latency_seconds']['parse_stage']
+        grade = run['latency_seconds']['grade_stage']
+        retries = sum(r['total'] for r in run['retries'].values())
+        print(f"{run['parallel']:>8} {run['wall_seconds']:>9.2f} {run['throughput_per_minute']:>9.1f} "
+              f"{parse['p50']:>7.2f}/{parse['p95']:>6.2f}/{parse['p99']:>6.2f}      "
+              f"{grade['p50']:>7.2f}/{grade['p95']:>6.2f}/{grade['p99']:>6.2f}      "
+              f"{retries:>8} {run['thread_utilization']:>6.0%}")
+
+
+def main():
+    args = parse_arguments()
+    parallel_values = [int(p) for p in args.parallel.split(',') if p.strip()]
+
+    # The pipeline logs every API call, keep the benchmark output readable
+    process_submissions.logger.setLevel(logging.WARNING)
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="bench_template_") as template_str:
+        template_dir = Path(template_str)
+        create_synthetic_tree(template_dir, args)
+
+        for parallel in parallel_values:
+            print(f"Running benchmark with --parallel {parallel} ...")
+            runs.append(run_benchmark(template_dir, parallel, args))
+
+    print_report(runs)
+
+    results = {
+        'config': {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        'runs': runs
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
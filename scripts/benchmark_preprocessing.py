@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Preprocessing benchmark suite.
+
+Times every converter path of SubmissionPreprocessor (convert_to_pdf,
+convert_to_images, native notebook rendering and archive extraction) on the files of a corpus, and the
+end-to-end preprocess_all_submissions run at different worker counts. Results
+are written as JSON for regression tracking. A corpus is generated with
+generate_corpus.py when none is given.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+from pathlib import Path
+from typing import List, Dict, Any
+
+from generate_corpus import generate_corpus, DEFAULT_MIX
+from preprocess_submissions import SubmissionPreprocessor
+
+logger = logging.getLogger(__name__)
+
+OFFICE_EXTENSIONS = SubmissionPreprocessor.OFFICE_EXTENSIONS
+
+
+def pdf_converter_path(extension: str) -> str:
+    """Name of the tool chain convert_to_pdf uses for an extension."""
+    if extension == '.pdf':
+        return 'pdf_copy'
+    if extension == '.ipynb':
+        return 'nbconvert'
+    if extension in OFFICE_EXTENSIONS:
+        return 'libreoffice'
+    if extension == '.html':
+        return 'pandoc_html'
+    return 'unsupported'
+
+
+def image_converter_path(extension: str) -> str:
+    """Name of the tool chain convert_to_images uses for an extension."""
+    if extension in SubmissionPreprocessor.VISUAL_EXTENSIONS:
+        return 'image_resize'
+    if extension == '.pdf':
+        return 'pdftoppm'
+    return f'{pdf_converter_path(extension)}+pdftoppm'
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    ordered = sorted(durations)
+    count = len(ordered)
+
+    def rank(p):
+        return ordered[min(count - 1, max(0, int(round(p / 100 * count)) - 1))]
+
+    return {
+        'count': count,
+        'total_seconds': sum(ordered),
+        'mean_seconds': sum(ordered) / count,
+        'p50_seconds': rank(50),
+        'p95_seconds': rank(95),
+        'max_seconds': ordered[-1]
+    }
+
+
+def sample_files(corpus_dir: Path, submissions: int) -> List[Path]:
+    """Return the top-level files of the first N submissions of the corpus."""
+    submission_dirs = sorted(d for d in corpus_dir.iterdir() if d.is_dir() and not d.name.startswith('#'))
+    files = []
+    for submission_dir in submission_dirs[:submissions]:
+        files.extend(sorted(p for p in submission_dir.iterdir() if p.is_file()))
+    return files
+
+
+def benchmark_converters(preprocessor: SubmissionPreprocessor, files: List[Path], repeat: int) -> Dict[str, Any]:
+    """Time each converter path on the sample files."""
+    timings: Dict[str, Dict[str, List[float]]] = {
+        'convert_to_pdf': {}, 'convert_to_images': {}, 'extract_archives': {}, 'render_notebook': {}
+    }
+    failures: Dict[str, int] = {}
+
+    for file_path in files:
+        should_process, category, _ = preprocessor.should_process_file(file_path)
+        if not should_process:
+            continue
+        extension = file_path.suffix.lower()
+
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory(prefix="bench_conv_") as out_str:
+                out_dir = Path(out_str)
+                if category == 'archive':
+                    path_name = f"archive{extension}"
+                    start = time.perf_counter()
+                    extracted = preprocessor.extract_archives(file_path, out_dir)
+                    timings['extract_archives'].setdefault(path_name, []).append(time.perf_counter() - start)
+                    if not extracted:
+                        failures[f"extract_archives:{path_name}"] = failures.get(f"extract_archives:{path_name}", 0) + 1
+                    continue
+
+                if extension == '.ipynb':
+                    textual_dir = out_dir / "textual"
+                    visual_dir = out_dir / "visual"
+                    textual_dir.mkdir()
+                    visual_dir.mkdir()
+                    start = time.perf_counter()
+                    rendered = preprocessor.render_notebook(file_path, textual_dir, visual_dir)
+                    timings['render_notebook'].setdefault('native', []).append(time.perf_counter() - start)
+                    if rendered is None:
+                        failures["render_notebook:native"] = failures.get("render_notebook:native", 0) + 1
+
+                if category == 'mixed':
+                    path_name = pdf_converter_path(extension)
+                    pdf_dir = out_dir / "pdf"
+                    pdf_dir.mkdir()
+                    start = time.perf_counter()
+                    pdf_path, _ = preprocessor.convert_to_pdf(file_path, pdf_dir)
+                    timings['convert_to_pdf'].setdefault(path_name, []).append(time.perf_counter() - start)
+                    if not pdf_path:
+                        failures[f"convert_to_pdf:{path_name}"] = failures.get(f"convert_to_pdf:{path_name}", 0) + 1
+
+                if category in ('mixed', 'visual'):
+                    path_name = image_converter_path(extension)
+                    image_dir = out_dir / "images"
+                    image_dir.mkdir()
+                    start = time.perf_counter()
+                    images, _ = preprocessor.convert_to_images(file_path, image_dir)
+                    timings['convert_to_images'].setdefault(path_name, []).append(time.perf_counter() - start)
+                    if not images:
+                        failures[f"convert_to_images:{path_name}"] = failures.get(f"convert_to_images:{path_name}", 0) + 1
+
+    return {
+        'paths': {
+            method: {path_name: summarize(durations) for path_name, durations in sorted(paths.items())}
+            for method, paths in timings.items()
+        },
+        'failures': failures
+    }
+
+
+def benchmark_end_to_end(preprocessor: SubmissionPreprocessor, corpus_dir: Path, workers_values: List[int]) -> List[Dict[str, Any]]:
+    """Run preprocess_all_submissions on a fresh copy of the corpus for every worker count."""
+    runs = []
+    for workers in workers_values:
+        with tempfile.TemporaryDirectory(prefix="bench_e2e_") as run_str:
+            run_dir = Path(run_str) / "submissions"
+            shutil.copytree(corpus_dir, run_dir)
+            logger.info(f"Running preprocess_all_submissions with --workers {workers} ...")
+
+            start = time.perf_counter()
+            results = preprocessor.preprocess_all_submissions(run_dir, workers=workers)
+            wall = time.perf_counter() - start
+
+        successful = sum(results.values())
+        runs.append({
+            'workers': workers,
+            'wall_seconds': wall,
+            'submissions': len(results),
+            'successful': successful,
+            'failed': len(results) - successful,
+            'submissions_per_minute': len(results) / wall * 60 if wall > 0 else 0.0
+        })
+        logger.info(f"--workers {workers}: {wall:.2f}s for {len(results)} submissions")
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the preprocessing converters and end-to-end preprocessing.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--corpus', type=Path, default=None,
+                        help='Existing corpus directory (generated into a temp dir if omitted)')
+    parser.add_argument('--submissions', type=int, default=8, help='Submissions to generate when no corpus is given')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='File mix for the generated corpus')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated corpus')
+    parser.add_argument('--workers', default='1,2,4', help='Comma separated worker counts for the end-to-end runs')
+    parser.add_argument('--cpu_workers', type=int, default=0,
+                        help='Worker processes for CPU-bound preprocessing work (0 runs it in the submission threads)')
+    parser.add_argument('--office_listeners', type=int, default=0,
+                        help='Persistent LibreOffice instances (0 starts LibreOffice for every file)')
+    parser.add_argument('--converter_samples', type=int, default=2,
+                        help='Number of submissions whose files are used for converter timings')
+    parser.add_argument('--repeat', type=int, default=1, help='Repetitions of every converter timing')
+    parser.add_argument('--skip_converters', action='store_true', help='Only run the end-to-end benchmark')
+    parser.add_argument('--output', type=Path, default=Path('benchmark_preprocessing_results.json'),
+                        help='Path of the JSON results file')
+    args = parser.parse_args()
+
+    workers_values = [int(w) for w in args.workers.split(',') if w.strip()]
+
+    with tempfile.TemporaryDirectory(prefix="bench_corpus_") as corpus_str:
+        corpus_dir = args.corpus
+        if corpus_dir is None:
+            corpus_dir = Path(corpus_str) / "corpus"
+            logger.info(f"Generating corpus of {args.submissions} submissions ...")
+            generate_corpus(corpus_dir, args.submissions, args.mix, args.seed)
+        elif not corpus_dir.exists():
+            parser.error(f"Corpus directory not found: {corpus_dir}")
+
+        preprocessor = SubmissionPreprocessor(cpu_workers=args.cpu_workers, office_listeners=args.office_listeners)
+
+        try:
+            converters = None
+            if not args.skip_converters:
+                files = sample_files(corpus_dir, args.converter_samples)
+                logger.info(f"Timing converters on {len(files)} files ...")
+                converters = benchmark_converters(preprocessor, files, args.repeat)
+
+            end_to_end = benchmark_end_to_end(preprocessor, corpus_dir, workers_values)
+        finally:
+            preprocessor.close()
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        'converters': converters,
+        'end_to_end': end_to_end
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    if converters:
+        print("\nConverter timings:")
+        for method, paths in converters['paths'].items():
+            for path_name, stats in paths.items():
+                print(f"  {method:<18} {path_name:<22} n={stats['count']:<4} "
+                      f"mean={stats['mean_seconds']:.3f}s p95={stats['p95_seconds']:.3f}s")
+    print("\nEnd-to-end:")
+    for run in end_to_end:
+        print(f"  workers={run['workers']:<3} wall={run['wall_seconds']:.2f}s "
+              f"ok={run['successful']}/{run['submissions']} ({run['submissions_per_minute']:.1f}/min)")
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Per-submission input token budget.
+
+After preprocessing, the planner estimates the input tokens of every textual
+and visual output. When a submission is over budget it degrades its inputs in
+this order, and stops as soon as it fits:
+
+1. drop files that are byte-identical to an earlier output,
+2. downscale images, lowering a common per-image token cap in 258-token tiles
+   down to a legibility floor,
+3. split the submission into page-ordered shards that are parsed separately.
+
+Nothing is removed without a record: every decision is returned with the plan
+and written to preprocess_info.json.
+"""
+
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from cpu_pool import resize_image
+from image_analysis import TOKENS_PER_TILE, budget_scale, estimate_image_tokens
+from pdf_analysis import analyze_pdf, default_call, default_run, file_digest
+from utils import page_order_key
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
+
+
+def estimate_file_tokens(path: Path, run: Callable = default_run, call: Callable = default_call) -> int:
+    """Estimated input tokens of an uploaded file; run and call are passed on to analyze_pdf."""
+    suffix = path.suffix.lower()
+    if suffix in IMAGE_SUFFIXES:
+        try:
+            with Image.open(path) as img:
+                return estimate_image_tokens(*img.size)
+        except Exception:
+            return TOKENS_PER_TILE
+    if suffix == '.pdf':
+        # Every page is seen as an image plus its extracted text
+        analysis = analyze_pdf(path, run=run, call=call)
+        return analysis.page_count * TOKENS_PER_TILE + len(analysis.text) // CHARS_PER_TOKEN
+    return path.stat().st_size // CHARS_PER_TOKEN + 1
+
+
+class BudgetPlanner:
+    """Fits the outputs of a submission into max_tokens."""
+
+    def __init__(self, max_tokens: int, min_image_tokens: int = 2 * TOKENS_PER_TILE,
+                 call: Callable = default_call, tool_runner: Optional[Callable] = None):
+        self.max_tokens = max_tokens
+        self.min_image_tokens = min_image_tokens
+        # Runs CPU-heavy work (image resizing, PDF analysis), e.g. in the preprocessing process pool
+        self.call = call
+        # tool_runner(path) returns the runner of the subprocesses analyzing path (pdftotext, pdfimages),
+        # e.g. one that goes through the preprocessing scheduler
+        self.tool_runner = tool_runner or (lambda path: default_run)
+
+    def plan(self, root: Path, textual_files: List[str], visual_files: List[str],
+             decisions: Optional[List[Dict]] = None) -> Dict:
+        """
+        Plan the inputs of a submission; file lists hold paths relative to root and are updated
+        in place. `decisions` may already hold earlier decisions (e.g. page truncation).
+        """
+        decisions = list(decisions or [])
+        tokens = {}
+        for name in textual_files + visual_files:
+            path = root / name
+            tokens[name] = estimate_file_tokens(path, run=self.tool_runner(path), call=self.call)
+        estimated_before = sum(tokens.values())
+
+        if self.max_tokens > 0 and sum(tokens.values()) > self.max_tokens:
+            self._drop_duplicates(root, textual_files, visual_files, tokens, decisions)
+        if self.max_tokens > 0 and sum(tokens.values()) > self.max_tokens:
+            self._downscale(root, visual_files, tokens, decisions)
+
+        shards = self._shard(textual_files + visual_files, tokens)
+        if len(shards) > 1:
+            decisions.append({
+                'action': 'shard',
+                'detail': f"{sum(tokens.values())} estimated tokens split into {len(shards)} shards "
+                          f"of at most {self.max_tokens}"
+            })
+            logger.info(f"Submission {root.name} split into {len(shards)} shards")
+
+        return {
+            'max_tokens': self.max_tokens,
+            'estimated_tokens_before': estimated_before,
+            'estimated_tokens': sum(tokens.values()),
+            'per_file': tokens,
+            'decisions': decisions,
+            'shards': shards
+        }
+
+    def _drop_duplicates(self, root: Path, textual_files: List[str], visual_files: List[str],
+                         tokens: Dict[str, int], decisions: List[Dict]):
+        seen = {}
+        for files in (textual_files, visual_files):
+            for name in list(files):
+                digest = file_digest(root / name)
+                if digest not in seen:
+                    seen[digest] = name
+                    continue
+                files.remove(name)
+                (root / name).unlink(missing_ok=True)
+                decisions.append({
+                    'action': 'drop_duplicate',
+                    'file': name,
+                    'detail': f"identical to {seen[digest]}",
+                    'tokens_saved': tokens.pop(name)
+                })
+
+    def _downscale(self, root: Path, visual_files: List[str], tokens: Dict[str, int], decisions: List[Dict]):
+        sizes = {}
+        for name in visual_files:
+            try:
+                with Image.open(root / name) as img:
+                    sizes[name] = img.size
+            except Exception:
+                continue
+        if not sizes:
+            return
+
+        other_tokens = sum(t for name, t in tokens.items() if name not in sizes)
+
+        def capped(cap: int) -> Dict[str, int]:
+            result = {}
+            for name, (width, height) in sizes.items():
+                scale = budget_scale(width, height, cap, max(width, height))
+                result[name] = estimate_image_tokens(int(width * scale), int(height * scale))
+            return result
+
+        # Largest common per-image cap that fits, but never below the legibility floor
+        cap = max(tokens[name] for name in sizes)
+        while cap - TOKENS_PER_TILE >= self.min_image_tokens:
+            cap -= TOKENS_PER_TILE
+            if other_tokens + sum(capped(cap).values()) <= self.max_tokens:
+                break
+
+        for name, new_tokens in capped(cap).items():
+            if new_tokens >= tokens[name]:
+                continue
+            width, height = sizes[name]
+            scale = budget_scale(width, height, cap, max(width, height))
+            path = str(root / name)
+            self.call(resize_image, path, path, int(max(width, height) * scale))
+            decisions.append({
+                'action': 'downscale',
+                'file': name,
+                'detail': f"{width}x{height} -> {int(width * scale)}x{int(height * scale)} "
+                          f"(cap {cap} tokens per image)",
+                'tokens_saved': tokens[name] - new_tokens
+            })
+            tokens[name] = new_tokens
+
+    def _shard(self, files: List[str], tokens: Dict[str, int]) -> List[Dict]:
+        """Pack files in page order into shards of at most max_tokens (a larger single file gets its own)."""
+        shards = []
+        current, current_tokens = [], 0
+        for name in sorted(files, key=page_order_key):
+            if current and self.max_tokens > 0 and current_tokens + tokens[name] > self.max_tokens:
+                shards.append({'files': current, 'estimated_tokens': current_tokens})
+                current, current_tokens = [], 0
+            current.append(name)
+            current_tokens += tokens[name]
+        if current:
+            shards.append({'files': current, 'estimated_tokens': current_tokens})
+        return shards
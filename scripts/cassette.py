@@ -0,0 +1,289 @@
+"""
+Record/replay of LLM backend interactions.
+
+A cassette is a gzip-compressed JSON-lines file. In recording mode every upload
+and generate call of a backend is appended to it together with the request
+fingerprint, response text, usage metadata, cost and observed latency. Failed
+calls are recorded with their error so retries replay faithfully. In replay
+mode the recorded responses are served in order for each fingerprint, optionally
+sleeping for the originally observed latency.
+"""
+
+import gzip
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+from llm_backends import LLMBackend, LLMBackendError, LLMResponse, UsageMetadata, error_status_code
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+
+def file_digest(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CassetteFile:
+    """Upload handle that remembers the content digest of the uploaded file."""
+
+    def __init__(self, path: Path, digest: str, handle: Any = None):
+        self.path = path
+        self.name = path.name
+        self.digest = digest
+        self.handle = handle
+
+
+def request_fingerprint(stage: str, inputs: List[Any]) -> str:
+    """Fingerprint a generate request from its text parts and uploaded file digests."""
+    digest = hashlib.sha256(stage.encode('utf-8'))
+    for item in inputs:
+        if isinstance(item, CassetteFile):
+            digest.update(b'\x00file:' + item.digest.encode('ascii'))
+        elif isinstance(item, str):
+            digest.update(b'\x00text:' + item.encode('utf-8'))
+        else:
+            digest.update(b'\x00other:' + type(item).__name__.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Cassette:
+    """Thread-safe append-only store of recorded backend interactions."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._queues: Dict[tuple, deque] = defaultdict(deque)
+        self.interactions = 0
+
+    @classmethod
+    def for_recording(cls, path: Path) -> 'Cassette':
+        cassette = cls(path)
+        cassette.path.parent.mkdir(parents=True, exist_ok=True)
+        cassette._writer = gzip.open(cassette.path, 'wt', encoding='utf-8')
+        cassette._write({'type': 'header', 'version': CASSETTE_VERSION, 'created': time.time()})
+        return cassette
+
+    @classmethod
+    def load(cls, path: Path) -> 'Cassette':
+        cassette = cls(path)
+        with gzip.open(cassette.path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record['type'] == 'header':
+                        if record.get('version') != CASSETTE_VERSION:
+                            raise ValueError(f"Unsupported cassette version: {record.get('version')}")
+                        continue
+                    key = (record['type'], record['stage'], record['key'])
+                    cassette._queues[key].append(record)
+                    cassette.interactions += 1
+            except (EOFError, zlib.error, json.JSONDecodeError) as e:
+                # A run that crashed while recording leaves a truncated stream
+                logger.warning(f"Cassette {path} is truncated, using {cassette.interactions} complete records: {e}")
+        logger.info(f"Loaded {cassette.interactions} recorded interactions from {path}")
+        return cassette
+
+    def _write(self, record: Dict[str, Any]):
+        self._writer.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._writer.flush()
+
+    def record(self, record: Dict[str, Any]):
+        with self._lock:
+            self._write(record)
+            self.interactions += 1
+
+    def next(self, kind: str, stage: str, key: str) -> Optional[Dict[str, Any]]:
+        """Pop the next recorded interaction for a request, or None if there is none."""
+        with self._lock:
+            queue = self._queues.get((kind, stage, key))
+            return queue.popleft() if queue else None
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class RecordedResponse(LLMResponse):
+    """Response served from a cassette, carrying the recorded cost and model."""
+
+    def __init__(self, text: str, usage_metadata: UsageMetadata, cost_usd: float, model_name: str, model_type: str):
+        super().__init__(text, usage_metadata)
+        self.cost_usd = cost_usd
+        self.model_name = model_name
+        self.model_type = model_type
+
+
+class RecordingBackend(LLMBackend):
+    """Wraps a backend and records all of its interactions into a cassette."""
+
+    def __init__(self, inner: LLMBackend, cassette: Cassette, stage: str):
+        super().__init__(inner.model_name, inner.model_type)
+        self.inner = inner
+        self.cassette = cassette
+        self.stage = stage
+        self.backend_name = inner.backend_name
+
+    def upload(self, path: Path) -> CassetteFile:
+        path = Path(path)
+        digest = file_digest(path)
+        start = time.perf_counter()
+        handle = self.inner.upload(path)
+        self.cassette.record({
+            'type': 'upload',
+            'stage': self.stage,
+            'key': digest,
+            'name': path.name,
+            'size': path.stat().st_size,
+            'latency': time.perf_counter() - start
+        })
+        return CassetteFile(path, digest, handle)
+
+    def generate(self, inputs: List[Any]) -> LLMResponse:
+        key = request_fingerprint(self.stage, inputs)
+        inner_inputs = [item.handle if isinstance(item, CassetteFile) else item for item in inputs]
+        record = {
+            'type': 'generate',
+            'stage': self.stage,
+            'key': key,
+            'backend': self.inner.backend_name,
+            'model_name': self.inner.model_name,
+            'model_type': self.inner.model_type
+        }
+
+        start = time.perf_counter()
+        try:
+            response = self.inner.generate(inner_inputs)
+        except Exception as e:
+            record['latency'] = time.perf_counter() - start
+            record['error'] = {'message': str(e), 'status_code': error_status_code(e)}
+            self.cassette.record(record)
+            raise
+
+        record['latency'] = time.perf_counter() - start
+        record['text'] = response.text
+        record['usage'] = {
+            'prompt_token_count': response.usage_metadata.prompt_token_count,
+            'candidates_token_count': response.usage_metadata.candidates_token_count
+        }
+        record['cost_usd'] = self.inner.cost(response)
+        self.cassette.record(record)
+        return response
+
+    def cost(self, response: LLMResponse) -> float:
+        return self.inner.cost(response)
+
+    def describe(self) -> str:
+        return f"{self.inner.describe()} (recording)"
+
+
+class ReplayBackend(LLMBackend):
+    """Serves recorded interactions from a cassette instead of calling a model."""
+
+    backend_name = 'replay'
+
+    def __init__(self, cassette: Cassette, stage: str, use_timing: bool = False):
+        super().__init__('replay', 'replay')
+        self.cassette = cassette
+        self.stage = stage
+        self.use_timing = use_timing
+
+    def upload(self, path: Path) -> CassetteFile:
+        path = Path(path)
+        digest = file_digest(path)
+        record = self.cassette.next('upload', self.stage, digest)
+        if record and self.use_timing:
+            time.sleep(record['latency'])
+        return CassetteFile(path, digest)
+
+    def generate(self, inputs: List[Any]) -> LLMResponse:
+        key = request_fingerprint(self.stage, inputs)
+        record = self.cassette.next('generate', self.stage, key)
+        if record is None:
+            raise LLMBackendError(f"No recorded {self.stage} response for request {key[:12]} in {self.cassette.path}")
+
+        if self.use_timing:
+            time.sleep(record['latency'])
+
+        if 'error' in record:
+            raise LLMBackendError(record['error']['message'], status_code=record['error']['status_code'])
+
+        usage = record['usage']
+        return RecordedResponse(
+            record['text'],
+            UsageMetadata(usage['prompt_token_count'], usage['candidates_token_count']),
+            record['cost_usd'],
+            record['model_name'],
+            record['model_type']
+        )
+
+    def cost(self, response: LLMResponse) -> float:
+        return getattr(response, 'cost_usd', 0.0)
+
+    def response_model(self, response: LLMResponse):
+        # The backend is shared by concurrent requests, so the recorded model travels with the response
+        return response.model_name, response.model_type
+
+    def describe(self) -> str:
+        timing = "original timing" if self.use_timing else "no delays"
+        return f"replay:{self.cassette.path.name} ({timing})"
+
+
+def add_cassette_arguments(parser):
+    """Add record/replay arguments to an argparse parser."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--record_cassette',
+        type=Path,
+        default=None,
+        help='Record all LLM interactions into this cassette file (.jsonl.gz)'
+    )
+    group.add_argument(
+        '--replay_cassette',
+        type=Path,
+        default=None,
+        help='Serve LLM interactions from this cassette file instead of calling a backend'
+    )
+    parser.add_argument(
+        '--replay_timing',
+        action='store_true',
+        help='When replaying, sleep for the originally recorded latency of every call'
+    )
+
+
+def open_cassette(args) -> Optional[Cassette]:
+    """Open the cassette requested on the command line, if any."""
+    if getattr(args, 'replay_cassette', None):
+        return Cassette.load(args.replay_cassette)
+    if getattr(args, 'record_cassette', None):
+        return Cassette.for_recording(args.record_cassette)
+    return None
+
+
+def apply_cassette(backend: Optional[LLMBackend], cassette: Optional[Cassette], stage: str, args) -> LLMBackend:
+    """Return the backend to use for a stage given the cassette mode.
+
+    In replay mode no real backend is needed and `backend` may be None.
+    """
+    if cassette is None:
+        return backend
+    if getattr(args, 'replay_cassette', None):
+        return ReplayBackend(cassette, stage, use_timing=args.replay_timing)
+    return RecordingBackend(backend, cassette, stage)
@@ -0,0 +1,113 @@
+"""
+Process pool for the in-Python CPU work of preprocessing.
+
+Submissions are processed on threads, which is right for the time spent waiting
+on converter subprocesses, but Pillow resizes, PyPDF2 page reading and zip/tar
+decompression hold the GIL. CPUPool runs these module-level tasks in worker
+processes instead. Every task has a timeout, and a worker that crashes (e.g. a
+decoder segfault on a malformed image) only fails the task that caused it: the
+pool is rebuilt and tasks that were merely caught in the crash are retried once.
+
+The task functions take and return plain picklable values (paths as strings).
+"""
+
+import os
+import shutil
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CPUTaskError(Exception):
+    """A pool task timed out or crashed its worker process."""
+
+
+def resize_image(source: str, output: str, max_resolution: int, image_format: Optional[str] = None,
+                 quality: int = 85) -> Tuple[int, int, int, int]:
+    """
+    Downscale an image so its longest side is at most max_resolution, writing it to output.
+    Smaller images are copied unchanged. Returns (width, height, new_width, new_height).
+    """
+    from PIL import Image
+
+    with Image.open(source) as img:
+        width, height = img.size
+        max_dim = max(width, height)
+        if max_dim <= max_resolution:
+            if source != output:
+                shutil.copy2(source, output)
+            return width, height, width, height
+
+        ratio = max_resolution / max_dim
+        new_width = int(width * ratio)
+        new_height = int(height * ratio)
+        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Write to a new file: output may be a hardlink shared with the artifact cache
+        temp_output = f"{output}.tmp"
+        resized_img.save(temp_output, image_format or img.format, optimize=True, quality=quality)
+    os.replace(temp_output, output)
+    return width, height, new_width, new_height
+
+
+class CPUPool:
+    """Runs CPU-bound tasks in worker processes, or inline when workers is 0."""
+
+    def __init__(self, workers: int = 0, task_timeout: float = 120):
+        self.workers = workers
+        self.task_timeout = task_timeout
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # forkserver: forking a process that runs worker threads is unsafe
+                context = multiprocessing.get_context('forkserver')
+                self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+            return self._executor
+
+    def _discard(self, executor: concurrent.futures.ProcessPoolExecutor, kill: bool = False):
+        """Replace a broken or stuck pool; tasks submitted afterwards get a fresh one."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        if kill:
+            # A running task cannot be cancelled, so terminate the workers
+            for process in list(getattr(executor, '_processes', {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, func, *args):
+        """Run func(*args) and return its result. Raises CPUTaskError on timeout or worker crash."""
+        if self.workers <= 0:
+            return func(*args)
+
+        name = getattr(func, '__name__', 'task')
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                future = executor.submit(func, *args)
+                return future.result(timeout=self.task_timeout)
+            except concurrent.futures.TimeoutError:
+                logger.warning(f"{name}{args} timed out after {self.task_timeout}s - restarting process pool")
+                self._discard(executor, kill=True)
+                raise CPUTaskError(f"{name} timed out after {self.task_timeout}s")
+            except BrokenProcessPool:
+                self._discard(executor)
+                if attempt == 0:
+                    # The crash may have been caused by another task running at the same time
+                    logger.warning(f"Process pool broke while running {name}{args} - retrying once")
+                    continue
+                raise CPUTaskError(f"{name} crashed its worker process")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,203 @@
+"""
+Deterministic fake LLM backend for benchmarking the pipeline without API costs.
+
+The fake backend implements the LLMBackend interface with configurable latency
+distributions, injected 429/500 errors, approximate token accounting and canned
+parse/grade responses. Randomness is derived from the request fingerprint and
+the attempt number, so a run is reproducible regardless of thread scheduling.
+"""
+
+import time
+import random
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+from llm_backends import LLMBackend, LLMBackendError, LLMResponse, UsageMetadata
+from utils import calculate_gemini_cost
+
+# Gemini bills every image (and every PDF page) as 258 tokens
+IMAGE_TOKENS = 258
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
+
+CANNED_PARSE_RESPONSE = """## Exercise 1.1 (Synthetic Exercise). (Total: 4 points)
+(i) First question. [2 points]
+**Solution.**
+$$x^2 + y^2 = z^2$$
+(ii) Second question. [2 points]
+**Solution.**
+The plot shows a monotonically increasing function.
+"""
+
+CANNED_GRADE_RESPONSE = """The submission answers both questions of Exercise 1.1.
+
+```json
+{
+  "Exercise 1.1": {
+    "i": 2,
+    "ii": 1
+  },
+  "total": 3
+}
+```
+"""
+
+CANNED_RESPONSES = {
+    'parse': CANNED_PARSE_RESPONSE,
+    'grade': CANNED_GRADE_RESPONSE
+}
+
+
+class LatencyDistribution:
+    """Latency distribution parsed from a spec string.
+
+    Supported specs (seconds):
+        constant:S
+        uniform:MIN:MAX
+        normal:MEAN:STDDEV
+        lognormal:MEDIAN:SIGMA
+    """
+
+    KINDS = {'constant': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2}
+
+    def __init__(self, spec: str):
+        parts = spec.split(':')
+        kind = parts[0]
+        if kind not in self.KINDS or len(parts) - 1 != self.KINDS[kind]:
+            raise ValueError(f"Invalid latency spec '{spec}'")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in parts[1:]]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'constant':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            value = rng.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            value = median * rng.lognormvariate(0, sigma)
+        return max(0.0, value)
+
+
+class FakeFile:
+    """Handle returned by FakeBackend.upload."""
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.name = path.name
+        self.size = size
+
+
+class FakeBackend(LLMBackend):
+    """LLM backend that simulates latency, errors and token usage locally."""
+
+    backend_name = 'fake'
+
+    def __init__(
+        self,
+        stage: str = 'parse',
+        model_type: str = 'pro',
+        generate_latency: str = 'lognormal:2.0:0.5',
+        upload_latency: str = 'constant:0.05',
+        rate_429: float = 0.0,
+        rate_500: float = 0.0,
+        seed: int = 0,
+        time_scale: float = 1.0,
+        response_text: Optional[str] = None
+    ):
+        super().__init__(f"fake-{model_type}", model_type)
+        self.stage = stage
+        self.generate_latency = LatencyDistribution(generate_latency)
+        self.upload_latency = LatencyDistribution(upload_latency)
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.seed = seed
+        self.time_scale = time_scale
+        self.response_text = response_text if response_text is not None else CANNED_RESPONSES.get(stage, "")
+
+        self._lock = threading.Lock()
+        self._attempts: Dict[str, int] = {}
+        self.calls: List[Dict[str, Any]] = []
+
+    def _rng(self, kind: str, fingerprint: str) -> random.Random:
+        """Return a random generator seeded by request content and attempt number."""
+        with self._lock:
+            key = f"{kind}:{fingerprint}"
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        digest = hashlib.sha256(f"{self.seed}:{self.stage}:{key}:{attempt}".encode('utf-8')).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    def _record(self, kind: str, start: float, outcome: str, **extra):
+        call = {
+            'kind': kind,
+            'stage': self.stage,
+            'start': start,
+            'end': time.perf_counter(),
+            'thread': threading.get_ident(),
+            'outcome': outcome
+        }
+        call.update(extra)
+        with self._lock:
+            self.calls.append(call)
+
+    def upload(self, path: Path) -> FakeFile:
+        path = Path(path)
+        start = time.perf_counter()
+        rng = self._rng('upload', str(path))
+        time.sleep(self.upload_latency.sample(rng) * self.time_scale)
+        handle = FakeFile(path, path.stat().st_size)
+        self._record('upload', start, 'ok', bytes=handle.size)
+        return handle
+
+    def _input_tokens(self, item: Any) -> int:
+        if isinstance(item, str):
+            return max(1, len(item) // 4)
+        if isinstance(item, FakeFile):
+            if item.path.suffix.lower() in IMAGE_EXTENSIONS:
+                return IMAGE_TOKENS
+            if item.path.suffix.lower() == '.pdf':
+                # Roughly 50KB per page for typical submissions
+                return IMAGE_TOKENS * max(1, item.size // 50_000)
+            return max(1, item.size // 4)
+        return 0
+
+    def _fingerprint(self, inputs: List[Any]) -> str:
+        digest = hashlib.sha256()
+        for item in inputs:
+            digest.update((item.name if isinstance(item, FakeFile) else str(item)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def generate(self, inputs: List[Any]) -> LLMResponse:
+        start = time.perf_counter()
+        rng = self._rng('generate', self._fingerprint(inputs))
+        latency = self.generate_latency.sample(rng) * self.time_scale
+
+        roll = rng.random()
+        if roll < self.rate_429:
+            # Rate limit errors are returned quickly
+            time.sleep(min(latency, 0.1 * self.time_scale))
+            self._record('generate', start, '429')
+            raise LLMBackendError("429 Resource has been exhausted (fake)", status_code=429)
+        if roll < self.rate_429 + self.rate_500:
+            time.sleep(latency)
+            self._record('generate', start, '500')
+            raise LLMBackendError("500 Internal error encountered (fake)", status_code=500)
+
+        time.sleep(latency)
+        usage = UsageMetadata(
+            sum(self._input_tokens(item) for item in inputs),
+            max(1, len(self.response_text) // 4)
+        )
+        self._record('generate', start, 'ok',
+                     prompt_tokens=usage.prompt_token_count,
+                     completion_tokens=usage.candidates_token_count)
+        return LLMResponse(text=self.response_text, usage_metadata=usage)
+
+    def cost(self, response: LLMResponse) -> float:
+        usage = response.usage_metadata
+        return calculate_gemini_cost(self.model_type, usage.prompt_token_count, usage.candidates_token_count)
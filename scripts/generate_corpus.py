@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Synthetic submission corpus generator.
+
+Creates N submission folders with a configurable mix of the file types that
+students hand in: typed PDFs, scanned PDFs, DOCX documents, Jupyter notebooks
+with plots, large phone photos and zip/rar/7z archives. The output is
+deterministic for a given seed and is used by benchmark_preprocessing.py.
+"""
+
+import io
+import json
+import base64
+import random
+import shutil
+import zipfile
+import argparse
+import subprocess
+import logging
+from pathlib import Path
+from typing import List, Dict
+
+from PIL import Image, ImageDraw
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = 'text_pdf=1,scan_pdf=1,docx=1,ipynb=1,photo=2,zip=1,rar=0,7z=0'
+
+FILE_KINDS = ['text_pdf', 'scan_pdf', 'docx', 'ipynb', 'photo', 'zip', 'rar', '7z']
+
+WORDS = (
+    "let function derivative integral matrix vector proof lemma theorem assume "
+    "therefore hence continuous bounded sequence converges limit epsilon delta "
+    "eigenvalue basis linear map kernel image dimension probability variance"
+).split()
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Parse a 'kind=count,...' mix specification."""
+    counts = {kind: 0 for kind in FILE_KINDS}
+    for item in mix.split(','):
+        if not item.strip():
+            continue
+        kind, count = item.split('=')
+        if kind not in counts:
+            raise ValueError(f"Unknown file kind '{kind}', expected one of {FILE_KINDS}")
+        counts[kind] = int(count)
+    return counts
+
+
+def random_paragraphs(rng: random.Random, lines: int) -> List[str]:
+    """Return lines of pseudo mathematical prose."""
+    result = []
+    for i in range(lines):
+        if i % 12 == 0:
+            result.append(f"Exercise {rng.randint(1, 5)}.{rng.randint(1, 4)} ({rng.choice(['i', 'ii', 'iii'])})")
+        else:
+            result.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 14))))
+    return result
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_text_pdf(path: Path, pages: List[List[str]]):
+    """Write a minimal PDF with a real text layer (Helvetica, one content stream per page)."""
+    objects = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+
+    objects.append("<< /Type /Catalog /Pages 2 0 R >>")
+    kids = ' '.join(f"{pid} 0 R" for pid in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for i, lines in enumerate(pages):
+        content = "BT /F1 11 Tf 14 TL 56 780 Td " + ' '.join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_ids[i] + 1} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(content.encode('latin-1'))} >>\nstream\n{content}\nendstream")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1'))
+    xref_offset = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1'))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode('latin-1'))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('latin-1'))
+    path.write_bytes(out.getvalue())
+
+
+def handwritten_page(rng: random.Random, size=(1240, 1754), color=False) -> Image.Image:
+    """Render a page that looks like a scanned sheet of handwriting."""
+    background = (250, 248, 240) if color else (255, 255, 255)
+    img = Image.new('RGB', size, background)
+    draw = ImageDraw.Draw(img)
+    ink = (20, 30, 120) if color else (30, 30, 30)
+    y = rng.randint(80, 160)
+    while y < size[1] - 120:
+        x = rng.randint(60, 140)
+        while x < size[0] - 200:
+            # A "word" is a short polyline with jitter
+            points = [(x + k * 6, y + rng.randint(-8, 8)) for k in range(rng.randint(4, 14))]
+            draw.line(points, fill=ink, width=rng.randint(2, 4))
+            x = points[-1][0] + rng.randint(20, 40)
+        y += rng.randint(45, 70)
+    return img
+
+
+def plot_image(rng: random.Random, size=(640, 480)) -> Image.Image:
+    """Render a simple line plot like a matplotlib output."""
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    draw.line([(60, 420), (600, 420)], fill='black', width=2)
+    draw.line([(60, 420), (60, 40)], fill='black', width=2)
+    value = 240
+    points = []
+    for x in range(60, 600, 6):
+        value = min(410, max(50, value + rng.randint(-12, 12)))
+        points.append((x, value))
+    draw.line(points, fill=(31, 119, 180), width=3)
+    return img
+
+
+def photo_image(rng: random.Random, size=(4032, 3024)) -> Image.Image:
+    """Render a large noisy photo of a sheet of paper on a desk."""
+    desk = Image.effect_noise(size, 40).convert('RGB')
+    desk = Image.blend(desk, Image.new('RGB', size, (120, 90, 60)), 0.7)
+    sheet = handwritten_page(rng, size=(int(size[0] * 0.6), int(size[1] * 0.85)), color=True)
+    desk.paste(sheet, (int(size[0] * 0.2), int(size[1] * 0.07)))
+    return desk
+
+
+def write_docx(path: Path, paragraphs: List[str]):
+    """Write a minimal WordprocessingML document."""
+    def escape(text):
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    body = ''.join(f"<w:p><w:r><w:t>{escape(p)}</w:t></w:r></w:p>" for p in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}</w:body></w:document>'
+    )
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '</Types>'
+    )
+    rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/>'
+        '</Relationships>'
+    )
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml', content_types)
+        docx.writestr('_rels/.rels', rels)
+        docx.writestr('word/document.xml', document)
+
+
+def write_notebook(path: Path, rng: random.Random, plots: int = 2):
+    """Write a notebook with markdown, code, stream output and PNG plot outputs."""
+    cells = [{
+        'cell_type': 'markdown',
+        'metadata': {},
+        'source': [f"# {random_paragraphs(rng, 1)[0]}\n", '\n'.join(random_paragraphs(rng, 4))]
+    }]
+    for i in range(plots):
+        buffer = io.BytesIO()
+        plot_image(rng).save(buffer, format='PNG')
+        cells.append({
+            'cell_type': 'code',
+            'execution_count': i + 1,
+            'metadata': {},
+            'source': ["import numpy as np\n", "import matplotlib.pyplot as plt\n",
+                       f"x = np.linspace(0, {i + 1}, 100)\n", "plt.plot(x, np.sin(x))"],
+            'outputs': [
+                {'name': 'stdout', 'output_type': 'stream', 'text': [f"max value {rng.random():.4f}\n"]},
+                {
+                    'output_type': 'display_data',
+                    'metadata': {},
+                    'data': {
+                        'image/png': base64.b64encode(buffer.getvalue()).decode('ascii'),
+                        'text/plain': ['<Figure size 640x480 with 1 Axes>']
+                    }
+                }
+            ]
+        })
+    notebook = {
+        'cells': cells,
+        'metadata': {'kernelspec': {'display_name': 'Python 3', 'language': 'python', 'name': 'python3'}},
+        'nbformat': 4,
+        'nbformat_minor': 5
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(notebook, f)
+
+
+def archive_members(staging: Path, rng: random.Random) -> List[Path]:
+    """Create the files that go into an archive."""
+    staging.mkdir(parents=True, exist_ok=True)
+    code = staging / "solution.py"
+    code.write_text('\n'.join(f"# {line}" for line in random_paragraphs(rng, 30)) + "\nprint('done')\n", encoding='utf-8')
+    plot = staging / "plot.png"
+    plot_image(rng).save(plot)
+    notes = staging / "notes.pdf"
+    write_text_pdf(notes, [random_paragraphs(rng, 40)])
+    junk = staging / "__MACOSX" / "._solution.py"
+    junk.parent.mkdir(exist_ok=True)
+    junk.write_bytes(b'\x00' * 128)
+    return [code, plot, notes, junk]
+
+
+def write_external_archive(tool: List[str], archive: Path, staging: Path) -> bool:
+    """Create an archive with an external tool, returns False if the tool is unavailable."""
+    try:
+        subprocess.run(tool + [str(archive.resolve()), '.'], cwd=staging, check=True, capture_output=True)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logger.warning(f"Could not create {archive.name} with {tool[0]}: {e}")
+        return False
+
+
+def generate_submission(submission_dir: Path, counts: Dict[str, int], rng: random.Random, photo_size):
+    """Generate one submission folder."""
+    submission_dir.mkdir(parents=True)
+
+    for i in range(counts['text_pdf']):
+        pages = [random_paragraphs(rng, 50) for _ in range(rng.randint(2, 8))]
+        write_text_pdf(submission_dir / f"solution_typed_{i + 1}.pdf", pages)
+
+    for i in range(counts['scan_pdf']):
+        pages = [handwritten_page(rng) for _ in range(rng.randint(2, 6))]
+        pages[0].save(submission_dir / f"solution_scan_{i + 1}.pdf", 'PDF', resolution=150,
+                      save_all=True, append_images=pages[1:])
+
+    for i in range(counts['docx']):
+        write_docx(submission_dir / f"report_{i + 1}.docx", random_paragraphs(rng, 60))
+
+    for i in range(counts['ipynb']):
+        write_notebook(submission_dir / f"exercise_{i + 1}.ipynb", rng, plots=rng.randint(1, 4))
+
+    for i in range(counts['photo']):
+        photo_image(rng, photo_size).save(submission_dir / f"IMG_{rng.randint(1000, 9999)}_{i + 1}.jpg", quality=92)
+
+    for kind, tool in (('zip', None), ('rar', ['rar', 'a', '-r']), ('7z', ['7z', 'a'])):
+        for i in range(counts[kind]):
+            staging = submission_dir / f".staging_{kind}_{i}"
+            members = archive_members(staging, rng)
+            archive = submission_dir / f"code_{kind}_{i + 1}.{kind}"
+            if tool is None:
+                with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+                    for member in members:
+                        zf.write(member, member.relative_to(staging))
+            else:
+                write_external_archive(tool, archive, staging)
+            shutil.rmtree(staging)
+
+
+def generate_corpus(output_dir: Path, submissions: int, mix: str, seed: int = 0, photo_size=(4032, 3024)) -> List[Path]:
+    """Generate a corpus of synthetic submissions. Returns the submission directories."""
+    counts = parse_mix(mix)
+    rng = random.Random(seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    submission_dirs = []
+    for i in range(submissions):
+        name = f"Student_Synthetic{i:04d}_{200000 + i}_{rng.randint(1000000, 9999999)}"
+        submission_dir = output_dir / name
+        generate_submission(submission_dir, counts, rng, photo_size)
+        submission_dirs.append(submission_dir)
+        logger.info(f"Generated {name} ({i + 1}/{submissions})")
+
+    with open(output_dir / "corpus_info.json", 'w', encoding='utf-8') as f:
+        json.dump({'submissions': submissions, 'mix': counts, 'seed': seed,
+                   'photo_size': list(photo_size)}, f, indent=2)
+    return submission_dirs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic corpus of student submissions.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('output_dir', type=Path, help='Directory to create the submissions in')
+    parser.add_argument('--submissions', type=int, default=20, help='Number of submission folders')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Files per submission, kinds: {", ".join(FILE_KINDS)}')
+    parser.add_argument('--photo_size', default='4032x3024', help='Size of generated photos (WxH)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    if args.output_dir.exists() and any(args.output_dir.iterdir()):
+        parser.error(f"Output directory is not empty: {args.output_dir}")
+
+    width, height = (int(v) for v in args.photo_size.lower().split('x'))
+    generate_corpus(args.output_dir, args.submissions, args.mix, args.seed, (width, height))
+
+
+if __name__ == "__main__":
+    main()
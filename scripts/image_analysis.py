@@ -0,0 +1,351 @@
+"""
+Local analysis of the images of a submission before upload.
+
+Scanned submissions often contain blank backsides and several photos of the
+same sheet. Every image gets a signature: its ink coverage (fraction of pixels
+that differ clearly from the local paper background) and two 64-bit perceptual
+hashes, dHash (gradient) and pHash (low DCT frequencies). An image with almost
+no ink is only blank if none of its marks is larger than a speck, so a page
+holding one short line of text is kept. Blank images and near-duplicates (both
+hashes within a few bits) are dropped; of a group of duplicates the largest
+image is kept.
+
+The remaining images are optimized for upload: cropped to their content,
+re-encoded as grayscale WebP or bilevel PNG when they have no colour, and
+downscaled to a token budget (Gemini bills 258 tokens per 768x768 tile).
+
+image_signature and optimize_image are module-level functions taking and
+returning plain values, so they can run in the CPU process pool.
+"""
+
+import os
+import math
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_SIZE = 256          # Long side of the thumbnail ink coverage is measured on
+INK_DELTA = 48               # Luminance difference from the background that counts as ink
+BLANK_INK_COVERAGE = 0.0015  # Images with less ink are checked for marks before being called blank
+MARK_ANALYSIS_SIZE = 1024    # Long side of the image marks are found on (12pt text is 10-15 pixels tall)
+SPECK_PIXELS = 10            # Connected ink areas up to this size are dust or scanner noise
+MIN_IMAGE_SIDE = 32          # Smaller images (icons) are not analyzed
+DUPLICATE_DHASH_BITS = 6
+DUPLICATE_PHASH_BITS = 6
+DUPLICATE_ASPECT_DIFFERENCE = 0.1
+
+TILE_SIZE = 768              # Gemini: images are billed per 768x768 tile
+TOKENS_PER_TILE = 258
+SMALL_IMAGE_SIDE = 384       # Images with both sides up to this are a single tile
+CROP_PADDING = 0.02          # Margin kept around the content, as a fraction of the image size
+MIN_CROP_SAVING = 0.1        # Crop only when it removes at least this fraction of the area
+COLOR_CHROMA = 32            # Chroma above the background's that makes a pixel coloured
+MAX_COLOR_PIXELS = 0.003     # Images with fewer coloured pixels are grayscale
+MAX_MIDTONE_PIXELS = 0.015   # Grayscale images with fewer midtone pixels are bilevel
+BILEVEL_THRESHOLD = 160      # On the background-normalized image
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int(''.join('1' if bit else '0' for bit in bits.ravel()), 2)
+
+
+def dhash(gray: Image.Image) -> int:
+    pixels = np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(gray: Image.Image) -> int:
+    pixels = np.asarray(gray.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8].ravel()[1:]  # without the DC term
+    return _bits_to_int(low > np.median(low))
+
+
+def _background(gray: Image.Image) -> np.ndarray:
+    """Local paper background: the image blurred to 1/16 of its size and scaled back."""
+    small = gray.resize((max(1, gray.width // 16), max(1, gray.height // 16)), Image.Resampling.BOX)
+    return np.asarray(small.resize(gray.size, Image.Resampling.BILINEAR), dtype=np.int16)
+
+
+def _thumbnail(img: Image.Image) -> Image.Image:
+    thumb = img.copy()
+    thumb.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.Resampling.BOX)
+    return thumb
+
+
+def ink_mask(gray: Image.Image) -> np.ndarray:
+    """Pixels that differ from the local background (smooth lighting gradients are ignored)."""
+    return np.abs(np.asarray(gray, dtype=np.int16) - _background(gray)) > INK_DELTA
+
+
+def ink_coverage(gray: Image.Image) -> float:
+    mask = ink_mask(_thumbnail(gray))
+    return float(np.count_nonzero(mask)) / mask.size
+
+
+def largest_mark(gray: Image.Image) -> int:
+    """
+    Pixel count of the largest 8-connected ink area, counted up to just above SPECK_PIXELS:
+    enough to tell a stroke or glyph from specks. Ink is found at full resolution and
+    reduced to MARK_ANALYSIS_SIZE by keeping any ink, so thin strokes are not averaged away.
+    """
+    mask = ink_mask(gray)
+    factor = math.ceil(max(gray.size) / MARK_ANALYSIS_SIZE)
+    if factor > 1:
+        rows, cols = mask.shape[0] // factor * factor, mask.shape[1] // factor * factor
+        mask = mask[:rows, :cols].reshape(rows // factor, factor, cols // factor, factor).any(axis=(1, 3))
+    remaining = set(zip(*np.nonzero(mask)))
+    largest = 0
+    while remaining and largest <= SPECK_PIXELS:
+        stack = [remaining.pop()]
+        size = 0
+        while stack:
+            y, x = stack.pop()
+            size += 1
+            for neighbour in ((y - 1, x - 1), (y - 1, x), (y - 1, x + 1), (y, x - 1),
+                              (y, x + 1), (y + 1, x - 1), (y + 1, x), (y + 1, x + 1)):
+                if neighbour in remaining:
+                    remaining.remove(neighbour)
+                    stack.append(neighbour)
+        largest = max(largest, size)
+    return largest
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """RGB or L version of an image; transparent areas count as white paper."""
+    if img.mode in ('RGBA', 'LA', 'P', 'PA'):
+        img = img.convert('RGBA')
+        canvas = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        canvas.alpha_composite(img)
+        return canvas.convert('RGB')
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def image_signature(path: str) -> Optional[Dict]:
+    """Size, ink coverage and perceptual hashes of an image, or None if it is too small to judge."""
+    with Image.open(path) as img:
+        width, height = img.size
+        if min(width, height) < MIN_IMAGE_SIDE:
+            return None
+        img.draft('L', (MARK_ANALYSIS_SIZE * 2, MARK_ANALYSIS_SIZE * 2))  # JPEG: decode at reduced size
+        gray = _flatten(img).convert('L')
+    coverage = ink_coverage(gray)
+    return {
+        'width': width,
+        'height': height,
+        'ink_coverage': coverage,
+        # Only needed to confirm a blank candidate
+        'largest_mark': largest_mark(gray) if coverage < BLANK_INK_COVERAGE else None,
+        'dhash': dhash(gray),
+        'phash': phash(gray)
+    }
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def is_near_duplicate(a: Dict, b: Dict) -> bool:
+    aspect_a = a['width'] / a['height']
+    aspect_b = b['width'] / b['height']
+    if abs(aspect_a - aspect_b) / max(aspect_a, aspect_b) > DUPLICATE_ASPECT_DIFFERENCE:
+        return False
+    return (hamming(a['dhash'], b['dhash']) <= DUPLICATE_DHASH_BITS
+            and hamming(a['phash'], b['phash']) <= DUPLICATE_PHASH_BITS)
+
+
+def is_blank(signature: Dict) -> bool:
+    """Almost no ink, and none of it in a mark larger than a speck."""
+    if signature['ink_coverage'] >= BLANK_INK_COVERAGE:
+        return False
+    mark = signature.get('largest_mark')
+    return mark is not None and mark <= SPECK_PIXELS
+
+
+def select_redundant(signatures: List[Tuple[str, Optional[Dict]]]) -> List[Dict]:
+    """
+    Given (name, signature) pairs in upload order, return one record per image to drop:
+    {'filename', 'reason': 'blank' | 'near_duplicate', 'duplicate_of', 'ink_coverage'}.
+    Images without a signature are always kept; images with a mark above speck size are never blank.
+    """
+    dropped = []
+    kept: List[Tuple[str, Dict]] = []
+    for name, signature in signatures:
+        if signature is None:
+            continue
+        coverage = round(signature['ink_coverage'], 5)
+        if is_blank(signature):
+            dropped.append({'filename': name, 'reason': 'blank', 'duplicate_of': None, 'ink_coverage': coverage})
+            continue
+        for index, (kept_name, kept_signature) in enumerate(kept):
+            if not is_near_duplicate(signature, kept_signature):
+                continue
+            if signature['width'] * signature['height'] > kept_signature['width'] * kept_signature['height']:
+                # Keep the larger image of the two
+                kept[index] = (name, signature)
+                dropped.append({'filename': kept_name, 'reason': 'near_duplicate', 'duplicate_of': name,
+                                'ink_coverage': round(kept_signature['ink_coverage'], 5)})
+                for record in dropped:
+                    if record['duplicate_of'] == kept_name:
+                        record['duplicate_of'] = name
+            else:
+                dropped.append({'filename': name, 'reason': 'near_duplicate', 'duplicate_of': kept_name,
+                                'ink_coverage': coverage})
+            break
+        else:
+            kept.append((name, signature))
+    return dropped
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Input tokens of an image: one tile when small, otherwise one per 768x768 tile."""
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return TOKENS_PER_TILE
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE) * TOKENS_PER_TILE
+
+
+def budget_scale(width: int, height: int, max_tokens: int, max_resolution: int) -> float:
+    """Largest scale (at most 1) that keeps an image within max_tokens and max_resolution."""
+    scale = min(1.0, max_resolution / max(width, height))
+    if estimate_image_tokens(int(width * scale), int(height * scale)) <= max_tokens:
+        return scale
+    max_tiles = max(1, max_tokens // TOKENS_PER_TILE)
+    best = min(1.0, SMALL_IMAGE_SIDE / max(width, height))
+    for tiles_x in range(1, max_tiles + 1):
+        tiles_y = max_tiles // tiles_x
+        best = max(best, min(scale, tiles_x * TILE_SIZE / width, tiles_y * TILE_SIZE / height))
+    return best
+
+
+def content_box(gray: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of the content with a small margin, or None when cropping would not pay off."""
+    thumb = _thumbnail(gray)
+    mask = ink_mask(thumb)
+    # Ignore isolated specks: a row/column needs at least two ink pixels
+    rows = np.flatnonzero(mask.sum(axis=1) >= 2)
+    cols = np.flatnonzero(mask.sum(axis=0) >= 2)
+    if not len(rows) or not len(cols):
+        return None
+    pad_x, pad_y = int(thumb.width * CROP_PADDING) + 1, int(thumb.height * CROP_PADDING) + 1
+    scale_x, scale_y = gray.width / thumb.width, gray.height / thumb.height
+    box = (max(0, int((cols[0] - pad_x) * scale_x)), max(0, int((rows[0] - pad_y) * scale_y)),
+           min(gray.width, int((cols[-1] + 1 + pad_x) * scale_x)), min(gray.height, int((rows[-1] + 1 + pad_y) * scale_y)))
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area > (1 - MIN_CROP_SAVING) * gray.width * gray.height:
+        return None
+    return box
+
+
+def color_mode(img: Image.Image) -> str:
+    """'color', 'grayscale' or 'bilevel'."""
+    thumb = _thumbnail(img)
+    if thumb.mode == 'RGB':
+        pixels = np.asarray(thumb, dtype=np.int16)
+        chroma = pixels.max(axis=2) - pixels.min(axis=2)
+        # Relative to the background, so paper photographed under warm light is not coloured
+        if np.count_nonzero(chroma - np.median(chroma) > COLOR_CHROMA) > MAX_COLOR_PIXELS * chroma.size:
+            return 'color'
+    gray = thumb.convert('L')
+    normalized = np.clip(np.asarray(gray, dtype=np.int16) - _background(gray) + 255, 0, 255)
+    midtones = np.count_nonzero((normalized > 80) & (normalized < 200))
+    return 'bilevel' if midtones < MAX_MIDTONE_PIXELS * normalized.size else 'grayscale'
+
+
+def optimize_image(path: str, max_tokens: int, max_resolution: int) -> Dict:
+    """
+    Crop an image to its content, re-encode it as grayscale WebP or bilevel PNG when it has no colour,
+    and downscale it to max_tokens. The result replaces the file (possibly with another extension,
+    numbered when another file already has that name) only if it is smaller or cheaper.
+    Returns a record with the output file name, bytes and tokens.
+    """
+    source = Path(path)
+    original_bytes = source.stat().st_size
+    with Image.open(source) as img:
+        original_format = img.format
+        img = _flatten(img)
+        img.load()
+    width, height = img.size
+    record = {
+        'filename': source.name,
+        'original_bytes': original_bytes,
+        'bytes': original_bytes,
+        'original_size': [width, height],
+        'size': [width, height],
+        'tokens_before': estimate_image_tokens(width, height),
+        'tokens': estimate_image_tokens(width, height),
+        'cropped': False,
+        'encoding': 'unchanged'
+    }
+    if min(width, height) < MIN_IMAGE_SIDE:
+        return record
+
+    box = content_box(img.convert('L'))
+    if box is not None:
+        img = img.crop(box)
+    mode = color_mode(img)
+
+    scale = budget_scale(img.width, img.height, max_tokens, max_resolution)
+    if scale < 1:
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.Resampling.LANCZOS)
+
+    if mode == 'bilevel':
+        gray = img.convert('L')
+        normalized = np.clip(np.asarray(gray, dtype=np.int16) - _background(gray) + 255, 0, 255)
+        output = Image.fromarray(normalized >= BILEVEL_THRESHOLD)
+        target, save_args = source.with_suffix('.png'), {'format': 'PNG', 'optimize': True}
+    elif mode == 'grayscale':
+        output = img.convert('L')
+        target, save_args = source.with_suffix('.webp'), {'format': 'WEBP', 'quality': 80, 'method': 4}
+    elif box is None and scale >= 1:
+        # Colour image that needs neither cropping nor scaling: leave it as it is
+        return record
+    else:
+        output = img.convert('RGB') if original_format == 'JPEG' else img
+        save_args = {'format': original_format or 'PNG', 'optimize': True}
+        if original_format == 'JPEG':
+            save_args['quality'] = 85
+        target = source
+
+    temp_path = source.with_name(f".{source.name}.opt")
+    output.save(temp_path, **save_args)
+    new_bytes = temp_path.stat().st_size
+    new_tokens = estimate_image_tokens(*output.size)
+    if new_bytes >= original_bytes and new_tokens >= record['tokens_before']:
+        temp_path.unlink()
+        return record
+
+    if target != source:
+        # page1.jpg must not replace the page1.png of the same scan
+        counter = 1
+        stem, suffix = target.stem, target.suffix
+        while target.exists():
+            target = source.with_name(f"{stem}_{counter}{suffix}")
+            counter += 1
+    os.replace(temp_path, target)
+    if target != source:
+        source.unlink()
+    record.update({
+        'filename': target.name,
+        'bytes': new_bytes,
+        'size': list(output.size),
+        'tokens': new_tokens,
+        'cropped': box is not None,
+        'encoding': mode
+    })
+    return record
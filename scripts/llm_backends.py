@@ -0,0 +1,341 @@
+"""
+LLM backend abstraction used by the parsing and grading scripts.
+
+A backend covers the four operations the pipeline needs from a model provider:
+uploading a file, generating content from a list of inputs, reporting token
+usage and estimating cost. Two implementations are provided:
+
+- GeminiBackend: Google Gemini via google-generativeai (file API uploads).
+- OpenAICompatibleBackend: any server exposing the OpenAI chat completions
+  API (vLLM, llama.cpp server, Ollama, ...). Files are sent inline with the
+  request, images as base64 data URLs.
+"""
+
+import json
+import base64
+import logging
+import mimetypes
+import subprocess
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+from utils import calculate_gemini_cost
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL_NAMES = {
+    'pro': 'gemini-2.5-pro-preview-05-06',
+    'flash': 'gemini-2.5-flash-preview-04-17'
+}
+
+BACKEND_CHOICES = ['gemini', 'openai']
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
+
+
+class LLMBackendError(Exception):
+    """Error returned by a backend, carrying the HTTP status code when known."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UsageMetadata:
+    """Token usage of a single generate call (mirrors Gemini's usage_metadata)."""
+
+    def __init__(self, prompt_token_count: int = 0, candidates_token_count: int = 0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+    @property
+    def total_token_count(self) -> int:
+        return self.prompt_token_count + self.candidates_token_count
+
+    def __repr__(self):
+        return (f"UsageMetadata(prompt_token_count={self.prompt_token_count}, "
+                f"candidates_token_count={self.candidates_token_count})")
+
+
+class LLMResponse:
+    """Backend-independent generate result."""
+
+    def __init__(self, text: str, usage_metadata: Optional[UsageMetadata] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata or UsageMetadata()
+
+
+class InlineFile:
+    """A local file that is sent inline with the request instead of uploaded."""
+
+    def __init__(self, path: Path, mime_type: str, data: bytes):
+        self.path = path
+        self.name = path.name
+        self.mime_type = mime_type
+        self.data = data
+
+
+class LLMBackend:
+    """Interface shared by all model backends."""
+
+    backend_name = 'base'
+    # Requests left in the current rate-limit window, when the server reports it
+    rate_limit_remaining: Optional[int] = None
+
+    def __init__(self, model_name: str, model_type: str):
+        self.model_name = model_name
+        self.model_type = model_type
+
+    def upload(self, path: Path) -> Any:
+        """Make a local file available to the model and return a handle for generate()."""
+        raise NotImplementedError
+
+    def generate(self, inputs: List[Any]) -> LLMResponse:
+        """Generate content from a list of strings and upload handles."""
+        raise NotImplementedError
+
+    def usage(self, response: LLMResponse) -> Dict[str, int]:
+        """Return token usage of a response."""
+        usage = response.usage_metadata
+        return {
+            'prompt_tokens': usage.prompt_token_count,
+            'completion_tokens': usage.candidates_token_count,
+            'total_tokens': usage.prompt_token_count + usage.candidates_token_count
+        }
+
+    def cost(self, response: LLMResponse) -> float:
+        """Return the cost in USD of a response."""
+        raise NotImplementedError
+
+    def response_model(self, response: LLMResponse) -> Tuple[str, str]:
+        """Return the (model name, model type) that produced a response."""
+        return self.model_name, self.model_type
+
+    def describe(self) -> str:
+        return f"{self.backend_name}:{self.model_name}"
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini backend using the file upload API."""
+
+    backend_name = 'gemini'
+    _configured_key = None
+
+    def __init__(self, api_key: str, model_type: str = 'pro', model_name: Optional[str] = None):
+        import google.generativeai as genai
+
+        if model_type not in GEMINI_MODEL_NAMES:
+            raise ValueError("Model must be 'flash' or 'pro'.")
+        super().__init__(model_name or GEMINI_MODEL_NAMES[model_type], model_type)
+        self._genai = genai
+
+        # genai.configure is process-global, only call it when the key changes
+        if GeminiBackend._configured_key != api_key:
+            genai.configure(api_key=api_key)
+            GeminiBackend._configured_key = api_key
+        self._model = genai.GenerativeModel(self.model_name)
+
+    def upload(self, path: Path) -> Any:
+        return self._genai.upload_file(str(path))
+
+    def generate(self, inputs: List[Any]) -> LLMResponse:
+        response = self._model.generate_content(inputs)
+        usage = getattr(response, 'usage_metadata', None)
+        return LLMResponse(
+            text=response.text,
+            usage_metadata=UsageMetadata(
+                getattr(usage, 'prompt_token_count', 0) or 0,
+                getattr(usage, 'candidates_token_count', 0) or 0
+            )
+        )
+
+    def cost(self, response: LLMResponse) -> float:
+        usage = response.usage_metadata
+        return calculate_gemini_cost(self.model_type, usage.prompt_token_count, usage.candidates_token_count)
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Backend for servers implementing the OpenAI chat completions API."""
+
+    backend_name = 'openai'
+
+    def __init__(
+        self,
+        base_url: str,
+        model_name: str,
+        api_key: Optional[str] = None,
+        timeout: float = 600,
+        input_price: float = 0.0,
+        output_price: float = 0.0
+    ):
+        # model_type is a category in metadata ('pro'/'flash' for Gemini), the server's model is in model_name
+        super().__init__(model_name, 'openai')
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        # Pricing per 1M tokens (USD), zero for self-hosted servers
+        self.input_price = input_price
+        self.output_price = output_price
+
+    def upload(self, path: Path) -> InlineFile:
+        path = Path(path)
+        mime_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        with open(path, 'rb') as f:
+            data = f.read()
+        return InlineFile(path, mime_type, data)
+
+    def _pdf_text(self, inline_file: InlineFile) -> str:
+        """Extract the text layer of an inline PDF, chat completion servers cannot read PDFs."""
+        result = subprocess.run(
+            ['pdftotext', '-', '-'],
+            input=inline_file.data, capture_output=True, timeout=120
+        )
+        if result.returncode != 0:
+            raise LLMBackendError(f"pdftotext failed for {inline_file.name}: {result.stderr[:200]!r}")
+        return result.stdout.decode('utf-8', errors='replace')
+
+    def _content_part(self, item: Any) -> Dict[str, Any]:
+        if isinstance(item, str):
+            return {'type': 'text', 'text': item}
+
+        if not isinstance(item, InlineFile):
+            raise TypeError(f"Unsupported input for {self.backend_name} backend: {type(item).__name__}")
+
+        if item.path.suffix.lower() in IMAGE_EXTENSIONS:
+            encoded = base64.b64encode(item.data).decode('ascii')
+            return {'type': 'image_url', 'image_url': {'url': f"data:{item.mime_type};base64,{encoded}"}}
+
+        if item.path.suffix.lower() == '.pdf':
+            text = self._pdf_text(item)
+            return {'type': 'text', 'text': f"File: {item.name} (text extracted from PDF)\n{text}"}
+
+        text = item.data.decode('utf-8', errors='replace')
+        return {'type': 'text', 'text': f"File: {item.name}\n{text}"}
+
+    def build_request(self, inputs: List[Any]) -> Dict[str, Any]:
+        """Build the chat completions request body for a list of inputs."""
+        return {
+            'model': self.model_name,
+            'messages': [
+                {'role': 'user', 'content': [self._content_part(item) for item in inputs]}
+            ]
+        }
+
+    def generate(self, inputs: List[Any]) -> LLMResponse:
+        body = json.dumps(self.build_request(inputs)).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+
+        request = urllib.request.Request(
+            f"{self.base_url}/chat/completions", data=body, headers=headers, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.loads(response.read().decode('utf-8'))
+                remaining = response.headers.get('x-ratelimit-remaining-requests')
+                if remaining is not None and remaining.isdigit():
+                    self.rate_limit_remaining = int(remaining)
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode('utf-8', errors='replace')[:500]
+            raise LLMBackendError(f"HTTP {e.code} from {self.base_url}: {detail}", status_code=e.code)
+        except urllib.error.URLError as e:
+            raise LLMBackendError(f"Cannot reach {self.base_url}: {e.reason}")
+
+        try:
+            text = payload['choices'][0]['message']['content'] or ""
+        except (KeyError, IndexError, TypeError):
+            raise LLMBackendError(f"Malformed response from {self.base_url}: {str(payload)[:200]}")
+
+        usage = payload.get('usage') or {}
+        return LLMResponse(
+            text=text,
+            usage_metadata=UsageMetadata(
+                usage.get('prompt_tokens', 0) or 0,
+                usage.get('completion_tokens', 0) or 0
+            )
+        )
+
+    def cost(self, response: LLMResponse) -> float:
+        usage = response.usage_metadata
+        input_cost = (usage.prompt_token_count / 1_000_000) * self.input_price
+        output_cost = (usage.candidates_token_count / 1_000_000) * self.output_price
+        return input_cost + output_cost
+
+
+def error_status_code(error: Exception) -> Optional[int]:
+    """Return the HTTP status code carried by a backend exception, if any."""
+    for attr in ('status_code', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def add_backend_arguments(parser, stages: List[str]):
+    """Add backend selection arguments for the given pipeline stages to an argparse parser."""
+    for stage in stages:
+        parser.add_argument(
+            f'--{stage}_backend',
+            choices=BACKEND_CHOICES,
+            default='gemini',
+            help=f'LLM backend used for the {stage} stage'
+        )
+
+    parser.add_argument(
+        '--openai_base_url',
+        default='http://localhost:8000/v1',
+        help='Base URL of the OpenAI-compatible server (used by the openai backend)'
+    )
+
+    parser.add_argument(
+        '--openai_model',
+        default=None,
+        help='Model name served by the OpenAI-compatible server'
+    )
+
+    parser.add_argument(
+        '--openai_api_key',
+        default=None,
+        help='API key for the OpenAI-compatible server, if it requires one'
+    )
+
+    parser.add_argument(
+        '--openai_input_price',
+        type=float,
+        default=0.0,
+        help='Price per 1M input tokens (USD) for the openai backend'
+    )
+
+    parser.add_argument(
+        '--openai_output_price',
+        type=float,
+        default=0.0,
+        help='Price per 1M output tokens (USD) for the openai backend'
+    )
+
+
+def requires_gemini_key(args, stages: List[str]) -> bool:
+    """Whether a Gemini API key is needed: some stage uses the gemini backend and nothing is replayed."""
+    if getattr(args, 'replay_cassette', None):
+        return False
+    return any(getattr(args, f'{stage}_backend') == 'gemini' for stage in stages)
+
+
+def create_backend(kind: str, args, model_type: str = 'pro') -> LLMBackend:
+    """Create a backend of the given kind from parsed command line arguments."""
+    if kind == 'gemini':
+        return GeminiBackend(args.api_key, model_type)
+    if kind == 'openai':
+        if not args.openai_model:
+            raise ValueError("--openai_model is required when using the openai backend")
+        return OpenAICompatibleBackend(
+            args.openai_base_url,
+            args.openai_model,
+            api_key=args.openai_api_key,
+            input_price=args.openai_input_price,
+            output_price=args.openai_output_price
+        )
+    raise ValueError(f"Unknown backend: {kind}")
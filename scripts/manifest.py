@@ -0,0 +1,103 @@
+"""
+Per-submission preprocessing manifest for incremental re-runs.
+
+processed/manifest.json records the source files of a submission (path, size,
+mtime) and, for every file that was converted, its content hash and the
+outputs it produced. A later run compares the manifest with the submission:
+
+- nothing changed: the submission is skipped without extracting anything,
+- files were added or changed: only those are converted again,
+- files disappeared: their outputs are deleted.
+
+The input fingerprint is a hash of the converted files' contents and of the
+preprocessing settings. It changes only when the inputs of parsing change, so
+parse and grade results made from another fingerprint are known to be stale.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pdf_analysis import file_digest
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+# Fields of a file entry that are carried over while the file is unchanged
+OUTPUT_KEYS = ('name', 'textual', 'visual', 'scanned_pdf', 'page_modality', 'dropped_images', 'decisions')
+
+
+def scan_sources(submission_dir: Path) -> Dict[str, Dict]:
+    """Size and mtime of every file of a submission outside processed/, by relative path."""
+    sources = {}
+    for item in submission_dir.rglob('*'):
+        if item.is_file() and 'processed' not in item.parts:
+            stat = item.stat()
+            sources[str(item.relative_to(submission_dir))] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return sources
+
+
+def input_fingerprint(settings: Dict, files: Dict[str, Dict]) -> str:
+    """Hash of the preprocessing settings and of the content of every converted file."""
+    material = json.dumps({
+        'settings': settings,
+        'files': sorted((origin, entry['sha256']) for origin, entry in files.items())
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class SubmissionManifest:
+    """Sources, settings and per-file outputs of the last successful preprocessing run."""
+
+    def __init__(self, settings: Dict, sources: Dict[str, Dict], files: Dict[str, Dict]):
+        self.settings = settings
+        self.sources = sources
+        # Source file (relative path, archive members as <archive>/<member>) -> hash and outputs
+        self.files = files
+
+    @classmethod
+    def load(cls, processed_dir: Path) -> Optional['SubmissionManifest']:
+        path = processed_dir / MANIFEST_NAME
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != MANIFEST_VERSION:
+            logger.info(f"Ignoring manifest {path} of version {data.get('version')}")
+            return None
+        return cls(data['settings'], data['sources'], data['files'])
+
+    @property
+    def fingerprint(self) -> str:
+        return input_fingerprint(self.settings, self.files)
+
+    def digest(self, origin: str, file_path: Path) -> str:
+        """Content hash of a file, taken from the manifest while its size and mtime are unchanged."""
+        entry = self.files.get(origin)
+        stat = file_path.stat()
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+        return file_digest(file_path)
+
+    @staticmethod
+    def outputs(entry: Dict) -> List[str]:
+        """Outputs of a file, relative to the submission directory."""
+        return entry['textual'] + entry['visual']
+
+    def save(self, processed_dir: Path):
+        path = processed_dir / MANIFEST_NAME
+        temp_path = path.with_name(f".{MANIFEST_NAME}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'settings': self.settings,
+                'input_fingerprint': self.fingerprint,
+                'sources': self.sources,
+                'files': self.files
+            }, f, indent=2)
+        os.replace(temp_path, path)
@@ -0,0 +1,342 @@
+"""
+Prometheus-format metrics for preprocessing and grading runs.
+
+A small self-contained registry of counters, gauges and histograms rendered in
+the Prometheus text exposition format. Metrics can be served on a local HTTP
+port (/metrics) or written periodically to a node-exporter textfile, so long
+grading runs can be watched with the same dashboards and alerts as other
+services.
+"""
+
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class of a metric family with optional labels."""
+
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, **labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _default(self):
+        """Child used when the metric has no labels."""
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+    def _items(self):
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), child) for key, child in sorted(self._children.items())]
+
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def _samples(self):
+        if not self.labelnames and not self._children:
+            self._default()
+        return [('', labels, child.value) for labels, child in self._items()]
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    metric_type = 'gauge'
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Histogram(_Metric):
+    """Histogram with fixed upper bucket bounds."""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _samples(self):
+        samples = []
+        for labels, child in self._items():
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+UPLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONVERTER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+SUBMISSIONS = REGISTRY.register(Counter(
+    'llmautograde_submissions_total', 'Submissions finished per stage and status', ['stage', 'status']))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'llmautograde_in_flight', 'Submissions currently being processed per stage', ['stage']))
+GENERATE_SECONDS = REGISTRY.register(Histogram(
+    'llmautograde_generate_seconds', 'Latency of generate calls (single attempt)', ['stage'], LATENCY_BUCKETS))
+UPLOAD_SECONDS = REGISTRY.register(Histogram(
+    'llmautograde_upload_seconds', 'Latency of file uploads', ['stage'], UPLOAD_BUCKETS))
+TOKENS = REGISTRY.register(Counter(
+    'llmautograde_tokens_total', 'Tokens sent to and received from models', ['model', 'direction']))
+COST_USD = REGISTRY.register(Counter(
+    'llmautograde_cost_usd_total', 'Cumulative API cost in USD', ['model']))
+RETRIES = REGISTRY.register(Counter(
+    'llmautograde_retries_total', 'Retried API calls', ['stage']))
+API_ERRORS = REGISTRY.register(Counter(
+    'llmautograde_api_errors_total', 'Failed API call attempts by status code', ['stage', 'code']))
+CONVERTER_SECONDS = REGISTRY.register(Histogram(
+    'llmautograde_converter_seconds', 'Duration of preprocessing converter subprocesses', ['tool'], CONVERTER_BUCKETS))
+CONVERTER_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    'llmautograde_converter_queue_seconds', 'Time converter subprocesses waited for a slot per resource class',
+    ['resource_class'], CONVERTER_BUCKETS))
+CONVERTERS_RUNNING = REGISTRY.register(Gauge(
+    'llmautograde_converters_running', 'Converter subprocesses running per resource class', ['resource_class']))
+CONVERTERS_QUEUED = REGISTRY.register(Gauge(
+    'llmautograde_converters_queued', 'Converter subprocesses waiting for a slot per resource class', ['resource_class']))
+
+
+def record_usage(model: str, prompt_tokens: int, completion_tokens: int, cost: float):
+    """Count tokens and cost of a generate call."""
+    TOKENS.labels(model=model, direction='in').inc(prompt_tokens)
+    TOKENS.labels(model=model, direction='out').inc(completion_tokens)
+    COST_USD.labels(model=model).inc(cost)
+
+
+@contextmanager
+def track_in_flight(stage: str):
+    """Count the block as one in-flight item of a stage."""
+    gauge = IN_FLIGHT.labels(stage=stage)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_textfile(path: Path, registry: Registry = REGISTRY):
+    """Atomically write the metrics in node-exporter textfile format."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """Serves metrics over HTTP and/or writes them to a textfile periodically."""
+
+    def __init__(self, port: Optional[int] = None, textfile: Optional[Path] = None, interval: float = 15.0,
+                 host: str = '127.0.0.1'):
+        self.port = port
+        # Run progress and costs are only served locally unless another address is chosen
+        self.host = host
+        self.textfile = textfile
+        self.interval = interval
+        self._server = None
+        self._stop = threading.Event()
+        self._writer = None
+
+    def start(self) -> 'MetricsExporter':
+        if self.port is not None:
+            self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+            logger.info(f"Serving metrics on http://{self.host}:{self._server.server_port}/metrics")
+        if self.textfile is not None:
+            self._writer = threading.Thread(target=self._write_loop, name='metrics-textfile', daemon=True)
+            self._writer.start()
+            logger.info(f"Writing metrics to {self.textfile} every {self.interval:.0f}s")
+        return self
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                write_textfile(self.textfile)
+            except OSError as e:
+                logger.warning(f"Failed to write metrics textfile: {e}")
+
+    def stop(self):
+        """Stop exporting, writing the textfile one final time."""
+        self._stop.set()
+        if self.textfile is not None:
+            write_textfile(self.textfile)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def add_metrics_arguments(parser):
+    """Add metrics export arguments to an argparse parser."""
+    parser.add_argument(
+        '--metrics_port',
+        type=int,
+        default=None,
+        help='Serve Prometheus metrics on this local HTTP port'
+    )
+    parser.add_argument(
+        '--metrics_host',
+        default='127.0.0.1',
+        help='Address the metrics port is bound to; use 0.0.0.0 to allow remote scraping (default: 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--metrics_textfile',
+        type=Path,
+        default=None,
+        help='Periodically write Prometheus metrics to this node-exporter textfile (.prom)'
+    )
+
+
+def start_metrics_export(args) -> Optional[MetricsExporter]:
+    """Start metrics export if requested on the command line."""
+    port = getattr(args, 'metrics_port', None)
+    textfile = getattr(args, 'metrics_textfile', None)
+    if port is None and textfile is None:
+        return None
+    return MetricsExporter(port, textfile, host=getattr(args, 'metrics_host', '127.0.0.1')).start()
@@ -0,0 +1,153 @@
+"""
+In-process renderer for Jupyter notebooks.
+
+Reads the notebook JSON directly instead of going through nbconvert and LaTeX:
+markdown cells, code cells and their text outputs are written to one markdown
+file, and image outputs (base64 PNG/JPEG/SVG, including markdown cell
+attachments) are decoded into image files. No subprocess, no PDF round trip.
+"""
+
+import re
+import json
+import base64
+import logging
+from pathlib import Path
+from typing import List, Tuple, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Preferred MIME type first; only one representation of every output is kept
+IMAGE_MIME_TYPES = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/svg+xml': '.svg'
+}
+TEXT_MIME_TYPES = ['text/markdown', 'text/plain', 'text/latex']
+MAX_OUTPUT_LINES = 200
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+
+class NotebookRenderError(Exception):
+    """The notebook could not be read."""
+
+
+def _text(value) -> str:
+    """Notebook strings are either a string or a list of lines."""
+    if isinstance(value, list):
+        return ''.join(value)
+    return value or ''
+
+
+def _truncate(text: str) -> str:
+    lines = text.rstrip('\n').split('\n')
+    if len(lines) > MAX_OUTPUT_LINES:
+        omitted = len(lines) - MAX_OUTPUT_LINES
+        lines = lines[:MAX_OUTPUT_LINES] + [f"... ({omitted} more lines)"]
+    return '\n'.join(lines)
+
+
+def _fenced(text: str, language: str = '') -> str:
+    fence = '```'
+    while fence in text:
+        fence += '`'
+    return f"{fence}{language}\n{text}\n{fence}"
+
+
+class _Renderer:
+    def __init__(self, notebook_path: Path, visual_dir: Path):
+        self.notebook_path = notebook_path
+        self.visual_dir = visual_dir
+        self.images: List[Path] = []
+
+    def save_image(self, data, mime_type: str, name: str) -> Path:
+        image_path = self.visual_dir / f"{self.notebook_path.stem}_{name}{IMAGE_MIME_TYPES[mime_type]}"
+        if mime_type == 'image/svg+xml':
+            image_path.write_text(_text(data), encoding='utf-8')
+        else:
+            image_path.write_bytes(base64.b64decode(_text(data)))
+        self.images.append(image_path)
+        return image_path
+
+    def image_reference(self, image_path: Path) -> str:
+        return f"![{image_path.name}](visual/{image_path.name})"
+
+    def render_output(self, output: Dict[str, Any], name: str) -> str:
+        output_type = output.get('output_type')
+        if output_type == 'stream':
+            return _fenced(_truncate(ANSI_ESCAPE.sub('', _text(output.get('text')))), 'text')
+        if output_type == 'error':
+            traceback = '\n'.join(output.get('traceback') or []) or f"{output.get('ename')}: {output.get('evalue')}"
+            return _fenced(_truncate(ANSI_ESCAPE.sub('', traceback)), 'text')
+        if output_type in ('execute_result', 'display_data'):
+            data = output.get('data') or {}
+            for mime_type in IMAGE_MIME_TYPES:
+                if mime_type in data:
+                    return self.image_reference(self.save_image(data[mime_type], mime_type, name))
+            for mime_type in TEXT_MIME_TYPES:
+                if mime_type in data:
+                    text = _truncate(_text(data[mime_type]))
+                    return text if mime_type == 'text/markdown' else _fenced(text, 'text')
+            if 'text/html' in data:
+                return _fenced(_truncate(_text(data['text/html'])), 'html')
+        return ''
+
+    def render_cell(self, cell: Dict[str, Any], index: int, language: str) -> List[str]:
+        cell_type = cell.get('cell_type')
+        source = _text(cell.get('source'))
+        parts = []
+        if cell_type == 'markdown':
+            for attachment_name, bundle in (cell.get('attachments') or {}).items():
+                for mime_type in IMAGE_MIME_TYPES:
+                    if mime_type in bundle:
+                        image_path = self.save_image(bundle[mime_type], mime_type, f"cell{index:03d}_{Path(attachment_name).stem}")
+                        source = source.replace(f"attachment:{attachment_name}", f"visual/{image_path.name}")
+                        break
+            parts.append(source)
+        elif cell_type == 'code':
+            parts.append(f"**In [{cell.get('execution_count') or ' '}]:**")
+            parts.append(_fenced(source, language))
+            for output_index, output in enumerate(cell.get('outputs') or []):
+                rendered = self.render_output(output, f"cell{index:03d}_out{output_index}")
+                if rendered:
+                    parts.append(rendered)
+        elif cell_type == 'raw' and source.strip():
+            parts.append(_fenced(source))
+        return parts
+
+
+def render_notebook(notebook_path: Path, textual_dir: Path, visual_dir: Path) -> Tuple[Path, List[Path]]:
+    """
+    Render a notebook to textual_dir/<stem>_from_ipynb.md with its image outputs in visual_dir.
+    Returns (markdown_path, image_paths).
+    """
+    try:
+        with open(notebook_path, 'r', encoding='utf-8') as f:
+            notebook = json.load(f)
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise NotebookRenderError(f"Cannot read notebook {notebook_path.name}: {e}")
+
+    if not isinstance(notebook, dict) or not isinstance(notebook.get('cells'), list):
+        # nbformat 3 and older keep cells in worksheets
+        raise NotebookRenderError(f"Unsupported notebook format in {notebook_path.name} "
+                                  f"(nbformat {notebook.get('nbformat') if isinstance(notebook, dict) else '?'})")
+
+    metadata = notebook.get('metadata') or {}
+    language = ((metadata.get('language_info') or {}).get('name')
+                or (metadata.get('kernelspec') or {}).get('language') or '')
+
+    renderer = _Renderer(notebook_path, visual_dir)
+    sections = [f"# Notebook: {notebook_path.name}"]
+    try:
+        for index, cell in enumerate(notebook['cells']):
+            sections.extend(renderer.render_cell(cell, index, language))
+    except (ValueError, TypeError, AttributeError) as e:
+        # Malformed cell or base64 payload: leave no partial output behind
+        for image_path in renderer.images:
+            image_path.unlink(missing_ok=True)
+        raise NotebookRenderError(f"Malformed notebook {notebook_path.name}: {e}")
+
+    markdown_path = textual_dir / f"{notebook_path.stem}_from_ipynb.md"
+    markdown_path.write_text('\n\n'.join(sections) + '\n', encoding='utf-8')
+    logger.info(f"Rendered {notebook_path.name}: {len(notebook['cells'])} cells, {len(renderer.images)} images")
+    return markdown_path, renderer.images
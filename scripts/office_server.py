@@ -0,0 +1,256 @@
+"""
+Pool of persistent headless LibreOffice instances for office-to-PDF conversion.
+
+A cold `libreoffice --headless --convert-to pdf` costs seconds of startup per
+file, and concurrent instances sharing the default user profile fail or
+serialize. OfficePool keeps N long-lived listeners, each with its own
+-env:UserInstallation profile, and drives them over a UNO pipe connection.
+Conversion throughput scales with the number of listeners.
+
+The UNO Python bindings (python3-uno) are optional. Without them every slot of
+the pool still has its own profile, but converts with a cold-started
+`--convert-to pdf` process.
+
+A listener is health-checked before every conversion. It is restarted if its
+process died, it stops answering on the pipe, a conversion exceeds its timeout,
+or it has served `recycle_after` documents.
+"""
+
+import os
+import time
+import queue
+import shutil
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+except ImportError:
+    uno = None
+
+logger = logging.getLogger(__name__)
+
+OFFICE_BINARY = 'libreoffice'
+
+# PDF export filter per document service
+PDF_FILTERS = [
+    ('com.sun.star.presentation.PresentationDocument', 'impress_pdf_Export'),
+    ('com.sun.star.sheet.SpreadsheetDocument', 'calc_pdf_Export'),
+    ('com.sun.star.drawing.DrawingDocument', 'draw_pdf_Export'),
+]
+DEFAULT_PDF_FILTER = 'writer_pdf_Export'
+
+
+class OfficeConversionError(Exception):
+    """LibreOffice could not convert a document."""
+
+
+def uno_available() -> bool:
+    return uno is not None
+
+
+def _properties(**values):
+    properties = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        properties.append(prop)
+    return tuple(properties)
+
+
+def _pdf_filter(document) -> str:
+    for service, filter_name in PDF_FILTERS:
+        if document.supportsService(service):
+            return filter_name
+    return DEFAULT_PDF_FILTER
+
+
+class OfficeListener:
+    """One headless LibreOffice instance with a private user profile."""
+
+    def __init__(self, index: int, profile_root: Path, startup_timeout: float = 60):
+        self.index = index
+        self.profile_dir = profile_root / f"profile_{index}"
+        self.pipe_name = f"llmautograde_office_{os.getpid()}_{index}"
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.conversions = 0
+
+    @property
+    def profile_url(self) -> str:
+        return self.profile_dir.resolve().as_uri()
+
+    def start(self):
+        self.process = subprocess.Popen([
+            OFFICE_BINARY, '--headless', '--invisible', '--nologo', '--norestore',
+            '--nodefault', '--nolockcheck',
+            f'-env:UserInstallation={self.profile_url}',
+            f'--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext'
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        self.desktop = self._connect(self.startup_timeout)
+        self.conversions = 0
+        logger.info(f"Started LibreOffice listener {self.index} (PID: {self.process.pid})")
+
+    def _connect(self, timeout: float):
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context
+        )
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                context = resolver.resolve(f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+            except NoConnectException:
+                if self.process.poll() is not None:
+                    raise OfficeConversionError(f"LibreOffice listener {self.index} exited during startup")
+                if time.monotonic() > deadline:
+                    raise OfficeConversionError(f"LibreOffice listener {self.index} did not start within {timeout}s")
+                time.sleep(0.25)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+        self.process = None
+        self.desktop = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def healthy(self, timeout: float = 10) -> bool:
+        """The process is alive and answers on its pipe."""
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.desktop = self._call_with_timeout(lambda: self._connect(timeout), timeout)
+            return True
+        except Exception:
+            return False
+
+    def _call_with_timeout(self, func: Callable, timeout: float):
+        """Run a blocking UNO call on a helper thread; UNO calls have no timeout of their own."""
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = func()
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=target, name=f'office-{self.index}', daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            raise subprocess.TimeoutExpired(f"LibreOffice listener {self.index}", timeout)
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+
+    def _convert(self, source: Path, output_path: Path):
+        document = self.desktop.loadComponentFromURL(
+            source.resolve().as_uri(), '_blank', 0, _properties(Hidden=True, ReadOnly=True)
+        )
+        if document is None:
+            raise OfficeConversionError(f"LibreOffice could not load {source.name}")
+        try:
+            document.storeToURL(output_path.resolve().as_uri(), _properties(FilterName=_pdf_filter(document)))
+        finally:
+            document.close(True)
+
+    def convert(self, source: Path, output_path: Path, timeout: float):
+        self.conversions += 1
+        self._call_with_timeout(lambda: self._convert(source, output_path), timeout)
+
+
+class OfficePool:
+    """Fixed number of LibreOffice slots shared by all worker threads."""
+
+    def __init__(self, size: int, recycle_after: int = 200):
+        self.size = size
+        self.recycle_after = recycle_after
+        self.use_uno = uno_available()
+        self.profile_root = Path(tempfile.mkdtemp(prefix='llmautograde_office_'))
+        self._slots: queue.Queue = queue.Queue()
+        self._listeners = []
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            if not self.use_uno:
+                logger.warning("python3-uno is not available - LibreOffice pool falls back to one cold-started "
+                               "process per conversion, each slot with its own profile")
+            for index in range(self.size):
+                listener = OfficeListener(index, self.profile_root)
+                if self.use_uno:
+                    try:
+                        listener.start()
+                    except OfficeConversionError as e:
+                        # Started again by the health check on first use
+                        logger.warning(str(e))
+                        listener.stop()
+                self._listeners.append(listener)
+                self._slots.put(listener)
+
+    def convert(self, source: Path, output_path: Path, timeout: float = 300,
+                run: Callable = subprocess.run):
+        """
+        Convert an office document to output_path (PDF) on a free slot, blocking until one is available.
+        `run` executes the cold-start command when UNO is unavailable (same signature as subprocess.run).
+        """
+        self._start()
+        listener = self._slots.get()
+        try:
+            if not self.use_uno:
+                self._convert_cold(listener, source, output_path, timeout, run)
+                return
+
+            if listener.conversions >= self.recycle_after or not listener.healthy():
+                logger.info(f"Restarting LibreOffice listener {listener.index}")
+                listener.restart()
+            try:
+                listener.convert(source, output_path, timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"LibreOffice listener {listener.index} hung on {source.name} - restarting it")
+                listener.restart()
+                raise
+        finally:
+            self._slots.put(listener)
+
+    def _convert_cold(self, listener: OfficeListener, source: Path, output_path: Path, timeout: float, run: Callable):
+        with tempfile.TemporaryDirectory(dir=self.profile_root, prefix=f"out_{listener.index}_") as out_dir:
+            run([
+                OFFICE_BINARY, f'-env:UserInstallation={listener.profile_url}',
+                '--headless', '--convert-to', 'pdf', '--outdir', out_dir, str(source)
+            ], check=True, capture_output=True, timeout=timeout)
+            produced = Path(out_dir) / f"{source.stem}.pdf"
+            if not produced.exists():
+                raise OfficeConversionError(f"LibreOffice produced no PDF for {source.name}")
+            shutil.move(str(produced), str(output_path))
+
+    def pids(self) -> set:
+        """PIDs of the running listener processes."""
+        return {listener.process.pid for listener in self._listeners
+                if listener.process is not None and listener.process.poll() is None}
+
+    def shutdown(self):
+        for listener in self._listeners:
+            listener.stop()
+        shutil.rmtree(self.profile_root, ignore_errors=True)
@@ -4,15 +4,14 @@ import os
 import sys
 import json
 import time
-import glob
 import shutil
 import argparse
-import subprocess
 from pathlib import Path
-import google.generativeai as genai
-from PyPDF2 import PdfReader
 from typing import List, Dict, Any
 from prompts import solution_extract_instruction, solution_parse_instruction, solution_parse_format_desc, solution_parse_fix_mistakes_instruction
+from llm_backends import LLMBackend, add_backend_arguments, create_backend, requires_gemini_key
+from cassette import add_cassette_arguments, open_cassette, apply_cassette
+from pdf_analysis import PdfAnalysis, analyze_pdf
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
@@ -43,8 +42,8 @@ def parse_arguments():
     
     parser.add_argument(
         '--api_key',
-        required=True,
-        help='Gemini API key'
+        default=None,
+        help='Gemini API key (required for the gemini backend unless replaying a cassette)'
     )
     
     # Optional arguments
@@ -55,6 +54,9 @@ def parse_arguments():
         help='Base directory for output files'
     )
     
+    add_backend_arguments(parser, ['parse'])
+    add_cassette_arguments(parser)
+    
     args = parser.parse_args()
     
     # Validate input files exist
@@ -62,8 +64,8 @@ def parse_arguments():
         parser.error(f"Solution PDF file not found: {args.solution_pdf}")
     if not args.structure_hint.exists():
         parser.error(f"Structure hint file not found: {args.structure_hint}")
-    if not args.api_key:
-        parser.error(f"API key not provided")
+    if not args.api_key and requires_gemini_key(args, ['parse']):
+        parser.error("--api_key is required for the gemini backend")
     
     return args
 
@@ -76,50 +78,21 @@ def move_files(source_path: Path, dest_path: Path):
     """Move files to their destination."""
     shutil.move(str(source_path), str(dest_path))
 
-def get_pdf_page_count(pdf_path: Path) -> int:
-    """Get the number of pages in a PDF file."""
-    with open(pdf_path, 'rb') as file:
-        pdf = PdfReader(file)
-        return len(pdf.pages)
-
-def convert_pdf_to_images(pdf_path: Path, pages_dir: Path, num_pages: int):
+def convert_pdf_to_images(analysis: PdfAnalysis, pages_dir: Path):
     """Convert PDF pages to images."""
-    
-    for i in range(1, num_pages + 1):
-        output_prefix = pages_dir / "model_solution_page_tmp"
-        subprocess.run([
-            "pdftoppm",
-            "-png",
-            "-f", str(i),
-            "-l", str(i),
-            str(pdf_path),
-            str(output_prefix)
-        ], check=True)
-        
-        # pdftoppm uses zero-padded page numbers when there are >= 10 pages
-        if num_pages >= 10:
-            page_suffix = f"{i:02d}"
-        else:
-            page_suffix = str(i)
-        
-        old_name = f"{output_prefix}-{page_suffix}.png"
-        new_name = pages_dir / f"model_solution_page_{i}.png"
-        
-        # Check if the expected file exists, if not try to find it with glob
-        if not os.path.exists(old_name):
-            # Fallback: search for any file matching the pattern
-            pattern = f"{output_prefix}-*{i}.png"
-            matching_files = glob.glob(pattern)
-            if matching_files:
-                old_name = matching_files[0]
-            else:
-                raise FileNotFoundError(f"Could not find generated image file for page {i}")
-        
-        os.rename(old_name, new_name)
+    rendered = analysis.rasterize(
+        range(1, analysis.page_count + 1), pages_dir, "model_solution_page_tmp", dpi=150, image_format='png',
+        workers=min(4, os.cpu_count() or 1)
+    )
+    for page_number, image_path in rendered:
+        image_path.rename(pages_dir / f"model_solution_page_{page_number}.png")
 
-def extract_text_from_pdf(pdf_path: Path, text_file: Path):
+def extract_text_from_pdf(analysis: PdfAnalysis, text_file: Path):
     """Extract text from PDF file."""
-    subprocess.run(["pdftotext", str(pdf_path), str(text_file)], check=True)
+    if not analysis.text_available:
+        raise RuntimeError(f"pdftotext could not extract text from {analysis.path.name}")
+    with open(text_file, 'w', encoding='utf-8') as f:
+        f.write(analysis.text)
 
 def create_json_output(assignment_id: str, assignment_dir: Path, pdf_basename: str, 
                       text_file: Path, structure_hint_basename: str, 
@@ -151,11 +124,13 @@ def update_json_with_parsed_solution(assignment_dir: Path, parsed_solution_path:
     with open(json_file, 'w') as f:
         json.dump(json_data, f, indent=2)
 
-def configure_gemini(api_key: str):
-    """Configure Gemini API."""
-    print("[1/7] Configuring Gemini API...")
-    genai.configure(api_key=api_key)
-    print("    Gemini API configured.")
+def configure_backend(args, cassette=None) -> LLMBackend:
+    """Create the LLM backend used for solution parsing, recording or replaying with a cassette."""
+    print("[1/7] Configuring LLM backend...")
+    backend = None if args.replay_cassette else create_backend(args.parse_backend, args, 'pro')
+    backend = apply_cassette(backend, cassette, 'solution', args)
+    print(f"    LLM backend configured: {backend.describe()}")
+    return backend
 
 def get_solution_metadata(solution_dir: Path) -> Dict[str, Any]:
     """Load the parsed solution info from JSON file."""
@@ -174,13 +149,13 @@ def read_structure_hint(hint_path: Path) -> str:
     print("    Structure hint loaded.")
     return hint
 
-def extract_markdown_from_pdf(pdf_path: Path, pro_model) -> str:
-    """Extract markdown from the PDF file using Gemini Pro model."""
+def extract_markdown_from_pdf(pdf_path: Path, backend: LLMBackend) -> str:
+    """Extract markdown from the PDF file using the parse backend."""
     print(f"[4/7] Uploading PDF file for extraction: {pdf_path} ...")
-    pdf_file = genai.upload_file(str(pdf_path))
-    print("    PDF file uploaded. Generating markdown from PDF using Gemini Pro model...")
+    pdf_file = backend.upload(pdf_path)
+    print(f"    PDF file uploaded. Generating markdown from PDF using {backend.describe()}...")
     start_time = time.time()
-    response = pro_model.generate_content(
+    response = backend.generate(
         [
             solution_extract_instruction,
             pdf_file
@@ -195,18 +170,18 @@ def enhance_markdown_with_images(
     markdown_path: Path,
     image_paths: List[str],
     structure_hint: str,
-    pro_model
+    backend: LLMBackend
 ) -> str:
-    """Enhance the markdown file using images and structure hint with Gemini Pro model."""
+    """Enhance the markdown file using images and structure hint with the parse backend."""
     print(f"[5/7] Uploading markdown file: {markdown_path} ...")
-    markdown_file = genai.upload_file(str(markdown_path))
+    markdown_file = backend.upload(markdown_path)
     print("    Markdown file uploaded.")
 
     print(f"[6/7] Uploading {len(image_paths)} image(s)...")
     image_files = []
     for idx, img_path in enumerate(image_paths):
         print(f"        Uploading image {idx+1}/{len(image_paths)}: {img_path}")
-        image_files.append(genai.upload_file(img_path))
+        image_files.append(backend.upload(Path(img_path)))
     print("    All images uploaded.")
 
     full_instruction = (
@@ -217,11 +192,11 @@ def enhance_markdown_with_images(
         + solution_parse_fix_mistakes_instruction
     )
 
-    print("    Generating enhanced markdown with Gemini Pro model...")
+    print(f"    Generating enhanced markdown with {backend.describe()}...")
     inputs = [full_instruction, markdown_file] + image_files
 
     start_time = time.time()
-    response = pro_model.generate_content(inputs)
+    response = backend.generate(inputs)
     elapsed = time.time() - start_time
     print(f"    Enhanced markdown generated. (Generation took {elapsed:.2f} seconds)")
     print("    Usage metadata for markdown enhancement:", getattr(response, "usage_metadata", None))
@@ -247,14 +222,15 @@ def process_and_parse_solution(args):
     
     # Process PDF
     pdf_path = assignment_dir / pdf_basename
-    num_pages = get_pdf_page_count(pdf_path)
+    analysis = analyze_pdf(pdf_path)
+    num_pages = analysis.page_count
     
     # Convert PDF to images
-    convert_pdf_to_images(pdf_path, pages_dir, num_pages)
+    convert_pdf_to_images(analysis, pages_dir)
     
     # Extract text
     text_file = assignment_dir / "solution_text.txt"
-    extract_text_from_pdf(pdf_path, text_file)
+    extract_text_from_pdf(analysis, text_file)
     
     # Create JSON output
     create_json_output(
@@ -269,13 +245,9 @@ def process_and_parse_solution(args):
     
     print("========== Starting Solution Parsing ==========")
     
-    # Configure Gemini
-    configure_gemini(args.api_key)
-    
-    # Initialize models
-    print("[*] Initializing Gemini models...")
-    pro_model = genai.GenerativeModel('gemini-2.5-pro-preview-05-06')
-    print("    Gemini Pro model initialized.")
+    # Configure the LLM backend
+    cassette = open_cassette(args)
+    backend = configure_backend(args, cassette)
 
     # Load metadata and structure hint
     solution_info = get_solution_metadata(assignment_dir)
@@ -283,7 +255,7 @@ def process_and_parse_solution(args):
 
     # Step 1: Extract markdown from PDF and save to file
     print("[3/7] Extracting markdown from PDF and saving to file...")
-    markdown_text = extract_markdown_from_pdf(Path(solution_info['solution_pdf']), pro_model)
+    markdown_text = extract_markdown_from_pdf(Path(solution_info['solution_pdf']), backend)
     markdown_path = assignment_dir / "extracted_solution_text.md"
     with open(markdown_path, 'w', encoding='utf-8') as f:
         f.write(markdown_text)
@@ -295,7 +267,7 @@ def process_and_parse_solution(args):
         markdown_path,
         solution_info['solution_images'],
         structure_hint,
-        pro_model
+        backend
     )
 
     # Write the final result
@@ -308,6 +280,9 @@ def process_and_parse_solution(args):
     update_json_with_parsed_solution(assignment_dir, output_path)
     
     print(f"Solution written to {output_path}")
+    if cassette is not None:
+        cassette.close()
+        print(f"Cassette {cassette.path}: {cassette.interactions} interactions")
     print("========== Solution Processing and Parsing Complete ==========")
 
 def main():
@@ -0,0 +1,288 @@
+"""
+Single-pass PDF analysis shared by preprocessing and solution parsing.
+
+A PdfAnalysis is built once per PDF content (sha256) and cached: the page count
+and page sizes come from one PyPDF2 read, the text of every page from one
+pdftotext run split on form feeds. Pages are only rasterized when a caller asks
+for them.
+
+Pages can be classified by modality: a page with a dense, clean text layer and
+little raster image area is sent to the model as text, everything else (scans,
+handwriting, figures) as an image.
+"""
+
+import hashlib
+import logging
+import threading
+import subprocess
+import concurrent.futures
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Tuple, Optional, Iterable, Callable
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 32
+POINTS_PER_INCH = 72
+
+# Page modality thresholds: a full page of typed text is around 30 characters per square inch
+MIN_TEXT_DENSITY = 8.0
+MIN_ALNUM_RATIO = 0.7
+MAX_IMAGE_COVERAGE = 0.3
+
+
+def default_run(tool: str, cmd: List[str], **kwargs) -> subprocess.CompletedProcess:
+    """Runner used when the caller does not account subprocesses itself."""
+    return subprocess.run(cmd, **kwargs)
+
+
+def default_call(func: Callable, *args):
+    """Caller used when the caller has no process pool for CPU work."""
+    return func(*args)
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def page_sizes(path: str) -> List[Tuple[float, float]]:
+    """(width, height) in points of every page, as displayed (rotation applied)."""
+    import PyPDF2
+
+    sizes = []
+    with open(path, 'rb') as pdf_file:
+        for page in PyPDF2.PdfReader(pdf_file).pages:
+            width, height = float(page.mediabox.width), float(page.mediabox.height)
+            if (page.get('/Rotate') or 0) % 180:
+                width, height = height, width
+            sizes.append((width, height))
+    return sizes
+
+
+class PageInfo:
+    """Text and geometry of one page."""
+
+    def __init__(self, number: int, width: float, height: float, text: str):
+        self.number = number
+        self.width = width
+        self.height = height
+        self.text = text
+        cleaned = ' '.join(text.split())
+        self.text_chars = len(cleaned)
+        self.alnum_ratio = (sum(c.isalnum() or c.isspace() for c in cleaned) / len(cleaned)) if cleaned else 0.0
+        # Fraction of the page covered by raster images, None until measured
+        self.image_coverage: Optional[float] = None
+
+    @property
+    def area_sq_inches(self) -> float:
+        return (self.width / POINTS_PER_INCH) * (self.height / POINTS_PER_INCH)
+
+    @property
+    def text_density(self) -> float:
+        """Characters of text per square inch; a full page of typed text is around 30."""
+        area = self.area_sq_inches
+        return self.text_chars / area if area > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'page': self.number,
+            'width_pt': round(self.width, 1),
+            'height_pt': round(self.height, 1),
+            'text_chars': self.text_chars,
+            'text_density': round(self.text_density, 2),
+            'image_coverage': round(self.image_coverage, 3) if self.image_coverage is not None else None
+        }
+
+
+def page_modality(page: PageInfo) -> Tuple[str, str]:
+    """Return ('text' | 'image', reason) for a page."""
+    if page.text_density < MIN_TEXT_DENSITY:
+        return 'image', 'sparse text layer'
+    if page.alnum_ratio <= MIN_ALNUM_RATIO:
+        return 'image', 'garbled text layer'
+    if page.image_coverage is not None and page.image_coverage > MAX_IMAGE_COVERAGE:
+        return 'image', 'image coverage'
+    return 'text', 'text layer'
+
+
+class PdfAnalysis:
+    """Page count, page sizes and per-page text of a PDF, with lazy rasterization."""
+
+    def __init__(self, path: Path, digest: str, pages: List[PageInfo], text_available: bool):
+        self.path = path
+        self.digest = digest
+        self.pages = pages
+        self.text_available = text_available
+
+    def for_path(self, path: Path) -> 'PdfAnalysis':
+        """The same analysis bound to another copy of the file."""
+        if path == self.path:
+            return self
+        return PdfAnalysis(path, self.digest, self.pages, self.text_available)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    @property
+    def text(self) -> str:
+        return '\f'.join(page.text for page in self.pages)
+
+    @classmethod
+    def build(cls, path: Path, digest: Optional[str] = None, run: Callable = default_run,
+              call: Callable = default_call) -> 'PdfAnalysis':
+        digest = digest or file_digest(path)
+        sizes = call(page_sizes, str(path))
+
+        texts = [''] * len(sizes)
+        text_available = False
+        try:
+            result = run('pdftotext', ['pdftotext', str(path), '-'],
+                         capture_output=True, text=True, timeout=120)
+            if result.returncode == 0:
+                # pdftotext ends every page with a form feed
+                page_texts = result.stdout.split('\f')
+                for i in range(min(len(texts), len(page_texts))):
+                    texts[i] = page_texts[i]
+                text_available = True
+            else:
+                logger.warning(f"pdftotext failed for {path.name}: {result.stderr}")
+        except subprocess.TimeoutExpired:
+            logger.warning(f"pdftotext timed out for {path.name}")
+
+        pages = [PageInfo(i + 1, width, height, texts[i]) for i, (width, height) in enumerate(sizes)]
+        return cls(path, digest, pages, text_available)
+
+    def measure_image_coverage(self, run: Callable = default_run):
+        """
+        Set image_coverage of every page from `pdfimages -list` (image sizes and resolutions,
+        nothing is decoded). Coverage stays None if pdfimages fails.
+        """
+        if all(page.image_coverage is not None for page in self.pages):
+            return
+        try:
+            result = run('pdfimages', ['pdfimages', '-list', str(self.path)],
+                         capture_output=True, text=True, timeout=120)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"pdfimages timed out for {self.path.name}")
+            return
+        if result.returncode != 0:
+            logger.warning(f"pdfimages failed for {self.path.name}: {result.stderr}")
+            return
+
+        image_area = [0.0] * self.page_count
+        # Columns: page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+        for line in result.stdout.splitlines()[2:]:
+            fields = line.split()
+            if len(fields) < 14 or fields[2] != 'image':
+                continue
+            try:
+                number, width, height = int(fields[0]), int(fields[3]), int(fields[4])
+                x_ppi, y_ppi = float(fields[12]), float(fields[13])
+            except ValueError:
+                continue
+            if 1 <= number <= self.page_count and x_ppi > 0 and y_ppi > 0:
+                image_area[number - 1] += (width / x_ppi) * (height / y_ppi)
+
+        for page, area in zip(self.pages, image_area):
+            page.image_coverage = min(1.0, area / page.area_sq_inches) if page.area_sq_inches > 0 else 0.0
+
+    def page_name_suffix(self, page_number: int) -> str:
+        """Page number as pdftoppm writes it: zero-padded to the digits of the page count."""
+        return f"{page_number:0{len(str(self.page_count))}d}"
+
+    def scale_to(self, page_number: int, dpi: int, max_pixels: Optional[int]) -> Optional[int]:
+        """pdftoppm -scale-to value for a page whose long side at dpi exceeds max_pixels, else None."""
+        if not max_pixels:
+            return None
+        page = self.pages[page_number - 1]
+        long_side = max(page.width, page.height) / POINTS_PER_INCH * dpi
+        return max_pixels if long_side > max_pixels else None
+
+    def render_runs(self, page_numbers: Iterable[int], dpi: int, max_pixels: Optional[int],
+                    workers: int = 1, min_pages_per_run: int = 4) -> List[Tuple[int, int, Optional[int]]]:
+        """
+        Split pages into (first, last, scale_to) ranges for pdftoppm: consecutive pages with the same
+        scale, and long ranges cut into pieces so that `workers` processes can render them concurrently.
+        """
+        numbers = sorted(set(n for n in page_numbers if 1 <= n <= self.page_count))
+        ranges = []
+        for number in numbers:
+            scale = self.scale_to(number, dpi, max_pixels)
+            if ranges and ranges[-1][1] == number - 1 and ranges[-1][2] == scale:
+                ranges[-1][1] = number
+            else:
+                ranges.append([number, number, scale])
+
+        per_run = max(min_pages_per_run, -(-len(numbers) // max(1, workers)))
+        runs = []
+        for first, last, scale in ranges:
+            for start in range(first, last + 1, per_run):
+                runs.append((start, min(last, start + per_run - 1), scale))
+        return runs
+
+    def rasterize(self, page_numbers: Iterable[int], output_dir: Path, prefix: str, dpi: int = 96,
+                  image_format: str = 'jpeg', max_pixels: Optional[int] = None, workers: int = 1,
+                  run: Callable = default_run, timeout: float = 300) -> List[Tuple[int, Path]]:
+        """
+        Render the given pages to output_dir as <prefix>-<page>.<ext> and return [(page_number, path)].
+        Pages are rendered at dpi, or scaled by pdftoppm so their long side is max_pixels when the dpi
+        would exceed it, so no resize is needed afterwards. Page ranges are rendered by up to `workers`
+        concurrent pdftoppm processes.
+        """
+        numbers = sorted(set(n for n in page_numbers if 1 <= n <= self.page_count))
+        extension = 'jpg' if image_format == 'jpeg' else image_format
+
+        def render(page_range):
+            first, last, scale = page_range
+            cmd = ['pdftoppm', f'-{image_format}', '-f', str(first), '-l', str(last)]
+            cmd += ['-scale-to', str(scale)] if scale else ['-r', str(dpi)]
+            if image_format == 'jpeg':
+                cmd += ['-jpegopt', 'quality=85']
+            run('pdftoppm', cmd + [str(self.path), str(output_dir / prefix)],
+                check=True, capture_output=True, timeout=timeout)
+
+        runs = self.render_runs(numbers, dpi, max_pixels, workers)
+        if workers > 1 and len(runs) > 1:
+            with concurrent.futures.ThreadPoolExecutor(min(workers, len(runs)), thread_name_prefix='pdftoppm') as pool:
+                # list() re-raises the first failure
+                list(pool.map(render, runs))
+        else:
+            for page_range in runs:
+                render(page_range)
+
+        # pdftoppm names pages deterministically (zero-padded to the digits of the page count)
+        rendered = []
+        for number in numbers:
+            image_path = output_dir / f"{prefix}-{self.page_name_suffix(number)}.{extension}"
+            if not image_path.exists():
+                raise FileNotFoundError(f"pdftoppm did not produce page {number} of {self.path.name}")
+            rendered.append((number, image_path))
+        return rendered
+
+
+_cache: 'OrderedDict[str, PdfAnalysis]' = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def analyze_pdf(path: Path, run: Callable = default_run, call: Callable = default_call) -> PdfAnalysis:
+    """Return the analysis of a PDF, reusing the cached one for identical content."""
+    digest = file_digest(path)
+    with _cache_lock:
+        analysis = _cache.get(digest)
+        if analysis is not None:
+            _cache.move_to_end(digest)
+    if analysis is not None:
+        # Same content, possibly another copy of the file: rasterize from the caller's path
+        return analysis.for_path(path)
+
+    analysis = PdfAnalysis.build(path, digest, run, call)
+    with _cache_lock:
+        _cache[digest] = analysis
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return analysis
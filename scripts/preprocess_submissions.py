@@ -5,26 +5,38 @@ Handles various file formats and converts them into a standardized structure
 with separate textual and visual data folders.
 """
 
-import os
 import sys
 import json
 import shutil
-import zipfile
 import tempfile
 import subprocess
 import logging
+import contextlib
 import concurrent.futures
 import signal
 import time
+import threading
 from pathlib import Path
-from typing import List, Dict, Set, Tuple, Optional
-import mimetypes
+from typing import List, Dict, Tuple, Optional
 
 # Required imports - script will fail if not available
-import rarfile
 import psutil
-from PIL import Image
-import PyPDF2
+
+from tracing import tracer
+from progress import progress, add_progress_arguments
+import metrics
+from resource_usage import ResourceUsage, run_with_usage, summarize_usage
+from cpu_pool import CPUPool, resize_image
+from archive_extraction import MemberRules, ExtractionLimits, extract_archive, parse_7z_listing, screen_members, member_path
+from office_server import OfficePool
+from notebook_renderer import render_notebook, NotebookRenderError
+from pdf_analysis import PdfAnalysis, analyze_pdf, file_digest, page_modality, MIN_TEXT_DENSITY, MIN_ALNUM_RATIO, MAX_IMAGE_COVERAGE
+from image_analysis import image_signature, select_redundant, optimize_image, BLANK_INK_COVERAGE, SPECK_PIXELS
+from budget import BudgetPlanner
+from artifact_cache import ArtifactCache, CacheEntry
+from manifest import SubmissionManifest, OUTPUT_KEYS, scan_sources
+from staging import Stager, STAGING_MODES
+from scheduler import SubprocessScheduler, default_classes
 
 # Configure logging
 logging.basicConfig(
@@ -58,8 +70,18 @@ class SubmissionPreprocessor:
         '.odt', '.rtf'
     }
     
+    # Mixed files whose pages are sent as text or images one by one (page modality)
+    PAGED_EXTENSIONS = {
+        '.pdf', '.pptx', '.ppt', '.docx', '.doc', '.odt', '.rtf'
+    }
+    
+    # Mixed files converted to PDF by LibreOffice
+    OFFICE_EXTENSIONS = {
+        '.pptx', '.ppt', '.docx', '.doc', '.odt', '.rtf'
+    }
+    
     ARCHIVE_EXTENSIONS = {
-        '.zip', '.rar', '.7z', '.tar', '.tar.gz', '.tar.bz2', '.gz'
+        '.zip', '.rar', '.7z', '.tar', '.tar.gz', '.tar.bz2', '.gz', '.tgz', '.bz2', '.xz'
     }
     
     # Files to skip or ignore
@@ -74,10 +96,33 @@ class SubmissionPreprocessor:
         '.tmp', '.log', '.cache', '.bak', '.swp'
     }
     
-    def __init__(self):
-        """Initialize preprocessor with hardcoded optimal settings."""
+    def __init__(self, cpu_workers: int = 0, cpu_task_timeout: float = 120, office_listeners: int = 0,
+                 notebook_renderer: str = 'native', page_modality: str = 'page', raster_workers: int = 2,
+                 image_filter: bool = True, image_optimization: bool = True, max_image_tokens: int = 1032,
+                 token_budget: int = 100000, cache_dir: Optional[Path] = None, cache_max_bytes: int = 10 * 1024 ** 3,
+                 staging: str = 'auto', heavy_slots: int = 0, medium_slots: int = 0, light_slots: int = 0):
+        """
+        Initialize preprocessor with hardcoded optimal settings.
+        With cpu_workers > 0, image resizing, PDF page reading and zip/tar extraction
+        run in a pool of that many worker processes. With office_listeners > 0, office
+        documents are converted by that many persistent LibreOffice instances.
+        notebook_renderer selects how notebooks are processed: 'native' renders them
+        in-process to markdown and images, 'nbconvert' converts them to PDF.
+        page_modality 'page' sends every page of a PDF or document either as extracted
+        text or as an image; 'file' keeps the PDF and rasterizes all of its pages.
+        raster_workers is the number of concurrent pdftoppm processes per PDF.
+        With image_filter, blank and near-duplicate images are dropped before upload.
+        With image_optimization, images are cropped to their content, re-encoded as
+        grayscale/bilevel when they have no colour and scaled to max_image_tokens each.
+        A submission estimated above token_budget input tokens is shrunk, then sharded (0: no budget).
+        With cache_dir, converted PDFs, page images and page text are cached by input content.
+        staging selects how files are placed (see staging.Stager): 'auto' reflinks, hardlinks or
+        copies, 'reference' also reads inputs in place instead of staging them.
+        Converter subprocesses share heavy (office, LaTeX), medium (rasterization) and light (text)
+        slots across all submission threads (see scheduler); a slot count of 0 sizes it to the machine.
+        """
         # Hardcoded limits optimized for LLM processing
-        self.max_pdf_pages = 30
+        self.max_pdf_pages = 100
         self.max_image_resolution = 2048
         self.pdf_dpi = 96
         self.min_pdf_text_length = 50
@@ -90,6 +135,33 @@ class SubmissionPreprocessor:
             'archive': 100
         }
         
+        # Archive members are screened with the rules of should_process_file before they are written
+        categories = {}
+        for category, extensions in [('textual', self.TEXTUAL_EXTENSIONS), ('visual', self.VISUAL_EXTENSIONS),
+                                     ('mixed', self.MIXED_EXTENSIONS), ('archive', self.ARCHIVE_EXTENSIONS)]:
+            categories.update(dict.fromkeys(extensions, category))
+        self.member_rules = MemberRules(categories, self.SKIP_FILES, self.SKIP_EXTENSIONS, self.size_limits)
+        self.archive_limits = ExtractionLimits(max_total_bytes=500 * 1024 * 1024, max_ratio=100, max_depth=3)
+        
+        # Resource usage of conversion subprocesses: per submission (thread-local) and for the whole run
+        self._local = threading.local()
+        self._usage_lock = threading.Lock()
+        self.resource_records: List[Dict] = []
+        
+        self.cpu_pool = CPUPool(cpu_workers, cpu_task_timeout)
+        self.office_pool = OfficePool(office_listeners) if office_listeners > 0 else None
+        self.notebook_renderer = notebook_renderer
+        self.page_modality = page_modality
+        self.raster_workers = raster_workers
+        self.image_filter = image_filter
+        self.image_optimization = image_optimization
+        self.max_image_tokens = max_image_tokens
+        self.budget_planner = BudgetPlanner(token_budget, call=self.cpu_pool.run,
+                                            tool_runner=self.tool_runner)
+        self.artifact_cache = ArtifactCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.stager = Stager(staging)
+        self.scheduler = SubprocessScheduler(default_classes(heavy_slots, medium_slots, light_slots))
+        
         self.check_dependencies()
     
     def check_dependencies(self):
@@ -171,15 +243,103 @@ class SubmissionPreprocessor:
         
         return True, category, ''
 
+    def run_tool(self, tool: str, cmd: List[str], source: Optional[Path] = None, **kwargs) -> subprocess.CompletedProcess:
+        """
+        Run a conversion subprocess (same arguments as subprocess.run) inside a trace span,
+        once the scheduler admits it. Wall time, CPU user/sys time and peak RSS of the child
+        and the time it queued for a slot are recorded per file and per converter.
+        """
+        status = 'ok'
+        usage = None
+        with tracer.span(f"queue:{tool}", cat='scheduler', file=source.name if source else ''):
+            admission = self.scheduler.acquire(tool)
+        try:
+            with tracer.span(f"subprocess:{tool}", cat='subprocess', file=source.name if source else ''):
+                result, usage = run_with_usage(cmd, **kwargs)
+            if result.returncode != 0:
+                status = 'failed'
+            return result
+        except subprocess.TimeoutExpired as e:
+            status = 'timeout'
+            usage = getattr(e, 'resource_usage', None)
+            raise
+        except subprocess.CalledProcessError as e:
+            status = 'failed'
+            usage = getattr(e, 'resource_usage', None)
+            raise
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self.scheduler.release(admission)
+            if usage is not None:
+                metrics.CONVERTER_SECONDS.labels(tool=tool).observe(usage.wall_seconds)
+                self._record_usage(tool, source, status, usage, admission.wait_seconds)
+    
+    def _record_usage(self, tool: str, source: Optional[Path], status: str, usage, queue_seconds: float = 0.0):
+        record = {'tool': tool, 'file': source.name if source else None, 'status': status}
+        record.update(usage.to_dict())
+        record['queue_seconds'] = round(queue_seconds, 3)
+        submission_records = getattr(self._local, 'resource_records', None)
+        if submission_records is not None:
+            submission_records.append(record)
+        with self._usage_lock:
+            self.resource_records.append(dict(record, submission=getattr(self._local, 'submission', None)))
+    
+    def resource_summary(self, slowest: int = 10) -> Dict:
+        """Per-converter totals of the run and the slowest individual conversions."""
+        with self._usage_lock:
+            records = list(self.resource_records)
+        return {
+            'per_converter': summarize_usage(records),
+            'slowest_conversions': sorted(records, key=lambda r: r['wall_seconds'], reverse=True)[:slowest]
+        }
+    
+    def close(self):
+        """Shut down the CPU worker pool and the LibreOffice listeners."""
+        self.cpu_pool.shutdown()
+        if self.office_pool is not None:
+            self.office_pool.shutdown()
+    
+    def convert_office_document(self, file_path: Path, output_path: Path, timeout: float = 300):
+        """Convert an office document to PDF on the persistent LibreOffice pool."""
+        if not self.office_pool.use_uno:
+            # Cold-started conversions are accounted like every other subprocess
+            def run(cmd, **kwargs):
+                return self.run_tool('libreoffice', cmd, source=file_path, **kwargs)
+            self.office_pool.convert(file_path, output_path, timeout, run=run)
+            return
+        
+        # The listener is a long-lived process, so only the wall time (including waiting for a free listener) is known
+        start_time = time.perf_counter()
+        status = 'ok'
+        try:
+            with tracer.span('subprocess:libreoffice_listener', cat='subprocess', file=file_path.name):
+                self.office_pool.convert(file_path, output_path, timeout)
+        except subprocess.TimeoutExpired:
+            status = 'timeout'
+            raise
+        except Exception:
+            status = 'failed'
+            raise
+        finally:
+            usage = ResourceUsage(time.perf_counter() - start_time)
+            metrics.CONVERTER_SECONDS.labels(tool='libreoffice_listener').observe(usage.wall_seconds)
+            self._record_usage('libreoffice_listener', file_path, status, usage)
+    
     def kill_hanging_processes(self):
         """Kill any hanging conversion processes."""
         try:
             # Kill hanging pandoc, jupyter, libreoffice, and pdftoppm processes
             hanging_processes = ['pandoc', 'jupyter', 'libreoffice', 'pdftoppm', 'pdftotext', 'wkhtmltopdf']
+            # Persistent LibreOffice listeners are long-lived on purpose
+            protected = self.office_pool.pids() if self.office_pool is not None else set()
             
-            for proc in psutil.process_iter(['pid', 'name', 'create_time']):
+            for proc in psutil.process_iter(['pid', 'ppid', 'name', 'create_time']):
                 try:
                     proc_info = proc.info
+                    if proc_info['pid'] in protected or proc_info['ppid'] in protected:
+                        continue
                     if proc_info['name'] in hanging_processes:
                         if time.time() - proc_info['create_time'] > 600:  # 10 minutes
                             logger.warning(f"Killing hanging process: {proc_info['name']} (PID: {proc_info['pid']})")
@@ -189,76 +349,273 @@ class SubmissionPreprocessor:
         except Exception as e:
             logger.warning(f"Error killing hanging processes: {e}")
 
+    def tool_runner(self, source: Path):
+        """
+        Runner with the signature run(tool, cmd, **kwargs) that accounts subprocesses of a source file.
+        It may be called from helper threads (concurrent pdftoppm runs): usage is still recorded
+        for the submission that created the runner.
+        """
+        owner = threading.current_thread()
+        submission = getattr(self._local, 'submission', None)
+        resource_records = getattr(self._local, 'resource_records', None)
+        
+        def run(tool: str, cmd: List[str], **kwargs) -> subprocess.CompletedProcess:
+            if threading.current_thread() is owner:
+                return self.run_tool(tool, cmd, source=source, **kwargs)
+            self._local.submission = submission
+            self._local.resource_records = resource_records
+            try:
+                with tracer.context(submission=submission, stage='preprocess'):
+                    return self.run_tool(tool, cmd, source=source, **kwargs)
+            finally:
+                self._local.submission = None
+                self._local.resource_records = None
+        return run
+    
+    def analyze_pdf(self, pdf_path: Path) -> PdfAnalysis:
+        """Page count, page sizes and per-page text of a PDF, computed once per PDF content."""
+        with tracer.span('pdf_analysis', cat='pdf', file=pdf_path.name):
+            return analyze_pdf(pdf_path, run=self.tool_runner(pdf_path), call=self.cpu_pool.run)
+    
     def has_extractable_text(self, pdf_path: Path) -> Tuple[bool, str]:
         """Check if a PDF has extractable text content. Returns (has_text, extracted_sample)."""
         try:
-            # Use pdftotext to extract text from the PDF
-            result = subprocess.run([
-                'pdftotext', str(pdf_path), '-'
-            ], capture_output=True, text=True, timeout=30)
-            
-            if result.returncode == 0:
-                extracted_text = result.stdout.strip()
-                cleaned_text = ' '.join(extracted_text.split())
-                
-                # Check if we have meaningful text content
-                if len(cleaned_text) >= self.min_pdf_text_length:
-                    if sum(c.isalnum() or c.isspace() for c in cleaned_text) / len(cleaned_text) > 0.7:
-                        return True, cleaned_text[:200] + "..." if len(cleaned_text) > 200 else cleaned_text
-                
-                return False, cleaned_text[:100] + "..." if len(cleaned_text) > 100 else cleaned_text
-            else:
-                logger.warning(f"pdftotext failed for {pdf_path.name}: {result.stderr}")
-                return False, ""
-                
-        except (subprocess.TimeoutExpired, Exception) as e:
+            analysis = self.analyze_pdf(pdf_path)
+        except Exception as e:
             logger.warning(f"Error extracting text from {pdf_path.name}: {e}")
             return False, ""
+        
+        if not analysis.text_available:
+            return False, ""
+        
+        cleaned_text = ' '.join(analysis.text.split())
+        
+        # Check if we have meaningful text content
+        if len(cleaned_text) >= self.min_pdf_text_length:
+            if sum(c.isalnum() or c.isspace() for c in cleaned_text) / len(cleaned_text) > 0.7:
+                return True, cleaned_text[:200] + "..." if len(cleaned_text) > 200 else cleaned_text
+        
+        return False, cleaned_text[:100] + "..." if len(cleaned_text) > 100 else cleaned_text
+    
+    def render_notebook(self, file_path: Path, textual_dir: Path, visual_dir: Path) -> Optional[Tuple[Path, List[Path]]]:
+        """Render a notebook natively. Returns (markdown_path, image_paths), or None to fall back to nbconvert."""
+        try:
+            with tracer.span('notebook_render', cat='notebook', file=file_path.name):
+                return render_notebook(file_path, textual_dir, visual_dir)
+        except NotebookRenderError as e:
+            logger.warning(f"{e} - falling back to nbconvert")
+            return None
+    
+    def batch_convert_office(self, files: List[Path], output_dir: Path) -> Dict[Path, Path]:
+        """
+        Convert office documents to PDF with one LibreOffice start per batch instead of one per file.
+        Returns {source: pdf} for the documents that converted. The others are left to convert_to_pdf,
+        which converts them one by one and reports their individual errors.
+        """
+        # LibreOffice names outputs after the input stem, so stems must be unique within a batch
+        batches: List[List[Path]] = []
+        for file_path in files:
+            for batch in batches:
+                if all(other.stem != file_path.stem for other in batch):
+                    batch.append(file_path)
+                    break
+            else:
+                batches.append([file_path])
+        
+        converted = {}
+        for index, batch in enumerate(batches):
+            batch_dir = output_dir / f"office_batch_{index}"
+            batch_dir.mkdir(parents=True, exist_ok=True)
+            clean_exit = False
+            try:
+                result = self.run_tool('libreoffice_batch', [
+                    'libreoffice', '--headless', '--convert-to', 'pdf',
+                    '--outdir', str(batch_dir)
+                ] + [str(file_path) for file_path in batch], capture_output=True, timeout=120 + 60 * len(batch))
+                clean_exit = result.returncode == 0
+            except (subprocess.TimeoutExpired, OSError) as e:
+                logger.warning(f"Batch conversion of {len(batch)} office files interrupted: {e}")
+            
+            for file_path in batch:
+                pdf_path = batch_dir / f"{file_path.stem}.pdf"
+                # After a crash or timeout the last output may be truncated
+                if pdf_path.exists() and (clean_exit or self._is_complete_pdf(pdf_path)):
+                    converted[file_path] = pdf_path
+                else:
+                    logger.warning(f"Batch conversion produced no PDF for {file_path.name}, converting it separately")
+        
+        logger.info(f"Batch converted {len(converted)}/{len(files)} office files with {len(batches)} LibreOffice run(s)")
+        return converted
+    
+    @staticmethod
+    def _is_complete_pdf(pdf_path: Path) -> bool:
+        """Check for the end-of-file marker of a PDF."""
+        try:
+            with open(pdf_path, 'rb') as f:
+                f.seek(max(0, pdf_path.stat().st_size - 1024))
+                return b'%%EOF' in f.read()
+        except OSError:
+            return False
     
     def extract_archives(self, file_path: Path, extract_dir: Path) -> List[Path]:
-        """Extract archive files and return list of extracted files."""
+        """
+        Extract the processable members of an archive, and of the archives inside it up to
+        max_depth levels, and return the extracted files. All archives of one call share the
+        total size limit.
+        """
+        with tracer.span('extract_archive', cat='archive', file=file_path.name):
+            return self._extract_archives(file_path, extract_dir, 1, {'bytes': self.archive_limits.max_total_bytes})
+    
+    def _extract_archives(self, file_path: Path, extract_dir: Path, depth: int, budget: Dict[str, int]) -> List[Path]:
         extracted_files = []
-        extension = file_path.suffix.lower()
         
         try:
-            if extension == '.zip':
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-            elif extension == '.rar':
-                with rarfile.RarFile(file_path, 'r') as rar_ref:
-                    rar_ref.extractall(extract_dir)
-            elif extension in ['.tar', '.tar.gz', '.tar.bz2']:
-                import tarfile
-                with tarfile.open(file_path, 'r:*') as tar_ref:
-                    tar_ref.extractall(extract_dir)
-            elif extension == '.7z':
-                # Use 7z command line tool
-                subprocess.run(['7z', 'x', str(file_path), f'-o{extract_dir}'], 
-                             check=True, capture_output=True)
-            elif extension == '.gz' and not file_path.name.endswith('.tar.gz'):
-                # Handle standalone .gz files
-                import gzip
-                output_file = extract_dir / file_path.stem
-                with gzip.open(file_path, 'rb') as f_in:
-                    with open(output_file, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                extracted_files.append(output_file)
-                return extracted_files
-            
-            # Find all extracted files
-            for root, dirs, files in os.walk(extract_dir):
-                for file in files:
-                    extracted_files.append(Path(root) / file)
-            
-            logger.info(f"Extracted {len(extracted_files)} files from {file_path.name}")
-            
+            if file_path.suffix.lower() == '.7z':
+                result = self._extract_7z(file_path, extract_dir, budget['bytes'])
+            else:
+                result = self.cpu_pool.run(extract_archive, str(file_path), str(extract_dir), self.member_rules,
+                                           self.archive_limits, budget['bytes'])
         except Exception as e:
             logger.error(f"Failed to extract {file_path}: {e}")
+            return extracted_files
+        
+        budget['bytes'] -= result['bytes']
+        if result['skipped']:
+            reasons = {}
+            for _, reason in result['skipped']:
+                reasons[reason] = reasons.get(reason, 0) + 1
+            logger.info(f"Not extracted from {file_path.name}: "
+                        + ", ".join(f"{count} x {reason}" for reason, count in reasons.items()))
+        if result['stopped']:
+            logger.warning(f"Stopped extracting {file_path.name}: {result['stopped']}")
+        
+        for member in map(Path, result['files']):
+            if member.suffix.lower() not in self.ARCHIVE_EXTENSIONS:
+                extracted_files.append(member)
+                continue
+            # Nested archive: extract it into a directory of the same name
+            if depth >= self.archive_limits.max_depth:
+                logger.warning(f"Not extracting {member.name} from {file_path.name}: "
+                               f"nested deeper than {self.archive_limits.max_depth} archives")
+            elif budget['bytes'] > 0:
+                holder = None
+                try:
+                    holder = Path(tempfile.mkdtemp(prefix=f".{member.name}.", dir=member.parent))
+                    nested_archive = holder / member.name
+                    member.rename(nested_archive)
+                    member.mkdir(exist_ok=False)
+                    extracted_files.extend(self._extract_archives(nested_archive, member, depth + 1, budget))
+                    continue
+                except Exception as e:
+                    logger.error(f"Failed to extract nested archive {member.name} from {file_path.name}: {e}")
+                    if member.is_dir():
+                        shutil.rmtree(member, ignore_errors=True)
+                finally:
+                    if holder:
+                        shutil.rmtree(holder, ignore_errors=True)
+            member.unlink(missing_ok=True)
         
+        logger.info(f"Extracted {len(extracted_files)} files from {file_path.name}")
         return extracted_files
     
+    def _extract_7z(self, file_path: Path, extract_dir: Path, max_bytes: int) -> Dict:
+        """7z cannot be streamed from Python: screen the listing, then extract the selected members."""
+        listing = self.run_tool('7z', ['7z', 'l', '-slt', str(file_path)],
+                                source=file_path, check=True, capture_output=True, text=True)
+        selected = screen_members(parse_7z_listing(listing.stdout), extract_dir, self.member_rules,
+                                  self.archive_limits, max_bytes, file_path.stat().st_size)
+        files = []
+        if selected['names']:
+            list_file = extract_dir / ".7z_members.txt"
+            list_file.write_text('\n'.join(selected['names']) + '\n', encoding='utf-8')
+            try:
+                self.run_tool('7z', ['7z', 'x', '-y', '-scsUTF-8', str(file_path), f'-o{extract_dir}', f'@{list_file}'],
+                              source=file_path, check=True, capture_output=True)
+            finally:
+                list_file.unlink(missing_ok=True)
+            files = [str(path) for path in (member_path(extract_dir, name) for name in selected['names'])
+                     if path.is_file()]
+        # The declared sizes are not trusted: charge what was actually written
+        return {'files': files, 'skipped': selected['skipped'], 'bytes': sum(Path(f).stat().st_size for f in files),
+                'stopped': selected['stopped']}
+    
     def convert_to_pdf(self, file_path: Path, output_dir: Path) -> Tuple[Optional[Path], Optional[str]]:
-        """Convert various file formats to PDF. Returns (pdf_path, error_message)."""
+        """
+        Convert various file formats to PDF. Returns (pdf_path, error_message).
+        Within a submission every document is converted once: later calls (e.g. from
+        convert_to_images) get the result of the first one, including its failure.
+        """
+        memo = getattr(self._local, 'pdf_memo', None)
+        if memo is not None and file_path in memo:
+            return memo[file_path]
+        
+        # A PDF is only copied, which is not worth caching
+        key, entry = self._cache_lookup(file_path, 'pdf') if file_path.suffix.lower() != '.pdf' else (None, None)
+        restored = self._cache_restore(entry, file_path, {'pdf': output_dir})
+        if restored:
+            result = restored['pdf'][0], None
+        else:
+            result = self._convert_to_pdf(file_path, output_dir)
+            if key and result[0]:
+                self.artifact_cache.store(key, file_path.stem, {'pdf': [result[0]]})
+        if memo is not None:
+            memo[file_path] = result
+        return result
+    
+    def cache_settings(self, file_path: Path, kind: str) -> Dict:
+        """Converter settings that the artifacts of a conversion depend on."""
+        settings = {'extension': file_path.suffix.lower()}
+        if kind in ('images', 'pages'):
+            settings.update({
+                'pdf_dpi': self.pdf_dpi,
+                'max_image_resolution': self.max_image_resolution,
+                'jpeg_quality': 85,
+                'max_pdf_pages': self.max_pdf_pages
+            })
+        if kind == 'pages':
+            settings.update({
+                'min_text_density': MIN_TEXT_DENSITY,
+                'min_alnum_ratio': MIN_ALNUM_RATIO,
+                'max_image_coverage': MAX_IMAGE_COVERAGE
+            })
+        return settings
+    
+    def _cache_key(self, file_path: Path, kind: str) -> Optional[str]:
+        if self.artifact_cache is None:
+            return None
+        return self.artifact_cache.key(file_path, kind, self.cache_settings(file_path, kind))
+    
+    def _cache_lookup(self, file_path: Path, kind: str) -> Tuple[Optional[str], Optional[CacheEntry]]:
+        """Cache key and entry of a conversion; both None when caching is off."""
+        key = self._cache_key(file_path, kind)
+        if key is None:
+            return None, None
+        entry = self.artifact_cache.lookup(key)
+        stats = getattr(self._local, 'cache_stats', None)
+        if stats is not None:
+            stats['hits' if entry else 'misses'] += 1
+        return key, entry
+    
+    def _cache_restore(self, entry: Optional[CacheEntry], file_path: Path,
+                       output_dirs: Dict[str, Path]) -> Optional[Dict[str, List[Path]]]:
+        if entry is None:
+            return None
+        try:
+            restored = entry.restore(file_path.stem, output_dirs)
+        except OSError as e:
+            logger.warning(f"Could not restore cached artifacts of {file_path.name}: {e}")
+            return None
+        logger.info(f"Restored {sum(len(paths) for paths in restored.values())} cached artifacts of {file_path.name}")
+        return restored
+    
+    def _conversion_cached(self, file_path: Path) -> bool:
+        """The conversion results of a document are in the artifact cache (no LibreOffice run needed)."""
+        if self.artifact_cache is None:
+            return False
+        kinds = ['pdf', 'pages'] if self.page_modality == 'page' else ['pdf']
+        return any(self.artifact_cache.contains(self._cache_key(file_path, kind)) for kind in kinds)
+    
+    def _convert_to_pdf(self, file_path: Path, output_dir: Path) -> Tuple[Optional[Path], Optional[str]]:
         extension = file_path.suffix.lower()
         
         # Create output filename
@@ -273,12 +630,12 @@ class SubmissionPreprocessor:
             if extension == '.ipynb':
                 # Method 1: Direct conversion to PDF
                 try:
-                    subprocess.run([
+                    self.run_tool('nbconvert', [
                         'jupyter', 'nbconvert', '--to', 'pdf',
                         '--output-dir', str(output_dir),
                         '--output', file_path.stem,
                         str(file_path)
-                    ], check=True, capture_output=True, text=True, timeout=300)
+                    ], source=file_path, check=True, capture_output=True, text=True, timeout=300)
                     
                     if output_path.exists():
                         logger.info(f"Successfully converted {file_path.name} to PDF (direct)")
@@ -292,18 +649,18 @@ class SubmissionPreprocessor:
                     html_path = output_dir / f"{file_path.stem}.html"
                     
                     # Convert to HTML
-                    subprocess.run([
+                    self.run_tool('nbconvert', [
                         'jupyter', 'nbconvert', '--to', 'html',
                         '--output-dir', str(output_dir),
                         '--output', file_path.stem,
                         str(file_path)
-                    ], check=True, capture_output=True, text=True, timeout=300)
+                    ], source=file_path, check=True, capture_output=True, text=True, timeout=300)
                     
                     # Convert HTML to PDF
-                    subprocess.run([
+                    self.run_tool('pandoc', [
                         'pandoc', str(html_path), '-o', str(output_path),
                         '--pdf-engine=wkhtmltopdf'
-                    ], check=True, capture_output=True, text=True, timeout=300)
+                    ], source=file_path, check=True, capture_output=True, text=True, timeout=300)
                     
                     # Clean up HTML
                     html_path.unlink(missing_ok=True)
@@ -321,28 +678,37 @@ class SubmissionPreprocessor:
                 # If both methods fail, it's a failed file
                 return None, "Jupyter notebook conversion failed (both direct PDF and HTML→PDF methods failed)"
                 
-            elif extension in ['.docx', '.doc', '.odt', '.rtf', '.pptx', '.ppt']:
-                # Use LibreOffice for conversion
-                subprocess.run([
-                    'libreoffice', '--headless', '--convert-to', 'pdf',
-                    '--outdir', str(output_dir), str(file_path)
-                ], check=True, capture_output=True, timeout=300)
-                
-                # LibreOffice creates PDF with just the stem name, rename to expected format
-                libreoffice_output = output_dir / f"{file_path.stem}.pdf"
-                if libreoffice_output.exists() and libreoffice_output != output_path:
-                    libreoffice_output.rename(output_path)
+            elif extension in self.OFFICE_EXTENSIONS:
+                batch_pdf = (getattr(self._local, 'office_pdfs', None) or {}).get(file_path)
+                if batch_pdf is not None:
+                    # Already converted with the other office files of the submission
+                    with tracer.span('file_write', cat='io', file=output_path.name):
+                        shutil.move(str(batch_pdf), str(output_path))
+                elif self.office_pool is not None:
+                    self.convert_office_document(file_path, output_path)
+                else:
+                    # Use LibreOffice for conversion
+                    self.run_tool('libreoffice', [
+                        'libreoffice', '--headless', '--convert-to', 'pdf',
+                        '--outdir', str(output_dir), str(file_path)
+                    ], source=file_path, check=True, capture_output=True, timeout=300)
+                    
+                    # LibreOffice creates PDF with just the stem name, rename to expected format
+                    libreoffice_output = output_dir / f"{file_path.stem}.pdf"
+                    if libreoffice_output.exists() and libreoffice_output != output_path:
+                        libreoffice_output.rename(output_path)
                 
             elif extension == '.html':
                 # Convert HTML to PDF using pandoc
-                subprocess.run([
+                self.run_tool('pandoc', [
                     'pandoc', str(file_path), '-o', str(output_path),
                     '--pdf-engine=wkhtmltopdf'
-                ], check=True, capture_output=True, timeout=300)
+                ], source=file_path, check=True, capture_output=True, timeout=300)
             
             elif extension == '.pdf':
-                # Already a PDF, just copy it
-                shutil.copy2(file_path, output_path)
+                # Already a PDF, just stage it
+                with tracer.span('file_write', cat='io', file=output_path.name):
+                    self.stager.stage(file_path, output_path)
             
             if output_path.exists():
                 logger.info(f"Successfully converted {file_path.name} to PDF")
@@ -372,73 +738,52 @@ class SubmissionPreprocessor:
                 output_path = output_dir / file_path.name
                 
                 # Resize image if needed
-                with Image.open(file_path) as img:
-                    width, height = img.size
-                    max_dim = max(width, height)
-                    
-                    if max_dim > self.max_image_resolution:
-                        ratio = self.max_image_resolution / max_dim
-                        new_width = int(width * ratio)
-                        new_height = int(height * ratio)
-                        
-                        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                        resized_img.save(output_path, optimize=True, quality=85)
-                        logger.info(f"Resized image {file_path.name} from {width}x{height} to {new_width}x{new_height}")
-                    else:
-                        shutil.copy2(file_path, output_path)
+                with tracer.span('pil_resize', cat='image', file=file_path.name):
+                    width, height, new_width, new_height = self.cpu_pool.run(
+                        resize_image, str(file_path), str(output_path), self.max_image_resolution
+                    )
+                if (new_width, new_height) != (width, height):
+                    logger.info(f"Resized image {file_path.name} from {width}x{height} to {new_width}x{new_height}")
                 
                 image_paths.append(output_path)
                 
             elif extension == '.pdf':
+                key, entry = self._cache_lookup(file_path, 'images')
+                restored = self._cache_restore(entry, file_path, {'visual': output_dir})
+                if restored:
+                    if entry.data['pages_dropped']:
+                        self._record_truncation(file_path, entry.data['pages_dropped'])
+                    logger.info(f"Generated {len(restored['visual'])} images from {file_path.name}")
+                    return restored['visual'], None
+                
                 # Get page count and limit
-                with open(file_path, 'rb') as pdf_file:
-                    pdf_reader = PyPDF2.PdfReader(pdf_file)
-                    total_pages = len(pdf_reader.pages)
-                    pages_to_process = min(total_pages, self.max_pdf_pages)
+                analysis = self.analyze_pdf(file_path)
+                total_pages = analysis.page_count
+                pages_to_process = min(total_pages, self.max_pdf_pages)
                 
                 if total_pages > self.max_pdf_pages:
                     logger.warning(f"PDF {file_path.name} has {total_pages} pages, limiting to first {self.max_pdf_pages}")
+                    self._record_truncation(file_path, total_pages - pages_to_process)
                 
-                # Convert PDF pages to images
-                subprocess.run([
-                    'pdftoppm', '-jpeg', '-r', str(self.pdf_dpi),
-                    '-l', str(pages_to_process),
-                    '-jpegopt', 'quality=85',
-                    str(file_path), str(output_dir / 'page')
-                ], check=True, capture_output=True, timeout=300)
-                
-                # Rename and resize generated images
-                for img_file in sorted(output_dir.glob('page-*.jpg')):
-                    page_num = img_file.stem.split('-')[-1]
-                    new_name = output_dir / f"{file_path.stem}_page_{page_num}.jpg"
-                    img_file.rename(new_name)
-                    
-                    # Resize if needed
-                    with Image.open(new_name) as img:
-                        width, height = img.size
-                        max_dim = max(width, height)
-                        
-                        if max_dim > self.max_image_resolution:
-                            ratio = self.max_image_resolution / max_dim
-                            new_width = int(width * ratio)
-                            new_height = int(height * ratio)
-                            
-                            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                            resized_img.save(new_name, 'JPEG', optimize=True, quality=85)
-                    
-                    image_paths.append(new_name)
+                image_paths.extend(self.rasterize_pages(analysis, range(1, pages_to_process + 1), output_dir))
+                if key:
+                    self.artifact_cache.store(key, file_path.stem, {'visual': image_paths},
+                                              {'pages_dropped': total_pages - pages_to_process})
                     
             elif extension in self.MIXED_EXTENSIONS:
-                # Convert to PDF first, then to images
-                with tempfile.TemporaryDirectory() as temp_pdf_dir:
-                    temp_pdf_dir_path = Path(temp_pdf_dir)
-                    pdf_path, pdf_error = self.convert_to_pdf(file_path, temp_pdf_dir_path)
-                    if pdf_path:
-                        # Convert the temporary PDF to images in the visual directory
-                        temp_images, img_error = self.convert_to_images(pdf_path, output_dir)
-                        image_paths.extend(temp_images)
+                # Reuse the PDF already made for textual/, or convert to a temporary PDF, then to images
+                memo = getattr(self._local, 'pdf_memo', None)
+                with contextlib.ExitStack() as stack:
+                    if memo is not None and file_path in memo:
+                        pdf_path, pdf_error = memo[file_path]
                     else:
+                        temp_pdf_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+                        pdf_path, pdf_error = self.convert_to_pdf(file_path, temp_pdf_dir)
+                    if not pdf_path:
                         return [], f"Image extraction failed: {pdf_error}"
+                    # Convert the PDF to images in the visual directory
+                    temp_images, img_error = self.convert_to_images(pdf_path, output_dir)
+                    image_paths.extend(temp_images)
             
             logger.info(f"Generated {len(image_paths)} images from {file_path.name}")
             return image_paths, None
@@ -448,8 +793,190 @@ class SubmissionPreprocessor:
             logger.error(f"{error_msg} for {file_path.name}")
             return [], error_msg
     
-    def flatten_directory(self, source_dir: Path, target_dir: Path) -> List[Path]:
-        """Recursively flatten directory structure and extract archives."""
+    def _record_truncation(self, file_path: Path, pages_dropped: int):
+        """Record pages left out by the max_pdf_pages limit as a budget decision of the submission."""
+        decisions = getattr(self._local, 'budget_decisions', None)
+        if decisions is not None:
+            decisions.append({
+                'action': 'truncate_pages',
+                'file': file_path.name,
+                'detail': f"{pages_dropped} image pages beyond the first {self.max_pdf_pages} not rasterized",
+                'pages_dropped': pages_dropped
+            })
+    
+    def rasterize_pages(self, analysis: PdfAnalysis, page_numbers, output_dir: Path) -> List[Path]:
+        """
+        Render pages of an analyzed PDF to <stem>_page_<n>.jpg in output_dir. Pages are rendered
+        directly within max_image_resolution, so they are not resized afterwards.
+        """
+        stem = analysis.path.stem
+        with tracer.span('pdftoppm_rasterize', cat='pdf', file=analysis.path.name):
+            rendered = analysis.rasterize(
+                page_numbers, output_dir, f"{stem}_page", dpi=self.pdf_dpi,
+                max_pixels=self.max_image_resolution, workers=self.raster_workers,
+                run=self.tool_runner(analysis.path)
+            )
+        
+        image_paths = []
+        for page_number, img_file in rendered:
+            new_name = output_dir / f"{stem}_page_{analysis.page_name_suffix(page_number)}.jpg"
+            img_file.rename(new_name)
+            image_paths.append(new_name)
+        return image_paths
+    
+    def split_pages_by_modality(self, file_path: Path, textual_dir: Path, visual_dir: Path) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        Send every page of a PDF (or of a document converted to PDF) as text or as an image.
+        Text pages are written together to textual/<stem>_pages.txt, the other pages are rasterized
+        to visual/. Returns ({'text_file', 'images', 'pages'}, None) or (None, error_message).
+        """
+        key, entry = self._cache_lookup(file_path, 'pages')
+        restored = self._cache_restore(entry, file_path, {'textual': textual_dir, 'visual': visual_dir})
+        if restored:
+            pages = entry.data['pages']
+            pages_dropped = sum(p['modality'] == 'dropped' for p in pages)
+            if pages_dropped:
+                self._record_truncation(file_path, pages_dropped)
+            text_file = restored['textual'][0] if restored['textual'] else None
+            return {'text_file': text_file, 'images': restored['visual'], 'pages': pages}, None
+        
+        with tempfile.TemporaryDirectory() as temp_pdf_dir:
+            if file_path.suffix.lower() == '.pdf':
+                pdf_path = file_path
+            else:
+                pdf_path, pdf_error = self.convert_to_pdf(file_path, Path(temp_pdf_dir))
+                if not pdf_path:
+                    return None, f"PDF conversion failed: {pdf_error}"
+            
+            try:
+                analysis = self.analyze_pdf(pdf_path)
+                if analysis.text_available:
+                    analysis.measure_image_coverage(run=self.tool_runner(pdf_path))
+            except Exception as e:
+                error_msg = f"PDF analysis failed: {str(e)[:100]}"
+                logger.error(f"{error_msg} for {file_path.name}")
+                return None, error_msg
+            
+            pages = []
+            text_sections = []
+            image_pages = []
+            for page in analysis.pages:
+                modality, reason = page_modality(page) if analysis.text_available else ('image', 'no text layer')
+                record = page.to_dict()
+                record.update({'modality': modality, 'reason': reason})
+                if modality == 'text':
+                    text_sections.append(f"[Page {page.number}]\n{page.text.strip()}")
+                elif page.number <= self.max_pdf_pages:
+                    image_pages.append(page.number)
+                else:
+                    record['reason'] = f"{reason}, beyond the {self.max_pdf_pages} page image limit"
+                    record['modality'] = 'dropped'
+                pages.append(record)
+            
+            if analysis.page_count > self.max_pdf_pages and any(p['modality'] == 'dropped' for p in pages):
+                logger.warning(f"PDF {file_path.name} has {analysis.page_count} pages, rasterizing image pages "
+                               f"among the first {self.max_pdf_pages} only")
+                self._record_truncation(file_path, sum(p['modality'] == 'dropped' for p in pages))
+            
+            text_file = None
+            if text_sections:
+                text_file = textual_dir / f"{pdf_path.stem}_pages.txt"
+                with tracer.span('file_write', cat='io', file=text_file.name):
+                    text_file.write_text('\n\n'.join(text_sections) + '\n', encoding='utf-8')
+            
+            try:
+                images = self.rasterize_pages(analysis, image_pages, visual_dir)
+            except Exception as e:
+                error_msg = f"Image conversion failed ({file_path.suffix.lower()}): {str(e)[:100]}"
+                logger.error(f"{error_msg} for {file_path.name}")
+                return None, error_msg
+        
+        logger.info(f"{file_path.name}: {len(text_sections)} text pages, {len(images)} image pages")
+        if key:
+            self.artifact_cache.store(key, file_path.stem, {'textual': [text_file] if text_file else [], 'visual': images},
+                                      {'pages': pages})
+        return {'text_file': text_file, 'images': images, 'pages': pages}, None
+    
+    def drop_redundant_images(self, submission_dir: Path, visual_outputs: List[str]) -> List[Dict]:
+        """
+        Delete blank and near-duplicate images among the visual outputs (paths relative to
+        submission_dir) and remove them from the list. Returns a record per dropped image.
+        """
+        signatures = []
+        with tracer.span('image_analysis', cat='image', images=len(visual_outputs)):
+            for rel_path in visual_outputs:
+                try:
+                    signatures.append((rel_path, self.cpu_pool.run(image_signature, str(submission_dir / rel_path))))
+                except Exception as e:
+                    # Formats Pillow cannot read (e.g. SVG) are kept as they are
+                    logger.debug(f"Cannot analyze {rel_path}: {e}")
+                    signatures.append((rel_path, None))
+        
+        dropped = select_redundant(signatures)
+        for record in dropped:
+            (submission_dir / record['filename']).unlink(missing_ok=True)
+            visual_outputs.remove(record['filename'])
+            detail = f" (duplicate of {record['duplicate_of']})" if record['duplicate_of'] else ""
+            logger.info(f"Dropped {record['reason']} image {record['filename']}{detail}")
+        return dropped
+    
+    def optimize_images(self, submission_dir: Path, visual_outputs: List[str]) -> Dict:
+        """
+        Crop, re-encode and downscale the visual outputs (paths relative to submission_dir) in place,
+        updating the list when a file changes extension. Returns per-file records and byte/token totals.
+        """
+        records = []
+        with tracer.span('image_optimization', cat='image', images=len(visual_outputs)):
+            for index, rel_path in enumerate(visual_outputs):
+                image_path = submission_dir / rel_path
+                try:
+                    record = self.cpu_pool.run(optimize_image, str(image_path), self.max_image_tokens,
+                                               self.max_image_resolution)
+                except Exception as e:
+                    # Formats Pillow cannot read (e.g. SVG) are uploaded as they are
+                    logger.debug(f"Cannot optimize {rel_path}: {e}")
+                    continue
+                if record['filename'] != image_path.name:
+                    visual_outputs[index] = str(Path(rel_path).with_name(record['filename']))
+                records.append(record)
+        
+        original_bytes = sum(r['original_bytes'] for r in records)
+        optimized_bytes = sum(r['bytes'] for r in records)
+        if original_bytes:
+            logger.info(f"Optimized {len(records)} images of {submission_dir.name}: "
+                        f"{original_bytes / 1024:.0f} KB -> {optimized_bytes / 1024:.0f} KB")
+        return {
+            'per_file': records,
+            'original_bytes': original_bytes,
+            'bytes': optimized_bytes,
+            'bytes_saved': original_bytes - optimized_bytes,
+            'tokens_before': sum(r['tokens_before'] for r in records),
+            'tokens': sum(r['tokens'] for r in records)
+        }
+    
+    def staging_root(self, submission_dir: Path) -> Optional[Path]:
+        """
+        Directory for the temporary flattening directories: on the filesystem of the submissions,
+        where reflinks and hardlinks work. None (the system temp directory) if it cannot be created.
+        """
+        if self.stager.mode == 'copy':
+            return None
+        root = submission_dir.parent / "#staging"
+        try:
+            root.mkdir(exist_ok=True)
+        except OSError:
+            return None
+        return root
+    
+    def flatten_directory(self, source_dir: Path, target_dir: Path, origins: Optional[Dict[Path, str]] = None) -> List[Path]:
+        """
+        Recursively flatten directory structure and extract archives. `origins` receives the
+        source of every flattened file: its path in source_dir, <archive>/<member> if extracted.
+        In reference mode, files whose name is not taken yet are returned in place.
+        """
+        if origins is None:
+            origins = {}
+        names = set()
         all_files = []
         
         for item in source_dir.rglob('*'):
@@ -472,16 +999,26 @@ class SubmissionPreprocessor:
                         should_process_extracted, _, _ = self.should_process_file(extracted_file)
                         if should_process_extracted:
                             all_files.append(extracted_file)
+                            member = (extracted_file.relative_to(extract_dir) if extract_dir in extracted_file.parents
+                                      else extracted_file.name)
+                            origins[extracted_file] = f"{item.relative_to(source_dir)}/{member}"
                 else:
-                    # Copy file to target directory with unique name if needed
+                    # Stage file in target directory with unique name if needed
                     target_path = target_dir / item.name
                     counter = 1
-                    while target_path.exists():
+                    while target_path.name in names or target_path.exists():
                         target_path = target_dir / f"{item.stem}_{counter}{item.suffix}"
                         counter += 1
+                    names.add(target_path.name)
                     
-                    shutil.copy2(item, target_path)
+                    if self.stager.references and target_path.name == item.name:
+                        self.stager.reference(item)
+                        target_path = item
+                    else:
+                        with tracer.span('file_write', cat='io', file=item.name):
+                            self.stager.stage(item, target_path)
                     all_files.append(target_path)
+                    origins[target_path] = str(item.relative_to(source_dir))
         
         return all_files
     
@@ -509,7 +1046,8 @@ class SubmissionPreprocessor:
                         dest_path = submission_failed_dir / f"{stem}_{counter}{suffix}"
                         counter += 1
                     
-                    shutil.copy2(source_path, dest_path)
+                    # Never a hardlink: copies in the failure folder may be edited to fix them
+                    self.stager.stage(source_path, dest_path, shared=False)
                     copied_files.append({
                         'original_file': failed_file['filename'],
                         'copied_to': str(dest_path.relative_to(submissions_root)),
@@ -538,27 +1076,203 @@ class SubmissionPreprocessor:
 
     def process_submission_directory(self, submission_dir: Path) -> Tuple[bool, Optional[str]]:
         """Process a single submission directory. Returns (success, failure_reason)."""
+        with tracer.context(submission=submission_dir.name, stage='preprocess'), \
+                tracer.span('preprocess_submission', cat='submission'), \
+                metrics.track_in_flight('preprocess'), \
+                progress.track('preprocess'):
+            self._local.submission = submission_dir.name
+            self._local.resource_records = []
+            self._local.pdf_memo = {}
+            self._local.budget_decisions = []
+            self._local.cache_stats = {'hits': 0, 'misses': 0}
+            try:
+                success, failure_reason = self._process_submission_directory(submission_dir)
+            finally:
+                self._local.submission = None
+                self._local.resource_records = None
+                self._local.office_pdfs = None
+                self._local.pdf_memo = None
+                self._local.budget_decisions = None
+                self._local.cache_stats = None
+        metrics.SUBMISSIONS.labels(stage='preprocess', status='success' if success else 'failed').inc()
+        progress.finish('preprocess', 'success' if success else 'failed')
+        return success, failure_reason
+    
+    def output_settings(self) -> Dict:
+        """Settings the preprocessed outputs depend on; outputs made with other settings are rebuilt."""
+        return {
+            'page_modality': self.page_modality,
+            'notebook_renderer': self.notebook_renderer,
+            'pdf_dpi': self.pdf_dpi,
+            'max_image_resolution': self.max_image_resolution,
+            'max_pdf_pages': self.max_pdf_pages,
+            'page_thresholds': [MIN_TEXT_DENSITY, MIN_ALNUM_RATIO, MAX_IMAGE_COVERAGE],
+            'image_filter': [BLANK_INK_COVERAGE, SPECK_PIXELS] if self.image_filter else False,
+            'image_optimization': self.image_optimization,
+            'max_image_tokens': self.max_image_tokens,
+            'token_budget': self.budget_planner.max_tokens
+        }
+    
+    def convert_submission_file(self, file_path: Path, category: str, submission_dir: Path,
+                                textual_dir: Path, visual_dir: Path) -> Dict:
+        """
+        Convert one file of a submission. Returns its outputs (paths relative to submission_dir),
+        failure records, and its scanned PDF and page modality records if any.
+        """
+        result = {'textual': [], 'visual': [], 'failed': [], 'scanned_pdf': None, 'page_modality': None}
+        
+        if category == 'textual':
+            # Copy textual files directly
+            output_path = textual_dir / file_path.name
+            with tracer.span('file_write', cat='io', file=file_path.name):
+                self.stager.stage(file_path, output_path)
+            result['textual'].append(str(output_path.relative_to(submission_dir)))
+            
+        elif category == 'visual':
+            # Copy visual files directly
+            output_path = visual_dir / file_path.name
+            with tracer.span('file_write', cat='io', file=file_path.name):
+                self.stager.stage(file_path, output_path)
+            result['visual'].append(str(output_path.relative_to(submission_dir)))
+            
+        elif category == 'mixed':
+            # Notebooks are rendered in-process to markdown plus their image outputs
+            if file_path.suffix.lower() == '.ipynb' and self.notebook_renderer == 'native':
+                rendered = self.render_notebook(file_path, textual_dir, visual_dir)
+                if rendered is not None:
+                    markdown_path, images = rendered
+                    result['textual'].append(str(markdown_path.relative_to(submission_dir)))
+                    for img in images:
+                        result['visual'].append(str(img.relative_to(submission_dir)))
+                    return result
+            
+            # Send each page as text or as an image
+            if self.page_modality == 'page' and file_path.suffix.lower() in self.PAGED_EXTENSIONS:
+                split, split_error = self.split_pages_by_modality(file_path, textual_dir, visual_dir)
+                if split is None:
+                    result['failed'].append({
+                        'original_path': str(file_path),
+                        'filename': file_path.name,
+                        'size': file_path.stat().st_size,
+                        'category': category,
+                        'failure_reason': split_error,
+                        'conversion_type': 'PDF'
+                    })
+                    return result
+                text_file = None
+                if split['text_file']:
+                    text_file = str(split['text_file'].relative_to(submission_dir))
+                    result['textual'].append(text_file)
+                elif file_path.suffix.lower() == '.pdf':
+                    result['scanned_pdf'] = {
+                        'filename': file_path.name,
+                        'size': file_path.stat().st_size,
+                        'text_sample': "No text pages"
+                    }
+                for img in split['images']:
+                    result['visual'].append(str(img.relative_to(submission_dir)))
+                result['page_modality'] = {'filename': file_path.name, 'text_file': text_file, 'pages': split['pages']}
+                return result
+            
+            # Handle PDFs specially - check for extractable text
+            if file_path.suffix.lower() == '.pdf':
+                has_text, text_sample = self.has_extractable_text(file_path)
+                
+                if has_text:
+                    # Process for textual
+                    pdf_file, pdf_error = self.convert_to_pdf(file_path, textual_dir)
+                    if pdf_file:
+                        result['textual'].append(str(pdf_file.relative_to(submission_dir)))
+                    else:
+                        # PDF conversion failed, track this file
+                        result['failed'].append({
+                            'original_path': str(file_path),
+                            'filename': file_path.name,
+                            'size': file_path.stat().st_size,
+                            'category': category,
+                            'failure_reason': f'PDF conversion failed: {pdf_error}',
+                            'conversion_type': 'PDF'
+                        })
+                else:
+                    # Scanned PDF - skip textual processing
+                    result['scanned_pdf'] = {
+                        'filename': file_path.name,
+                        'size': file_path.stat().st_size,
+                        'text_sample': text_sample[:100] if text_sample else "No text found"
+                    }
+            else:
+                # Non-PDF mixed file - process for textual
+                pdf_file, pdf_error = self.convert_to_pdf(file_path, textual_dir)
+                if pdf_file:
+                    result['textual'].append(str(pdf_file.relative_to(submission_dir)))
+                else:
+                    # PDF conversion failed, track this file
+                    result['failed'].append({
+                        'original_path': str(file_path),
+                        'filename': file_path.name,
+                        'size': file_path.stat().st_size,
+                        'category': category,
+                        'failure_reason': f'PDF conversion failed: {pdf_error}',
+                        'conversion_type': 'PDF'
+                    })
+            
+            # Always convert to images for visual analysis
+            images, img_error = self.convert_to_images(file_path, visual_dir)
+            if images:
+                for img in images:
+                    result['visual'].append(str(img.relative_to(submission_dir)))
+            else:
+                result['failed'].append({
+                    'original_path': str(file_path),
+                    'filename': file_path.name,
+                    'size': file_path.stat().st_size,
+                    'category': category,
+                    'failure_reason': f'Image conversion failed: {img_error}',
+                    'conversion_type': 'Image'
+                })
+        
+        return result
+    
+    def _process_submission_directory(self, submission_dir: Path) -> Tuple[bool, Optional[str]]:
         logger.info(f"Processing submission: {submission_dir.name}")
         
-        # Skip if already processed
+        # Compare with the manifest of the last run: skip, update incrementally or rebuild
         processed_dir = submission_dir / "processed"
+        settings = self.output_settings()
+        sources = scan_sources(submission_dir)
+        manifest = None
         if processed_dir.exists():
-            logger.info(f"Skipping {submission_dir.name} - already processed")
-            return True, None
+            manifest = SubmissionManifest.load(processed_dir)
+            if manifest is None and (processed_dir / "preprocess_info.json").exists():
+                # Processed before manifests were written
+                logger.info(f"Skipping {submission_dir.name} - already processed")
+                return True, None
+            if manifest is None:
+                logger.info(f"Previous run of {submission_dir.name} did not finish, rebuilding")
+                shutil.rmtree(processed_dir)
+            elif manifest.settings != settings:
+                logger.info(f"Preprocessing settings changed, rebuilding {submission_dir.name}")
+                shutil.rmtree(processed_dir)
+                manifest = None
+            elif manifest.sources == sources:
+                logger.info(f"Skipping {submission_dir.name} - already processed, no file changed")
+                return True, None
         
         failed_files = []
         skipped_files = []
-        scanned_pdfs = []  # Track PDFs that were processed as visual-only
         
-        # Create temporary directory for flattening
-        with tempfile.TemporaryDirectory() as temp_dir_str:
+        # Create temporary directory for flattening, next to the submissions so files can be linked
+        with tempfile.TemporaryDirectory(dir=self.staging_root(submission_dir)) as temp_dir_str:
             temp_dir = Path(temp_dir_str)
             
             # Flatten directory structure and extract archives
-            all_files = self.flatten_directory(submission_dir, temp_dir)
+            origins = {}
+            all_files = self.flatten_directory(submission_dir, temp_dir, origins)
             
             if not all_files:
                 logger.warning(f"No files found in {submission_dir.name}")
+                if processed_dir.exists():
+                    shutil.rmtree(processed_dir)
                 return False, "No processable files found"
             
             # Create processed subdirectories only after confirming we have files
@@ -568,12 +1282,10 @@ class SubmissionPreprocessor:
             for dir_path in [processed_dir, textual_dir, visual_dir]:
                 dir_path.mkdir(exist_ok=True)
             
-            # Track processing results
-            original_files = []
-            textual_outputs = []
-            visual_outputs = []
-            
-            # Categorize and process files
+            # Diff the files against the manifest: unchanged files keep their outputs
+            previous = manifest.files if manifest else {}
+            file_entries = {}  # Manifest entry of every file, in processing order
+            pending = {}  # Files to convert: origin -> (path, category)
             for file_path in all_files:
                 should_process, category, skip_reason = self.should_process_file(file_path)
                 
@@ -585,105 +1297,181 @@ class SubmissionPreprocessor:
                     })
                     continue
                 
-                original_files.append({
+                origin = origins[file_path]
+                stat = file_path.stat()
+                entry = {
                     'name': file_path.name,
-                    'size': file_path.stat().st_size,
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'sha256': manifest.digest(origin, file_path) if manifest else file_digest(file_path),
                     'category': category
+                }
+                old = previous.get(origin)
+                if (old and old['sha256'] == entry['sha256']
+                        and all((submission_dir / rel).exists() for rel in SubmissionManifest.outputs(old))):
+                    entry.update({key: old[key] for key in OUTPUT_KEYS})
+                else:
+                    pending[origin] = (file_path, category)
+                file_entries[origin] = entry
+            
+            removed = [origin for origin in previous if origin not in file_entries]
+            if removed or any(origin in previous for origin in pending):
+                # Images dropped as duplicates may have duplicated a file that is gone now
+                paths = {origin: path for path, origin in origins.items()}
+                for origin, entry in file_entries.items():
+                    if origin not in pending and (entry['dropped_images'] or any(
+                            d['action'] == 'drop_duplicate' for d in entry['decisions'])):
+                        pending[origin] = (paths[origin], entry['category'])
+            
+            if not pending and not removed:
+                # Only timestamps changed: the outputs and downstream results stay valid
+                SubmissionManifest(settings, sources, file_entries).save(processed_dir)
+                logger.info(f"Skipping {submission_dir.name} - no file content changed")
+                return True, None
+            
+            # Delete the outputs of removed and changed files
+            for origin in removed + [origin for origin in pending if origin in previous]:
+                for rel in SubmissionManifest.outputs(previous[origin]):
+                    (submission_dir / rel).unlink(missing_ok=True)
+            if manifest:
+                logger.info(f"Updating {submission_dir.name}: {len(pending)} files to convert, "
+                            f"{len(file_entries) - len(pending)} unchanged, {len(removed)} removed")
+            
+            # New files must not produce output names of unchanged files
+            taken = {Path(file_entries[origin]['name']).stem for origin in file_entries if origin not in pending}
+            for origin, (file_path, category) in pending.items():
+                if file_path.stem in taken:
+                    counter = 1
+                    target_path = temp_dir / f"{file_path.stem}_{counter}{file_path.suffix}"
+                    while target_path.stem in taken or target_path.exists():
+                        counter += 1
+                        target_path = temp_dir / f"{file_path.stem}_{counter}{file_path.suffix}"
+                    # A new name in the staging directory (file_path may be a source read in place)
+                    self.stager.stage(file_path, target_path)
+                    pending[origin] = (target_path, category)
+                taken.add(pending[origin][0].stem)
+            
+            # Convert the office documents of the submission together when LibreOffice is cold-started
+            office_files = [f for f, category in pending.values() if f.suffix.lower() in self.OFFICE_EXTENSIONS
+                            and not self._conversion_cached(f)]
+            if self.office_pool is None and len(office_files) > 1:
+                self._local.office_pdfs = self.batch_convert_office(office_files, temp_dir / "_office_batches")
+            
+            # Earlier decisions of unchanged files (page truncation, dropped duplicates) still hold
+            for origin, entry in file_entries.items():
+                if origin not in pending:
+                    self._local.budget_decisions.extend(entry['decisions'])
+            
+            for origin, (file_path, category) in pending.items():
+                decisions_before = len(self._local.budget_decisions)
+                result = self.convert_submission_file(file_path, category, submission_dir, textual_dir, visual_dir)
+                failed_files.extend(result['failed'])
+                file_entries[origin].update({
+                    'name': file_path.name,
+                    'textual': result['textual'],
+                    'visual': result['visual'],
+                    'scanned_pdf': result['scanned_pdf'],
+                    'page_modality': result['page_modality'],
+                    'dropped_images': [],
+                    'decisions': self._local.budget_decisions[decisions_before:]
                 })
-                
-                if category == 'textual':
-                    # Copy textual files directly
-                    output_path = textual_dir / file_path.name
-                    shutil.copy2(file_path, output_path)
-                    textual_outputs.append(str(output_path.relative_to(submission_dir)))
-                    
-                elif category == 'visual':
-                    # Copy visual files directly
-                    output_path = visual_dir / file_path.name
-                    shutil.copy2(file_path, output_path)
-                    visual_outputs.append(str(output_path.relative_to(submission_dir)))
-                    
-                elif category == 'mixed':
-                    # Handle PDFs specially - check for extractable text
-                    if file_path.suffix.lower() == '.pdf':
-                        has_text, text_sample = self.has_extractable_text(file_path)
-                        
-                        if has_text:
-                            # Process for textual
-                            pdf_file, pdf_error = self.convert_to_pdf(file_path, textual_dir)
-                            if pdf_file:
-                                textual_outputs.append(str(pdf_file.relative_to(submission_dir)))
-                            else:
-                                # PDF conversion failed, track this file
-                                failed_files.append({
-                                    'original_path': str(file_path),
-                                    'filename': file_path.name,
-                                    'size': file_path.stat().st_size,
-                                    'category': category,
-                                    'failure_reason': f'PDF conversion failed: {pdf_error}',
-                                    'conversion_type': 'PDF'
-                                })
-                        else:
-                            # Scanned PDF - skip textual processing
-                            scanned_pdfs.append({
-                                'filename': file_path.name,
-                                'size': file_path.stat().st_size,
-                                'text_sample': text_sample[:100] if text_sample else "No text found"
-                            })
-                    else:
-                        # Non-PDF mixed file - process for textual
-                        pdf_file, pdf_error = self.convert_to_pdf(file_path, textual_dir)
-                        if pdf_file:
-                            textual_outputs.append(str(pdf_file.relative_to(submission_dir)))
-                        else:
-                            # PDF conversion failed, track this file
-                            failed_files.append({
-                                'original_path': str(file_path),
-                                'filename': file_path.name,
-                                'size': file_path.stat().st_size,
-                                'category': category,
-                                'failure_reason': f'PDF conversion failed: {pdf_error}',
-                                'conversion_type': 'PDF'
-                            })
-                    
-                    # Always convert to images for visual analysis
-                    images, img_error = self.convert_to_images(file_path, visual_dir)
-                    if images:
-                        for img in images:
-                            visual_outputs.append(str(img.relative_to(submission_dir)))
-                    else:
-                        failed_files.append({
-                            'original_path': str(file_path),
-                            'filename': file_path.name,
-                            'size': file_path.stat().st_size,
-                            'category': category,
-                            'failure_reason': f'Image conversion failed: {img_error}',
-                            'conversion_type': 'Image'
-                        })
+            
+            # Outputs of all files, in processing order
+            owner = {}
+            textual_outputs = []
+            visual_outputs = []
+            for origin, entry in file_entries.items():
+                for rel in entry['textual']:
+                    owner[rel] = origin
+                    textual_outputs.append(rel)
+                for rel in entry['visual']:
+                    owner[rel] = origin
+                    visual_outputs.append(rel)
+            
+            # Drop blank pages and repeated photos of the same sheet before they are uploaded
+            dropped_images = self.drop_redundant_images(submission_dir, visual_outputs) if self.image_filter else []
+            image_optimization = None
+            if self.image_optimization:
+                # Images of unchanged files were optimized by an earlier run
+                new_images = [rel for rel in visual_outputs if owner[rel] in pending]
+                before = list(new_images)
+                image_optimization = self.optimize_images(submission_dir, new_images)
+                renamed = dict(zip(before, new_images))
+                for old_rel, new_rel in renamed.items():
+                    owner[new_rel] = owner[old_rel]
+                visual_outputs[:] = [renamed.get(rel, rel) for rel in visual_outputs]
+            
+            # Fit the submission into the token budget: shrink inputs first, shard only if still too large
+            with tracer.span('budget_plan', cat='submission'):
+                budget = self.budget_planner.plan(submission_dir, textual_outputs, visual_outputs,
+                                                  self._local.budget_decisions)
+            
+            # Record the final outputs and decisions of every file
+            for entry in file_entries.values():
+                entry['textual'] = []
+                entry['visual'] = []
+            for rel in textual_outputs:
+                file_entries[owner[rel]]['textual'].append(rel)
+            for rel in visual_outputs:
+                file_entries[owner[rel]]['visual'].append(rel)
+            for record in dropped_images:
+                file_entries[owner[record['filename']]]['dropped_images'].append(record)
+            for decision in budget['decisions'][len(self._local.budget_decisions):]:
+                if decision['action'] == 'drop_duplicate':
+                    file_entries[owner[decision['file']]]['decisions'].append(decision)
+            new_manifest = SubmissionManifest(settings, sources, file_entries)
+            
+            original_files = [{'name': e['name'], 'size': e['size'], 'category': e['category']}
+                              for e in file_entries.values()]
+            scanned_pdfs = [e['scanned_pdf'] for e in file_entries.values() if e['scanned_pdf']]
+            page_modalities = [e['page_modality'] for e in file_entries.values() if e['page_modality']]
+            dropped_images = [record for e in file_entries.values() for record in e['dropped_images']]
             
             # Create preprocessing info
             preprocess_info = {
                 'submission_name': submission_dir.name,
                 'processing_timestamp': str(subprocess.run(['date'], capture_output=True, text=True).stdout.strip()),
+                'input_fingerprint': new_manifest.fingerprint,
+                'incremental': {
+                    'converted': list(pending),
+                    'unchanged': len(file_entries) - len(pending),
+                    'removed': removed
+                },
                 'original_files': original_files,
                 'textual_files': textual_outputs,
                 'visual_files': visual_outputs,
                 'skipped_files': skipped_files,
                 'scanned_pdfs': scanned_pdfs,
+                'page_modality': page_modalities,
+                'dropped_images': dropped_images,
+                'image_optimization': image_optimization,
+                'budget': budget,
+                'artifact_cache': dict(self._local.cache_stats) if self.artifact_cache else None,
+                'resource_usage': {
+                    'per_file': self._local.resource_records,
+                    'per_converter': summarize_usage(self._local.resource_records)
+                },
                 'summary': {
                     'total_original_files': len(original_files),
                     'textual_outputs': len(textual_outputs),
                     'visual_outputs': len(visual_outputs),
                     'skipped_files': len(skipped_files),
                     'failed_files': len(failed_files),
-                    'scanned_pdfs': len(scanned_pdfs)
+                    'scanned_pdfs': len(scanned_pdfs),
+                    'text_pages': sum(p['modality'] == 'text' for doc in page_modalities for p in doc['pages']),
+                    'image_pages': sum(p['modality'] == 'image' for doc in page_modalities for p in doc['pages']),
+                    'dropped_images': len(dropped_images),
+                    'image_bytes_saved': image_optimization['bytes_saved'] if image_optimization else 0,
+                    'estimated_tokens': budget['estimated_tokens'],
+                    'shards': len(budget['shards'])
                 }
             }
             
             # Save preprocessing info
             info_path = processed_dir / "preprocess_info.json"
-            with open(info_path, 'w', encoding='utf-8') as f:
-                json.dump(preprocess_info, f, indent=2)
+            with tracer.span('file_write', cat='io', file=info_path.name):
+                with open(info_path, 'w', encoding='utf-8') as f:
+                    json.dump(preprocess_info, f, indent=2)
             
             # Save failed files if any
             if failed_files:
@@ -715,6 +1503,8 @@ class SubmissionPreprocessor:
                 logger.warning(f"Failed to process {submission_dir.name}: {failure_reason}")
                 return False, failure_reason
             
+            # The manifest is written last, so an interrupted run is redone rather than trusted
+            new_manifest.save(processed_dir)
             logger.info(f"Processed {submission_dir.name}: {preprocess_info['summary']}")
             return True, None
     
@@ -728,6 +1518,7 @@ class SubmissionPreprocessor:
                           if d.is_dir() and not d.name.startswith('#')]
         
         logger.info(f"Found {len(submission_dirs)} submissions to preprocess")
+        progress.start(['preprocess'], len(submission_dirs), workers)
         
         if workers == 1:
             # Sequential processing
@@ -795,6 +1586,8 @@ class SubmissionPreprocessor:
                             results[submission_name] = False
                             failed_submissions[submission_name] = "Processing cancelled"
         
+        progress.stop()
+        
         # Generate summary
         successful = sum(results.values())
         total = len(results)
@@ -803,7 +1596,10 @@ class SubmissionPreprocessor:
             'total_submissions': total,
             'successful_preprocessing': successful,
             'failed_preprocessing': total - successful,
-            'failed_submissions': failed_submissions  # Only include failed ones with reasons
+            'failed_submissions': failed_submissions,  # Only include failed ones with reasons
+            'converter_resources': self.resource_summary(),
+            'staging': self.stager.summary(),
+            'scheduler': self.scheduler.summary()
         }
         
         # Save summary report
@@ -811,6 +1607,19 @@ class SubmissionPreprocessor:
         with open(summary_path, 'w', encoding='utf-8') as f:
             json.dump(summary_report, f, indent=2)
         
+        # Empty once every temporary flattening directory is gone
+        try:
+            (submissions_dir / "#staging").rmdir()
+        except OSError:
+            pass
+        
+        staging = self.stager.summary()
+        logger.info(f"Staging ({staging['mode']}): " + (", ".join(
+            f"{count} files by {method} ({staging['bytes'][method] / 1024 ** 2:.1f} MB)"
+            for method, count in staging['files'].items()) or "no files"))
+        logger.info("Converter slots: " + ", ".join(
+            f"{name} {c['slots']} ({c['admitted']} run, {c['queue_seconds_total']:.1f}s queued)"
+            for name, c in summary_report['scheduler'].items()))
         logger.info(f"Preprocessing complete: {successful}/{total} submissions processed successfully")
         if failed_submissions:
             logger.warning(f"Failed submissions: {list(failed_submissions.keys())}")
@@ -834,6 +1643,52 @@ def main():
     parser.add_argument('submissions_dir', type=Path, help='Directory containing submissions')
     parser.add_argument('--workers', type=int, default=4,
                        help='Number of parallel workers (default: 4, use 1 for sequential)')
+    parser.add_argument('--cpu_workers', type=int, default=0,
+                       help='Worker processes for image resizing, PDF page reading and zip/tar extraction '
+                            '(default: 0, run them in the submission threads)')
+    parser.add_argument('--cpu_task_timeout', type=float, default=120,
+                       help='Timeout in seconds of a single task in the CPU worker pool, including queueing (default: 120)')
+    parser.add_argument('--office_listeners', type=int, default=0,
+                       help='Persistent LibreOffice instances for office document conversion '
+                            '(default: 0, start LibreOffice for every file)')
+    parser.add_argument('--notebook_renderer', choices=['native', 'nbconvert'], default='native',
+                       help='Render notebooks in-process to markdown and images (native) or convert them '
+                            'to PDF with jupyter nbconvert (default: native)')
+    parser.add_argument('--page_modality', choices=['page', 'file'], default='page',
+                       help='Send each page of PDFs and office documents as extracted text or as an image (page), '
+                            'or send the whole PDF plus images of all pages (file) (default: page)')
+    parser.add_argument('--raster_workers', type=int, default=2,
+                       help='Concurrent pdftoppm processes rendering the page ranges of one PDF (default: 2)')
+    parser.add_argument('--no_image_filter', action='store_true',
+                       help='Keep blank images and near-duplicate photos of the same page')
+    parser.add_argument('--no_image_optimization', action='store_true',
+                       help='Upload images without cropping, grayscale/bilevel re-encoding and token budget scaling')
+    parser.add_argument('--max_image_tokens', type=int, default=1032,
+                       help='Input token budget of a single image; larger images are downscaled '
+                            '(default: 1032, four 768x768 tiles at 258 tokens each)')
+    parser.add_argument('--token_budget', type=int, default=100000,
+                       help='Estimated input tokens per submission; larger submissions are deduplicated, '
+                            'downscaled and finally split into shards parsed separately (default: 100000, 0: no budget)')
+    parser.add_argument('--cache_dir', type=Path, default=None,
+                       help='Cache converted PDFs, page images and page text here by input content and settings, '
+                            'shared across submissions and runs (default: no cache)')
+    parser.add_argument('--cache_max_gb', type=float, default=10,
+                       help='Size limit of the artifact cache; least recently used entries are evicted (default: 10)')
+    parser.add_argument('--staging', choices=STAGING_MODES, default='auto',
+                       help='How input files are staged: reflink, hardlink or copy, whichever works first (auto), '
+                            'one method (reflink and hardlink fall back to copy), or read inputs in place '
+                            '(reference) (default: auto)')
+    parser.add_argument('--heavy_slots', type=int, default=0,
+                       help='Concurrent LibreOffice, nbconvert and pandoc processes across all workers '
+                            '(default: 0, one per two CPUs and per GB of RAM)')
+    parser.add_argument('--medium_slots', type=int, default=0,
+                       help='Concurrent pdftoppm and 7z processes across all workers (default: 0, one per CPU)')
+    parser.add_argument('--light_slots', type=int, default=0,
+                       help='Concurrent pdftotext and pdfimages processes across all workers (default: 0, two per CPU)')
+    parser.add_argument('--trace_file', type=Path, default=None,
+                       help='Write a Chrome trace-event JSON file of the run')
+    metrics.add_metrics_arguments(parser)
+    add_progress_arguments(parser)
     
     args = parser.parse_args()
     
@@ -841,12 +1696,43 @@ def main():
         logger.error(f"Submissions directory not found: {args.submissions_dir}")
         sys.exit(1)
     
+    if args.trace_file:
+        tracer.enable()
+    progress.enable(args.progress)
+    exporter = metrics.start_metrics_export(args)
+    
+    preprocessor = None
     try:
-        preprocessor = SubmissionPreprocessor()
+        preprocessor = SubmissionPreprocessor(
+            cpu_workers=args.cpu_workers,
+            cpu_task_timeout=args.cpu_task_timeout,
+            office_listeners=args.office_listeners,
+            notebook_renderer=args.notebook_renderer,
+            page_modality=args.page_modality,
+            raster_workers=args.raster_workers,
+            image_filter=not args.no_image_filter,
+            image_optimization=not args.no_image_optimization,
+            max_image_tokens=args.max_image_tokens,
+            token_budget=args.token_budget,
+            cache_dir=args.cache_dir,
+            cache_max_bytes=int(args.cache_max_gb * 1024 ** 3),
+            staging=args.staging,
+            heavy_slots=args.heavy_slots,
+            medium_slots=args.medium_slots,
+            light_slots=args.light_slots
+        )
         results = preprocessor.preprocess_all_submissions(args.submissions_dir, workers=args.workers)
     except KeyboardInterrupt:
         logger.info("Processing interrupted by user")
         sys.exit(0)
+    finally:
+        if preprocessor is not None:
+            preprocessor.close()
+        if exporter is not None:
+            exporter.stop()
+        if args.trace_file:
+            event_count = tracer.export_chrome_trace(args.trace_file)
+            logger.info(f"Trace with {event_count} events written to {args.trace_file}")
     
     # Print final summary
     successful = sum(results.values())
@@ -858,7 +1744,7 @@ def main():
     
     if successful > 0:
         print(f"\nProcessed submissions now have:")
-        print(f"- processed/textual/ folder with PDF files and text files")
+        print(f"- processed/textual/ folder with text files (and PDF files with --page_modality file)")
         print(f"- processed/visual/ folder with image files")
         print(f"- processed/preprocess_info.json with processing details")
 
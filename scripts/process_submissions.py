@@ -11,10 +11,14 @@ import re
 import logging
 import concurrent.futures
 from pathlib import Path
-import google.generativeai as genai
 from typing import List, Dict, Any, Optional, Tuple
-from prompts import submission_extract_and_parse_instruction, grading_instruction
-from utils import calculate_gemini_cost
+from prompts import submission_extract_and_parse_instruction, submission_chunk_parse_instruction, grading_instruction
+from llm_backends import LLMBackend, LLMBackendError, add_backend_arguments, create_backend, requires_gemini_key, error_status_code
+from cassette import Cassette, add_cassette_arguments, open_cassette, apply_cassette
+from tracing import tracer
+from progress import progress, add_progress_arguments
+import metrics
+from utils import page_order_key
 
 # Configure logging
 logging.basicConfig(
@@ -49,8 +53,8 @@ def parse_arguments():
     
     parser.add_argument(
         '--api_key',
-        required=True,
-        help='Gemini API key'
+        default=None,
+        help='Gemini API key (required for the gemini backend unless replaying a cassette)'
     )
 
     parser.add_argument(
@@ -74,12 +78,47 @@ def parse_arguments():
         help='Number of retries for API calls'
     )
     
+    parser.add_argument(
+        '--retry_delay',
+        type=float,
+        default=5,
+        help='Initial delay in seconds between API retries (doubled after every attempt)'
+    )
+    
+    parser.add_argument(
+        '--parse_chunk_pages',
+        type=int,
+        default=20,
+        help='Parse submissions with more pages than this in page-ordered chunks of at most this many pages (0 to disable); '
+             'submissions sharded by the preprocessing token budget are always parsed per shard'
+    )
+    
+    parser.add_argument(
+        '--parse_chunk_workers',
+        type=int,
+        default=4,
+        help='Number of chunks of one submission parsed concurrently'
+    )
+    
     parser.add_argument(
         '--regrade',
         action='store_true',
         help='Only regrade submissions without parsing them again'
     )
     
+    add_backend_arguments(parser, ['parse', 'grade'])
+    add_cassette_arguments(parser)
+    
+    parser.add_argument(
+        '--trace_file',
+        type=Path,
+        default=None,
+        help='Write a Chrome trace-event JSON file of the run'
+    )
+    
+    metrics.add_metrics_arguments(parser)
+    add_progress_arguments(parser)
+    
     args = parser.parse_args()
     
     # Validate inputs
@@ -87,22 +126,38 @@ def parse_arguments():
         parser.error(f"Submissions directory not found: {args.submissions_dir}")
     if not args.solution_dir.exists():
         parser.error(f"Solution directory not found: {args.solution_dir}")
-    if not args.api_key:
-        parser.error(f"API key not provided")
+    if not args.api_key and requires_gemini_key(args, ['parse', 'grade']):
+        parser.error("--api_key is required for the gemini backend")
     
     return args
 
 
 
-def configure_gemini(api_key: str):
-    """Configure Gemini API."""
-    logger.info("Configuring Gemini API...")
+def create_stage_backends(args, cassette: Optional[Cassette] = None) -> Tuple[LLMBackend, LLMBackend]:
+    """Create the LLM backends for the parse and grade stages.
+    
+    With a cassette the backends either record their interactions or, in replay
+    mode, are replaced by the recorded responses.
+    """
+    logger.info("Initializing LLM backends...")
     try:
-        genai.configure(api_key=api_key)
-        logger.info("Gemini API configured successfully.")
+        if args.replay_cassette:
+            parse_backend, grade_backend = None, None
+        else:
+            parse_backend = create_backend(args.parse_backend, args, args.model_type)
+            if args.grade_backend == args.parse_backend:
+                grade_backend = parse_backend
+            else:
+                grade_backend = create_backend(args.grade_backend, args, args.model_type)
+        parse_backend = apply_cassette(parse_backend, cassette, 'parse', args)
+        grade_backend = apply_cassette(grade_backend, cassette, 'grade', args)
     except Exception as e:
-        logger.error(f"Failed to configure Gemini API: {str(e)}")
+        logger.error(f"Failed to initialize LLM backends: {str(e)}")
         raise
+    
+    logger.info(f"Parse backend: {parse_backend.describe()}")
+    logger.info(f"Grade backend: {grade_backend.describe()}")
+    return parse_backend, grade_backend
 
 def read_solution_info(solution_dir: Path) -> tuple[Path, str]:
     """Read solution paths from processed_solution_info.json."""
@@ -154,6 +209,28 @@ def read_preprocess_info(submission_dir: Path) -> Optional[Dict[str, Any]]:
         logger.error(f"Invalid JSON in preprocessing info file: {str(e)}")
         return None
 
+def stale_results(submission_dir: Path) -> Dict[str, bool]:
+    """
+    Whether the parse and grade results of a submission were made from other preprocessed inputs
+    than the current ones (by input_fingerprint). Results of runs that recorded none count as current.
+    """
+    fingerprint = (read_preprocess_info(submission_dir) or {}).get('input_fingerprint')
+    metadata = {}
+    metadata_path = submission_dir / "grading_metadata.json"
+    if metadata_path.exists():
+        try:
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+        except json.JSONDecodeError:
+            logger.warning(f"Invalid JSON in metadata file: {metadata_path}")
+    
+    def stale(stage: str) -> bool:
+        recorded = (metadata.get(stage) or {}).get('input_fingerprint')
+        return bool(fingerprint and recorded and recorded != fingerprint)
+    
+    parse_stale = stale('parsing')
+    return {'parse': parse_stale, 'grade': parse_stale or stale('grading')}
+
 def parse_student_details(submission_dir: Path) -> Dict[str, str]:
     """Parse student details from submission directory name."""
     dir_name = submission_dir.name
@@ -206,23 +283,49 @@ def extract_json_from_report(report: str) -> Dict[str, Any]:
             "raw_json_str": json_str
         }
 
-def api_call_with_retry(func, *args, max_retries=3, retry_delay=5, **kwargs):
-    """Execute an API call with retry logic."""
+def api_call_with_retry(func, *args, max_retries=3, retry_delay=5, stage='api', validate=None, **kwargs):
+    """Execute an API call with retry logic. validate may raise on a result that should be retried."""
+    span_name = f"api_call:{getattr(func, '__name__', 'call')}"
+    backend = getattr(func, '__self__', None)
     for attempt in range(max_retries + 1):
+        start_time = time.time()
         try:
-            return func(*args, **kwargs)
+            with tracer.span(span_name, cat='llm', attempt=attempt + 1):
+                result = func(*args, **kwargs)
+                if validate is not None:
+                    validate(result)
+            metrics.GENERATE_SECONDS.labels(stage=stage).observe(time.time() - start_time)
+            progress.record_api_call(rate_limit_remaining=getattr(backend, 'rate_limit_remaining', None))
+            return result
         except Exception as e:
+            metrics.GENERATE_SECONDS.labels(stage=stage).observe(time.time() - start_time)
+            metrics.API_ERRORS.labels(stage=stage, code=error_status_code(e) or 'unknown').inc()
+            progress.record_api_call(error_status_code(e), getattr(backend, 'rate_limit_remaining', None))
             if attempt < max_retries:
+                metrics.RETRIES.labels(stage=stage).inc()
                 delay = retry_delay * (2 ** attempt)  # Exponential backoff
                 logger.warning(f"API call failed (attempt {attempt+1}/{max_retries+1}): {str(e)}")
                 logger.info(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
+                with tracer.span('retry_sleep', cat='llm', attempt=attempt + 1, delay=delay):
+                    time.sleep(delay)
             else:
                 logger.error(f"API call failed after {max_retries+1} attempts: {str(e)}")
                 raise
 
-def upload_files_from_preprocessed(submission_dir: Path) -> Tuple[List, Optional[Dict]]:
-    """Upload textual and visual files from preprocessed submission."""
+def timed_upload(backend: LLMBackend, file_path: Path, stage: str):
+    """Upload a file through the backend, tracing and measuring the upload."""
+    start_time = time.time()
+    with tracer.span('upload', cat='llm', file=file_path.name):
+        uploaded_file = backend.upload(file_path)
+    metrics.UPLOAD_SECONDS.labels(stage=stage).observe(time.time() - start_time)
+    return uploaded_file
+
+def upload_files_from_preprocessed(submission_dir: Path, backend: LLMBackend,
+                                   files: Optional[List[str]] = None) -> Tuple[List, Optional[Dict]]:
+    """
+    Upload textual and visual files from preprocessed submission.
+    With files (paths relative to submission_dir, e.g. one parse chunk), only those are uploaded.
+    """
     processed_dir = submission_dir / "processed"
     textual_dir = processed_dir / "textual"
     visual_dir = processed_dir / "visual"
@@ -236,13 +339,19 @@ def upload_files_from_preprocessed(submission_dir: Path) -> Tuple[List, Optional
     uploaded_files = []
     
     try:
+        if files is not None:
+            logger.info(f"Uploading {len(files)} files of chunk...")
+            for name in files:
+                uploaded_files.append(timed_upload(backend, submission_dir / name, 'parse'))
+            return uploaded_files, preprocess_info
+        
         # Upload textual files
         if textual_dir.exists():
             textual_files = list(textual_dir.iterdir())
             logger.info(f"Uploading {len(textual_files)} textual files...")
             for file_path in textual_files:
                 if file_path.is_file():
-                    uploaded_file = genai.upload_file(str(file_path))
+                    uploaded_file = timed_upload(backend, file_path, 'parse')
                     uploaded_files.append(uploaded_file)
                     logger.debug(f"Uploaded textual file: {file_path.name}")
         
@@ -256,7 +365,7 @@ def upload_files_from_preprocessed(submission_dir: Path) -> Tuple[List, Optional
                 batch = visual_files[i:i+batch_size]
                 for file_path in batch:
                     if file_path.is_file():
-                        uploaded_file = genai.upload_file(str(file_path))
+                        uploaded_file = timed_upload(backend, file_path, 'parse')
                         uploaded_files.append(uploaded_file)
                         logger.debug(f"Uploaded visual file: {file_path.name}")
                 logger.info(f"Uploaded batch of {len(batch)} visual files")
@@ -268,8 +377,67 @@ def upload_files_from_preprocessed(submission_dir: Path) -> Tuple[List, Optional
         logger.error(f"Error uploading files: {str(e)}")
         return [], preprocess_info
 
-def parse_submission(submission_dir: Path, model, retry_count: int = 3) -> Optional[str]:
-    """Parse a single submission using Gemini model with preprocessed files."""
+def plan_parse_chunks(preprocess_info: Optional[Dict[str, Any]], chunk_pages: int) -> List[Optional[List[str]]]:
+    """
+    Split the outputs of a submission into page-ordered chunks parsed by separate requests.
+    Budget shards from preprocessing are used as they are; otherwise a submission with more than
+    chunk_pages pages is cut into chunks of at most chunk_pages pages (a text file of typed pages
+    counts its pages and is never split). [None] means one request with all files.
+    """
+    if not preprocess_info:
+        return [None]
+    shards = (preprocess_info.get('budget') or {}).get('shards') or []
+    if len(shards) > 1:
+        return [shard['files'] for shard in shards]
+    # Page numbers of the typed pages in each <stem>_pages.txt, as recorded by preprocessing
+    text_pages = {doc['text_file']: [page['number'] for page in doc['pages'] if page['modality'] == 'text']
+                  for doc in preprocess_info.get('page_modality') or [] if doc.get('text_file')}
+    files = preprocess_info.get('textual_files', []) + preprocess_info.get('visual_files', [])
+    pages = {name: len(text_pages.get(name) or [name]) for name in files}
+    if chunk_pages <= 0 or sum(pages.values()) <= chunk_pages:
+        return [None]
+    
+    chunks = []
+    current, current_pages = [], 0
+    for name in sorted(files, key=lambda name: page_order_key(name, text_pages.get(name))):
+        if current and current_pages + pages[name] > chunk_pages:
+            chunks.append(current)
+            current, current_pages = [], 0
+        current.append(name)
+        current_pages += pages[name]
+    chunks.append(current)
+    return chunks
+
+EXERCISE_HEADER = re.compile(r'^#+\s*Exercise\s+([\w.]+)', re.IGNORECASE)
+
+def merge_parsed_chunks(parts: List[str]) -> str:
+    """
+    Concatenate the markdown of consecutive chunks. When a chunk starts by repeating the header of
+    the exercise the previous chunk ended in, the repeated header is dropped.
+    """
+    merged = []
+    last_exercise = None
+    for part in parts:
+        lines = part.strip('\n').split('\n')
+        first = next((i for i, line in enumerate(lines) if line.strip()), None)
+        if first is not None and last_exercise is not None:
+            match = EXERCISE_HEADER.match(lines[first].strip())
+            if match and match.group(1).rstrip('.') == last_exercise:
+                logger.debug(f"Dropped repeated header of Exercise {last_exercise} at a chunk boundary")
+                del lines[first]
+        for line in lines:
+            match = EXERCISE_HEADER.match(line.strip())
+            if match:
+                last_exercise = match.group(1).rstrip('.')
+        merged.append('\n'.join(lines).strip('\n'))
+    return '\n\n'.join(part for part in merged if part)
+
+def parse_submission(submission_dir: Path, backend: LLMBackend, retry_count: int = 3, retry_delay: float = 5,
+                     chunk_pages: int = 20, chunk_workers: int = 4) -> Optional[str]:
+    """
+    Parse a single submission using the parse backend with preprocessed files.
+    Long submissions are parsed in page-ordered chunks, up to chunk_workers at a time, and merged in order.
+    """
     logger.info(f"Processing submission from: {submission_dir.name}")
     
     # Check if submission has been preprocessed
@@ -289,17 +457,75 @@ def parse_submission(submission_dir: Path, model, retry_count: int = 3) -> Optio
         logger.error(f"SUBMISSION NOT PREPROCESSED: {submission_dir.name} - Run preprocessing script first")
         return None
     
-    # Upload files from preprocessed directories
-    logger.info("Uploading preprocessed files...")
-    uploaded_files, preprocess_info = upload_files_from_preprocessed(submission_dir)
+    preprocess_info = read_preprocess_info(submission_dir)
+    chunks = plan_parse_chunks(preprocess_info, chunk_pages)
+    if len(chunks) > 1:
+        logger.info(f"Parsing {submission_dir.name} in {len(chunks)} chunks")
     
-    if not uploaded_files:
-        logger.warning(f"No files were uploaded for {submission_dir.name}")
-        return None
+    def parse_chunk(index: int, files: Optional[List[str]]):
+        with tracer.context(submission=submission_dir.name, stage='parse'), \
+                tracer.span('parse_chunk', cat='llm', chunk=index, chunks=len(chunks)):
+            # Upload files from preprocessed directories
+            logger.info("Uploading preprocessed files...")
+            uploaded_files, preprocess_info = upload_files_from_preprocessed(submission_dir, backend, files)
+            
+            if not uploaded_files:
+                logger.warning(f"No files were uploaded for {submission_dir.name}")
+                return None
+            
+            context_info = submission_context(submission_dir, preprocess_info, files, index, len(chunks))
+            chunk_instruction = None
+            if len(chunks) > 1:
+                chunk_instruction = (submission_chunk_parse_instruction
+                                     .replace("{part}", str(index + 1)).replace("{parts}", str(len(chunks))))
+            return parse_uploaded_files(backend, context_info, uploaded_files, retry_count, retry_delay,
+                                        chunk_instruction)
     
-    # Generate content with all context
-    logger.info("Parsing submission with Gemini...")
+    if len(chunks) == 1:
+        results = [parse_chunk(0, chunks[0])]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(chunk_workers, len(chunks))),
+                                                   thread_name_prefix='parse_chunk') as executor:
+            results = list(executor.map(parse_chunk, range(len(chunks)), chunks))
+    
+    parts = []
+    totals = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'cost_usd': 0.0,
+              'processing_time_seconds': 0.0, 'files_processed': 0}
+    model_type = backend.model_type
+    for index, result in enumerate(results):
+        if result is None:
+            if len(chunks) > 1:
+                logger.error(f"Chunk {index + 1}/{len(chunks)} of {submission_dir.name} failed")
+            return None
+        text, usage = result
+        parts.append(text)
+        model_type = usage['model_type']
+        for key in totals:
+            totals[key] += usage[key]
+    
+    if totals['files_processed']:
+        # Save cost metadata
+        metadata = {}
+        metadata['parsing'] = dict(totals, model_type=model_type, backend=backend.backend_name)
+        # Preprocessed inputs the result was parsed from
+        metadata['parsing']['input_fingerprint'] = (preprocess_info or {}).get('input_fingerprint')
+        if len(chunks) > 1:
+            metadata['parsing']['chunks'] = len(chunks)
+            # Chunks run concurrently: wall time of the stage, not the sum of the requests
+            metadata['parsing']['request_seconds_total'] = totals['processing_time_seconds']
+            metadata['parsing']['processing_time_seconds'] = max(usage['processing_time_seconds'] for _, usage in results)
+        
+        metadata_path = submission_dir / "grading_metadata.json"
+        with tracer.span('file_write', cat='io', file=metadata_path.name):
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+        logger.info(f"Cost metadata saved to: {metadata_path}")
     
+    return merge_parsed_chunks(parts) if len(parts) > 1 else parts[0]
+
+def submission_context(submission_dir: Path, preprocess_info: Optional[Dict[str, Any]], files: Optional[List[str]],
+                       index: int, chunk_count: int) -> str:
+    """Describe the structure of a submission (or of one of its chunks) for the parse prompt."""
     # Create context about the submission structure
     context_info = f"""
 Submission Structure Information:
@@ -311,7 +537,11 @@ Submission Structure Information:
 The following files have been uploaded for analysis:
 """
     
-    if preprocess_info:
+    if files is not None and chunk_count > 1:
+        context_info += f"\nFiles of part {index + 1} of {chunk_count}:\n"
+        for file_path in files:
+            context_info += f"- {file_path}\n"
+    elif preprocess_info:
         context_info += "\nTextual files:\n"
         for file_path in preprocess_info.get('textual_files', []):
             context_info += f"- {file_path}\n"
@@ -320,54 +550,69 @@ The following files have been uploaded for analysis:
         for file_path in preprocess_info.get('visual_files', []):
             context_info += f"- {file_path}\n"
     
-    inputs = [submission_extract_and_parse_instruction, context_info] + uploaded_files
+    if preprocess_info and preprocess_info.get('page_modality'):
+        context_info += ("\nDocuments were split by page: typed pages are in the *_pages.txt files "
+                         "(each page starts with a [Page N] marker), the remaining pages are the "
+                         "*_page_N images.\n")
+    return context_info
+
+def parse_uploaded_files(backend: LLMBackend, context_info: str, uploaded_files: List, retry_count: int,
+                         retry_delay: float, chunk_instruction: Optional[str] = None) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    Run the parse prompt on uploaded files. Returns (text, usage) where usage holds tokens, cost and
+    time, or None when the call failed or every attempt returned an empty response.
+    """
+    # Generate content with all context
+    logger.info(f"Parsing submission with {backend.describe()}...")
+    
+    inputs = [submission_extract_and_parse_instruction]
+    if chunk_instruction:
+        inputs.append(chunk_instruction)
+    inputs += [context_info] + uploaded_files
+    
+    def require_text(response):
+        # An empty response is retried like a failed call
+        if not response.text or response.text.strip() == "":
+            logger.warning(f"Empty response received from {backend.describe()}!")
+            raise LLMBackendError(f"Empty response from {backend.describe()}")
     
     start_time = time.time()
     try:
         response = api_call_with_retry(
-            model.generate_content, 
+            backend.generate, 
             inputs, 
-            max_retries=retry_count
+            max_retries=retry_count,
+            retry_delay=retry_delay,
+            stage='parse',
+            validate=require_text
         )
         elapsed = time.time() - start_time
         logger.info(f"Parsing completed in {elapsed:.2f} seconds")
         
-        # Check if response text is empty
-        if not response.text or response.text.strip() == "":
-            logger.warning("Empty response received from Gemini model!")
-            return "Error: Empty response from Gemini model. Please check the submission files."
-        
+        model_name, model_type = backend.response_model(response)
+        usage_info = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'cost_usd': 0.0,
+                      'processing_time_seconds': elapsed, 'files_processed': 0, 'model_type': model_type}
         # Calculate cost using usage metadata
         if hasattr(response, 'usage_metadata'):
-            prompt_tokens = response.usage_metadata.prompt_token_count
-            completion_tokens = response.usage_metadata.candidates_token_count
-            model_type = 'pro' if 'pro' in model.model_name else 'flash'
-            cost = calculate_gemini_cost(model_type, prompt_tokens, completion_tokens)
-            
-            # Save cost metadata
-            metadata = {}
-            metadata['parsing'] = {
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens,
-                'total_tokens': prompt_tokens + completion_tokens,
+            usage = backend.usage(response)
+            cost = backend.cost(response)
+            metrics.record_usage(model_name, usage['prompt_tokens'], usage['completion_tokens'], cost)
+            progress.record_cost(cost)
+            usage_info.update({
+                'prompt_tokens': usage['prompt_tokens'],
+                'completion_tokens': usage['completion_tokens'],
+                'total_tokens': usage['total_tokens'],
                 'cost_usd': cost,
-                'model_type': model_type,
-                'processing_time_seconds': elapsed,
                 'files_processed': len(uploaded_files)
-            }
-            
-            metadata_path = submission_dir / "grading_metadata.json"
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
-            logger.info(f"Cost metadata saved to: {metadata_path}")
+            })
         
-        return response.text
+        return response.text, usage_info
     except Exception as e:
         logger.error(f"Error parsing submission: {str(e)}")
         return None
 
-def grade_submission(submission_dir: Path, solution_dir: Path, model, retry_count: int = 3) -> Optional[str]:
-    """Grade a submission using Gemini model."""
+def grade_submission(submission_dir: Path, solution_dir: Path, backend: LLMBackend, retry_count: int = 3, retry_delay: float = 5) -> Optional[str]:
+    """Grade a submission using the grade backend."""
     # Read the parsed submission
     submission_file = submission_dir / "parsed_submission.md"
     if not submission_file.exists():
@@ -383,10 +628,10 @@ def grade_submission(submission_dir: Path, solution_dir: Path, model, retry_coun
         # Format the grading instruction with the structural hint
         formatted_grading_instruction = grading_instruction.replace("{structural_hint}", structural_hint)
         
-        # Upload files using Gemini API
+        # Upload files using the grade backend
         logger.info("Uploading files for grading...")
-        submission_data = genai.upload_file(str(submission_file))
-        solution_data = genai.upload_file(str(solution_file))
+        submission_data = timed_upload(backend, submission_file, 'grade')
+        solution_data = timed_upload(backend, solution_file, 'grade')
         
         # Generate grading report using uploaded files
         logger.info("Generating grading report...")
@@ -400,19 +645,22 @@ def grade_submission(submission_dir: Path, solution_dir: Path, model, retry_coun
         
         start_time = time.time()
         response = api_call_with_retry(
-            model.generate_content, 
+            backend.generate, 
             inputs, 
-            max_retries=retry_count
+            max_retries=retry_count,
+            retry_delay=retry_delay,
+            stage='grade'
         )
         elapsed = time.time() - start_time
         logger.info(f"Grading completed in {elapsed:.2f} seconds")
         
         # Calculate cost using usage metadata
         if hasattr(response, 'usage_metadata'):
-            prompt_tokens = response.usage_metadata.prompt_token_count
-            completion_tokens = response.usage_metadata.candidates_token_count
-            model_type = 'pro' if 'pro' in model.model_name else 'flash'
-            cost = calculate_gemini_cost(model_type, prompt_tokens, completion_tokens)
+            usage = backend.usage(response)
+            cost = backend.cost(response)
+            model_name, model_type = backend.response_model(response)
+            metrics.record_usage(model_name, usage['prompt_tokens'], usage['completion_tokens'], cost)
+            progress.record_cost(cost)
             
             # Load existing metadata if it exists
             metadata_path = submission_dir / "grading_metadata.json"
@@ -426,17 +674,21 @@ def grade_submission(submission_dir: Path, solution_dir: Path, model, retry_coun
             
             # Add grading metrics
             metadata['grading'] = {
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens,
-                'total_tokens': prompt_tokens + completion_tokens,
+                'prompt_tokens': usage['prompt_tokens'],
+                'completion_tokens': usage['completion_tokens'],
+                'total_tokens': usage['total_tokens'],
                 'cost_usd': cost,
                 'model_type': model_type,
-                'processing_time_seconds': elapsed
+                'backend': backend.backend_name,
+                'processing_time_seconds': elapsed,
+                # Graded from the parse of these preprocessed inputs
+                'input_fingerprint': (metadata.get('parsing') or {}).get('input_fingerprint')
             }
             
             # Save updated metadata
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            with tracer.span('file_write', cat='io', file=metadata_path.name):
+                with open(metadata_path, 'w') as f:
+                    json.dump(metadata, f, indent=2)
             logger.info(f"Grading metrics saved to: {metadata_path}")
         
         # Extract student details and grading results
@@ -453,8 +705,9 @@ def grade_submission(submission_dir: Path, solution_dir: Path, model, retry_coun
             
             # Save the combined results
             results_path = submission_dir / "grading_result.json"
-            with open(results_path, 'w', encoding='utf-8') as f:
-                json.dump(final_results, f, indent=2)
+            with tracer.span('file_write', cat='io', file=results_path.name):
+                with open(results_path, 'w', encoding='utf-8') as f:
+                    json.dump(final_results, f, indent=2)
             logger.info(f"Grading results saved to: {results_path}")
         except Exception as e:
             logger.error(f"Error extracting or saving grading results: {str(e)}")
@@ -464,8 +717,20 @@ def grade_submission(submission_dir: Path, solution_dir: Path, model, retry_coun
         logger.error(f"Error grading submission: {str(e)}")
         return None
 
-def process_single_submission(submission_dir: Path, solution_dir: Path, model, retry_count: int, regrade: bool = False):
+def process_single_submission(submission_dir: Path, solution_dir: Path, parse_backend: LLMBackend, grade_backend: LLMBackend, retry_count: int, regrade: bool = False, retry_delay: float = 5,
+                              chunk_pages: int = 20, chunk_workers: int = 4):
     """Process a single submission directory."""
+    with tracer.context(submission=submission_dir.name), tracer.span('process_submission', cat='submission'):
+        result = _process_single_submission(submission_dir, solution_dir, parse_backend, grade_backend, retry_count, regrade, retry_delay,
+                                            chunk_pages, chunk_workers)
+    metrics.SUBMISSIONS.labels(stage='parse', status=result['parsing']).inc()
+    metrics.SUBMISSIONS.labels(stage='grade', status=result['grading']).inc()
+    progress.finish('parse', result['parsing'])
+    progress.finish('grade', result['grading'])
+    return result
+
+def _process_single_submission(submission_dir: Path, solution_dir: Path, parse_backend: LLMBackend, grade_backend: LLMBackend, retry_count: int, regrade: bool, retry_delay: float,
+                               chunk_pages: int, chunk_workers: int):
     logger.info(f"\nProcessing submission in: {submission_dir}")
     
     parsing_status = "skipped"
@@ -477,20 +742,27 @@ def process_single_submission(submission_dir: Path, solution_dir: Path, model, r
     parsed_submission_path = submission_dir / "parsed_submission.md"
     grading_result_path = submission_dir / "grading_result.json"
     
+    # Results made from preprocessed inputs that have changed since are redone
+    stale = stale_results(submission_dir)
+    
     try:
         # Handle parsing
-        if parsed_submission_path.exists() and not regrade:
+        if parsed_submission_path.exists() and not regrade and not stale['parse']:
             logger.info(f"Skipping parsing for {submission_dir.name} - parsed_submission.md already exists")
             parsing_status = "skipped"
             parsing_reason = "parsed_submission.md already exists"
         else:
+            if parsed_submission_path.exists() and stale['parse']:
+                logger.info(f"Re-parsing {submission_dir.name} - preprocessed inputs changed")
             # Parse the submission
-            parsed_text = parse_submission(submission_dir, model, retry_count)
+            with tracer.context(stage='parse'), tracer.span('parse', cat='stage'), metrics.track_in_flight('parse'), progress.track('parse'):
+                parsed_text = parse_submission(submission_dir, parse_backend, retry_count, retry_delay, chunk_pages, chunk_workers)
             
             if parsed_text:
                 # Save the parsed result
-                with open(parsed_submission_path, "w", encoding="utf-8") as f:
-                    f.write(parsed_text)
+                with tracer.span('file_write', cat='io', file=parsed_submission_path.name):
+                    with open(parsed_submission_path, "w", encoding="utf-8") as f:
+                        f.write(parsed_text)
                 logger.info(f"Parsed submission saved to: {parsed_submission_path}")
                 parsing_status = "success"
             else:
@@ -506,19 +778,23 @@ def process_single_submission(submission_dir: Path, solution_dir: Path, model, r
             grading_reason = "No parsed submission file"
             return {"parsing": parsing_status, "grading": grading_status, "parsing_reason": parsing_reason, "grading_reason": grading_reason}
         
-        if grading_result_path.exists():
+        if grading_result_path.exists() and not stale['grade']:
             logger.info(f"Skipping grading for {submission_dir.name} - grading_result.json already exists")
             grading_status = "skipped"
             grading_reason = "grading_result.json already exists"
         else:
+            if grading_result_path.exists():
+                logger.info(f"Re-grading {submission_dir.name} - preprocessed inputs changed")
             # Grade the submission
-            grading_report = grade_submission(submission_dir, solution_dir, model, retry_count)
+            with tracer.context(stage='grade'), tracer.span('grade', cat='stage'), metrics.track_in_flight('grade'), progress.track('grade'):
+                grading_report = grade_submission(submission_dir, solution_dir, grade_backend, retry_count, retry_delay)
             
             if grading_report:
                 # Save the grading report
                 output_path = submission_dir / "grading_report.md"
-                with open(output_path, "w", encoding="utf-8") as f:
-                    f.write(grading_report)
+                with tracer.span('file_write', cat='io', file=output_path.name):
+                    with open(output_path, "w", encoding="utf-8") as f:
+                        f.write(grading_report)
                 logger.info(f"Grading report saved to: {output_path}")
                 grading_status = "success"
             else:
@@ -684,18 +960,19 @@ def generate_processing_report(submissions_dir: Path, results: Dict[str, Dict[st
     logger.info(f"Comprehensive processing report saved to: {report_path}")
     return report_path
 
-def process_submissions(args):
-    """Process all submissions in the submissions directory."""
-    logger.info("========== Starting Submissions Processing ==========")
+def process_submissions(args, parse_backend: Optional[LLMBackend] = None, grade_backend: Optional[LLMBackend] = None) -> Dict[str, Dict[str, str]]:
+    """Process all submissions in the submissions directory.
     
-    # Configure Gemini
-    configure_gemini(args.api_key)
+    Backends are created from the arguments unless they are passed in explicitly.
+    Returns the per-submission parsing and grading results.
+    """
+    logger.info("========== Starting Submissions Processing ==========")
     
-    # Initialize model
-    logger.info("Initializing Gemini model...")
-    model_name = 'gemini-2.5-pro-preview-05-06' if args.model_type == 'pro' else 'gemini-2.5-flash-preview-04-17'
-    model = genai.GenerativeModel(model_name)
-    logger.info(f"Gemini {args.model_type} model initialized.")
+    # Initialize backends for the parse and grade stages
+    cassette = None
+    if parse_backend is None or grade_backend is None:
+        cassette = open_cassette(args)
+        parse_backend, grade_backend = create_stage_backends(args, cassette)
     
     # Get list of submission directories
     submission_dirs = get_submission_dirs(args.submissions_dir)
@@ -709,13 +986,15 @@ def process_submissions(args):
     
     # Dictionary to store detailed results for reporting
     results = {}
+    progress.start(['parse', 'grade'], len(submission_dirs), num_workers)
     
     # Process submissions sequentially or in parallel
     if num_workers == 1:
         logger.info("Processing submissions sequentially")
         successful = 0
         for submission_dir in submission_dirs:
-            result = process_single_submission(submission_dir, args.solution_dir, model, args.retry_count, args.regrade)
+            result = process_single_submission(submission_dir, args.solution_dir, parse_backend, grade_backend, args.retry_count, args.regrade, args.retry_delay,
+                                               args.parse_chunk_pages, args.parse_chunk_workers)
             results[submission_dir.name] = result
             if result["grading"] == "success":
                 successful += 1
@@ -727,9 +1006,13 @@ def process_submissions(args):
                     process_single_submission, 
                     submission_dir, 
                     args.solution_dir, 
-                    model,
+                    parse_backend,
+                    grade_backend,
                     args.retry_count,
-                    args.regrade
+                    args.regrade,
+                    args.retry_delay,
+                    args.parse_chunk_pages,
+                    args.parse_chunk_workers
                 ): submission_dir
                 for submission_dir in submission_dirs
             }
@@ -745,6 +1028,8 @@ def process_submissions(args):
                         successful += 1
                 except Exception as e:
                     logger.error(f"Error in thread processing {submission_name}: {str(e)}")
+                    progress.finish('parse', 'failed')
+                    progress.finish('grade', 'failed')
                     results[submission_name] = {
                         "parsing": "failed",
                         "grading": "failed", 
@@ -752,6 +1037,8 @@ def process_submissions(args):
                         "grading_reason": f"Thread exception: {str(e)}"
                     }
     
+    progress.stop()
+    
     # Report summary
     logger.info("\n========== Submissions Processing Summary ==========")
     logger.info(f"Total submissions: {len(submission_dirs)}")
@@ -764,11 +1051,27 @@ def process_submissions(args):
     # Generate comprehensive processing report
     generate_processing_report(args.submissions_dir, results)
     
+    if cassette is not None:
+        cassette.close()
+        logger.info(f"Cassette {cassette.path}: {cassette.interactions} interactions")
+    
     logger.info("========== Submissions Processing Complete ==========")
+    return results
 
 def main():
     args = parse_arguments()
-    process_submissions(args)
+    if args.trace_file:
+        tracer.enable()
+    progress.enable(args.progress)
+    exporter = metrics.start_metrics_export(args)
+    try:
+        process_submissions(args)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+        if args.trace_file:
+            event_count = tracer.export_chrome_trace(args.trace_file)
+            logger.info(f"Trace with {event_count} events written to {args.trace_file}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
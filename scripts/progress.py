@@ -0,0 +1,301 @@
+"""
+Live progress display for preprocessing and grading runs.
+
+Worker threads only put small event tuples on a queue (no shared counters, no
+locks); a single render thread drains the queue, keeps the per-stage state and
+redraws either a progress bar on a TTY or a periodic log line otherwise. While
+the bar is shown, log handlers writing to stderr clear it before every record
+and redraw it after, so log lines and the bar do not overwrite each other.
+
+The ETA uses an exponentially weighted moving average of the duration of every
+stage, so it follows changes in model latency or converter speed during a run.
+"""
+
+import sys
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_MODES = ['auto', 'bar', 'log', 'off']
+EWMA_ALPHA = 0.2
+WINDOW_SECONDS = 60.0
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class _StageState:
+    def __init__(self):
+        self.in_flight = 0
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.ewma_seconds: Optional[float] = None
+
+    @property
+    def finished(self) -> int:
+        return self.done + self.failed + self.skipped
+
+
+class _ProgressView:
+    """Run state owned by the render thread."""
+
+    def __init__(self, stages: List[str], total: int, workers: int):
+        self.stages = {stage: _StageState() for stage in stages}
+        self.final_stage = stages[-1]
+        self.total = total
+        self.workers = max(1, workers)
+        self.started_at = time.monotonic()
+        self.spend_usd = 0.0
+        self.completions = deque()
+        self.api_calls = deque()
+        self.rate_limited = deque()
+        self.rate_limit_remaining: Optional[int] = None
+
+    def apply(self, event):
+        timestamp, kind, stage, value = event
+        state = self.stages.get(stage)
+        if kind == 'start' and state:
+            state.in_flight += 1
+        elif kind == 'end' and state:
+            state.in_flight = max(0, state.in_flight - 1)
+            if state.ewma_seconds is None:
+                state.ewma_seconds = value
+            else:
+                state.ewma_seconds = EWMA_ALPHA * value + (1 - EWMA_ALPHA) * state.ewma_seconds
+        elif kind == 'finish' and state:
+            if value == 'success':
+                state.done += 1
+            elif value == 'failed':
+                state.failed += 1
+            else:
+                state.skipped += 1
+            if stage == self.final_stage:
+                self.completions.append(timestamp)
+        elif kind == 'cost':
+            self.spend_usd += value
+        elif kind == 'api_call':
+            status_code, remaining = value
+            self.api_calls.append(timestamp)
+            if status_code == 429:
+                self.rate_limited.append(timestamp)
+            if remaining is not None:
+                self.rate_limit_remaining = remaining
+
+    def _trim(self, now: float):
+        for window in (self.completions, self.api_calls, self.rate_limited):
+            while window and now - window[0] > WINDOW_SECONDS:
+                window.popleft()
+
+    def throughput_per_minute(self, now: float) -> float:
+        window = min(WINDOW_SECONDS, now - self.started_at)
+        if window <= 0:
+            return 0.0
+        return len(self.completions) / window * 60
+
+    def eta_seconds(self) -> Optional[float]:
+        known = [state.ewma_seconds for state in self.stages.values() if state.ewma_seconds is not None]
+        if not known:
+            return None
+        fallback = sum(known) / len(known)
+        remaining_work = 0.0
+        for state in self.stages.values():
+            queued = max(0, self.total - state.finished - state.in_flight)
+            ewma = state.ewma_seconds if state.ewma_seconds is not None else fallback
+            # In-flight items are assumed to be half done on average
+            remaining_work += ewma * (queued + 0.5 * state.in_flight)
+        return remaining_work / self.workers
+
+    def describe(self, now: float) -> str:
+        self._trim(now)
+        parts = []
+        for name, state in self.stages.items():
+            queued = max(0, self.total - state.finished - state.in_flight)
+            parts.append(f"{name} q{queued} r{state.in_flight} ok{state.done} x{state.failed} s{state.skipped}")
+        parts.append(f"{self.throughput_per_minute(now):.1f}/min")
+        eta = self.eta_seconds()
+        parts.append(f"ETA {format_duration(eta) if eta is not None else '--'}")
+        if self.api_calls or self.spend_usd:
+            parts.append(f"${self.spend_usd:.4f}")
+            headroom = f"api {len(self.api_calls)}/min 429s {len(self.rate_limited)}/min"
+            if self.rate_limit_remaining is not None:
+                headroom += f" left {self.rate_limit_remaining}"
+            parts.append(headroom)
+        return ' | '.join(parts)
+
+    def fraction(self) -> float:
+        if not self.total:
+            return 1.0
+        return self.stages[self.final_stage].finished / self.total
+
+
+class _BarAwareStream:
+    """Stream of a log handler that clears the progress bar before each record and redraws it after."""
+
+    def __init__(self, tracker: 'ProgressTracker', stream):
+        self.tracker = tracker
+        self.stream = stream
+
+    def write(self, text: str):
+        with self.tracker._bar_lock:
+            if self.tracker._bar_line:
+                self.stream.write("\r\x1b[K")
+            self.stream.write(text)
+            if self.tracker._bar_line:
+                self.stream.write(self.tracker._bar_line)
+            self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class ProgressTracker:
+    """Collects progress events from worker threads and renders them."""
+
+    def __init__(self):
+        self.mode = 'off'
+        self.refresh_interval = 0.5
+        self.log_interval = 30.0
+        self._queue = queue.SimpleQueue()
+        self._view: Optional[_ProgressView] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # The bar as last drawn, and the stderr log handlers that redraw it
+        self._bar_lock = threading.Lock()
+        self._bar_line = ''
+        self._wrapped_handlers: List[logging.StreamHandler] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    def enable(self, mode: str = 'auto', log_interval: float = 30.0):
+        if mode == 'auto' or mode == 'bar':
+            # \r redraws only work on a terminal
+            mode = 'bar' if sys.stderr.isatty() else 'log'
+        self.mode = mode
+        self.log_interval = log_interval
+
+    def _emit(self, kind: str, stage: Optional[str] = None, value=None):
+        if self.mode != 'off':
+            self._queue.put((time.monotonic(), kind, stage, value))
+
+    @contextmanager
+    def track(self, stage: str):
+        """Count the block as one in-flight item of a stage and time it."""
+        if self.mode == 'off':
+            yield
+            return
+        start = time.monotonic()
+        self._emit('start', stage)
+        try:
+            yield
+        finally:
+            self._emit('end', stage, time.monotonic() - start)
+
+    def finish(self, stage: str, status: str):
+        """Mark one item of a stage as finished ('success', 'failed' or 'skipped')."""
+        self._emit('finish', stage, status)
+
+    def record_cost(self, cost_usd: float):
+        self._emit('cost', value=cost_usd)
+
+    def record_api_call(self, status_code: Optional[int] = None, rate_limit_remaining: Optional[int] = None):
+        self._emit('api_call', value=(status_code, rate_limit_remaining))
+
+    def start(self, stages: List[str], total: int, workers: int):
+        """Start rendering a run of `total` items through the given stages."""
+        if self.mode == 'off':
+            return
+        self._view = _ProgressView(stages, total, workers)
+        if self.mode == 'bar':
+            self._wrap_log_handlers()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Render the final state and stop the render thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._drain()
+        self._render(final=True)
+        self._unwrap_log_handlers()
+
+    def _wrap_log_handlers(self):
+        for handler in logging.getLogger().handlers:
+            if (isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler)
+                    and handler.stream is sys.stderr):
+                handler.setStream(_BarAwareStream(self, handler.stream))
+                self._wrapped_handlers.append(handler)
+
+    def _unwrap_log_handlers(self):
+        for handler in self._wrapped_handlers:
+            handler.setStream(handler.stream.stream)
+        self._wrapped_handlers = []
+
+    def _drain(self):
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._view.apply(event)
+
+    def _run(self):
+        last_log = time.monotonic()
+        while not self._stop.wait(self.refresh_interval):
+            self._drain()
+            if self.mode == 'bar':
+                self._render()
+            elif time.monotonic() - last_log >= self.log_interval:
+                last_log = time.monotonic()
+                self._render()
+
+    def _render(self, final: bool = False):
+        view = self._view
+        now = time.monotonic()
+        done = view.stages[view.final_stage].finished
+        text = f"{done}/{view.total} {view.describe(now)} | elapsed {format_duration(now - view.started_at)}"
+        if self.mode == 'bar':
+            width = 24
+            filled = int(view.fraction() * width)
+            line = f"[{'#' * filled}{'-' * (width - filled)}] {text}"
+            with self._bar_lock:
+                sys.stderr.write(f"\r\x1b[K{line}" + ("\n" if final else ""))
+                sys.stderr.flush()
+                self._bar_line = '' if final else line
+        else:
+            logger.info(f"Progress: {text}")
+
+
+# Process-wide progress tracker used by all scripts
+progress = ProgressTracker()
+
+
+def add_progress_arguments(parser):
+    """Add the progress display argument to an argparse parser."""
+    parser.add_argument(
+        '--progress',
+        choices=PROGRESS_MODES,
+        default='auto',
+        help='Live progress: bar on a TTY, periodic log lines otherwise (auto), or off'
+    )
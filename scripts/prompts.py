@@ -58,6 +58,11 @@ You have access to the textual data from the pdf file. The challenge is that the
 It is very important that you only format the text and don't add in any other information because it will be used for grading. The contents of the submission may or may not be correct but must be parsed as is.
 """
 
+submission_chunk_parse_instruction = """
+The submission is too long for one request and is parsed in parts. This request contains only part {part} of {parts} of the submission, with its files in page order. Parse only the content of these files, in order.
+The parts are concatenated afterwards, so do not add introductions, summaries or closing remarks. If this part starts in the middle of an exercise, continue it under the same exercise header as it appears in the submission; do not renumber exercises or questions.
+"""
+
 grading_instruction = """
 You are a math expert. You are given a submission for an assignment and a model solution for the same assignment. Please grade the submission based on the model solution. Please first analyse each question in the submission and model solution and then grade the submission, giving points for each question based on the model solution. Consider that a different valid solution may exist for the same question. Be generous when grading.
 In the very end, summarize the points for each question and the total points for the submission in json format.
@@ -0,0 +1,181 @@
+"""
+Resource accounting for child processes.
+
+run_with_usage() is a drop-in replacement for subprocess.run() that reaps the
+child itself with os.wait4() while threads serve its pipes, so the wall time,
+user/system CPU time and peak RSS of the child (including the descendants it
+waited for, e.g. soffice.bin behind the libreoffice wrapper or LaTeX behind
+nbconvert) are available per invocation. Only the public Popen interface is
+used; without os.wait4 (Windows) only the wall time is recorded.
+"""
+
+import os
+import time
+import threading
+import subprocess
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class ResourceUsage:
+    """Resources consumed by one child process."""
+
+    def __init__(self, wall_seconds: float, cpu_user_seconds: Optional[float] = None,
+                 cpu_sys_seconds: Optional[float] = None, max_rss_mb: Optional[float] = None):
+        self.wall_seconds = wall_seconds
+        self.cpu_user_seconds = cpu_user_seconds
+        self.cpu_sys_seconds = cpu_sys_seconds
+        self.max_rss_mb = max_rss_mb
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'wall_seconds': round(self.wall_seconds, 3),
+            'cpu_user_seconds': None if self.cpu_user_seconds is None else round(self.cpu_user_seconds, 3),
+            'cpu_sys_seconds': None if self.cpu_sys_seconds is None else round(self.cpu_sys_seconds, 3),
+            'max_rss_mb': None if self.max_rss_mb is None else round(self.max_rss_mb, 1)
+        }
+
+
+def _exit_code(status: int) -> int:
+    """Popen.returncode of a wait status: the exit code, or -signal when killed."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _reap(pid: int, reaped: Dict[str, Any]):
+    try:
+        _, status, rusage = os.wait4(pid, 0)
+    except ChildProcessError:
+        # Reaped by Popen (e.g. polled by kill()), its usage is lost
+        return
+    reaped['returncode'] = _exit_code(status)
+    reaped['rusage'] = rusage
+
+
+def _read(stream, chunks: List):
+    chunks.append(stream.read())
+
+
+def _write(stream, data):
+    try:
+        stream.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+
+def _usage(reaped: Dict[str, Any], start: float) -> ResourceUsage:
+    wall = time.perf_counter() - start
+    rusage = reaped.get('rusage')
+    if rusage is None:
+        return ResourceUsage(wall)
+    # ru_maxrss is reported in kilobytes on Linux
+    return ResourceUsage(wall, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss / 1024)
+
+
+def run_with_usage(cmd, *, input=None, capture_output=False, timeout=None, check=False,
+                   **kwargs) -> Tuple[subprocess.CompletedProcess, ResourceUsage]:
+    """Run a command like subprocess.run and return (completed_process, resource_usage).
+
+    Exceptions raised for timeouts or failed checks carry the usage of the child
+    in their `resource_usage` attribute.
+    """
+    if not hasattr(os, 'wait4'):
+        # No per-child accounting (Windows): only the wall time is known
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(cmd, input=input, capture_output=capture_output, timeout=timeout,
+                                    check=check, **kwargs)
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as exc:
+            exc.resource_usage = ResourceUsage(time.perf_counter() - start)
+            raise
+        return result, ResourceUsage(time.perf_counter() - start)
+
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+
+    start = time.perf_counter()
+    with subprocess.Popen(cmd, **kwargs) as process:
+        # The child is reaped here with wait4 rather than by Popen, so its rusage is kept;
+        # the pipes are served by threads meanwhile, as communicate() would
+        reaped: Dict[str, Any] = {}
+        waiter = threading.Thread(target=_reap, args=(process.pid, reaped), daemon=True)
+        waiter.start()
+        outputs = {}
+        io_threads = []
+        for name in ('stdout', 'stderr'):
+            stream = getattr(process, name)
+            if stream is not None:
+                outputs[name] = []
+                io_threads.append(threading.Thread(target=_read, args=(stream, outputs[name]), daemon=True))
+        if process.stdin is not None:
+            io_threads.append(threading.Thread(target=_write, args=(process.stdin, input), daemon=True))
+        for thread in io_threads:
+            thread.start()
+
+        try:
+            waiter.join(timeout)
+            timed_out = waiter.is_alive()
+            if timed_out:
+                process.kill()
+                waiter.join()
+            for thread in io_threads:
+                thread.join()
+        except BaseException:
+            if waiter.is_alive():
+                process.kill()
+            raise
+        if 'returncode' in reaped:
+            # Popen.wait() then returns at once instead of reaping the child again
+            process.returncode = reaped['returncode']
+        retcode = process.wait()
+        stdout = outputs['stdout'][0] if outputs.get('stdout') else None
+        stderr = outputs['stderr'][0] if outputs.get('stderr') else None
+        if timed_out:
+            exc = subprocess.TimeoutExpired(process.args, timeout, output=stdout, stderr=stderr)
+            exc.resource_usage = _usage(reaped, start)
+            raise exc
+
+    usage = _usage(reaped, start)
+    if check and retcode:
+        error = subprocess.CalledProcessError(retcode, process.args, output=stdout, stderr=stderr)
+        error.resource_usage = usage
+        raise error
+    return subprocess.CompletedProcess(process.args, retcode, stdout, stderr), usage
+
+
+def summarize_usage(records) -> Dict[str, Dict[str, Any]]:
+    """Aggregate per-invocation usage records (dicts with a 'tool' key) per tool."""
+    summary: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        stats = summary.setdefault(record['tool'], {
+            'runs': 0,
+            'failures': 0,
+            'wall_seconds_total': 0.0,
+            'cpu_user_seconds_total': 0.0,
+            'cpu_sys_seconds_total': 0.0,
+            'max_rss_mb': 0.0,
+            'queue_seconds_total': 0.0
+        })
+        stats['runs'] += 1
+        if record.get('status') != 'ok':
+            stats['failures'] += 1
+        stats['wall_seconds_total'] += record['wall_seconds']
+        stats['cpu_user_seconds_total'] += record['cpu_user_seconds'] or 0.0
+        stats['cpu_sys_seconds_total'] += record['cpu_sys_seconds'] or 0.0
+        stats['max_rss_mb'] = max(stats['max_rss_mb'], record['max_rss_mb'] or 0.0)
+        stats['queue_seconds_total'] += record.get('queue_seconds', 0.0)
+
+    for stats in summary.values():
+        stats['wall_seconds_mean'] = stats['wall_seconds_total'] / stats['runs']
+        for key in ('wall_seconds_total', 'cpu_user_seconds_total', 'cpu_sys_seconds_total', 'wall_seconds_mean',
+                    'queue_seconds_total'):
+            stats[key] = round(stats[key], 3)
+    return summary
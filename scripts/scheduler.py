@@ -0,0 +1,175 @@
+"""
+Resource-aware admission of converter subprocesses.
+
+Submissions are processed on --workers threads, and every thread may start a
+converter at any time: eight workers can mean eight LibreOffice or LaTeX runs
+at once, enough to exhaust memory and get processes OOM-killed, while cheap
+tools like pdftotext are throttled by the same knob. The scheduler gives each
+tool a resource class with its own number of slots:
+
+- heavy: LibreOffice, nbconvert (LaTeX), pandoc/wkhtmltopdf,
+- medium: rasterization and archive tools (pdftoppm, 7z),
+- light: text and metadata tools (pdftotext, pdfimages, pdfinfo).
+
+A process waits in a first-in first-out queue of its class until a slot is
+free. Heavy and medium processes are also held back while available memory is
+below the class reserve or the load average per CPU is above the class limit.
+A class with nothing running always admits its next process, so the queue
+keeps moving on a machine that is busy for other reasons.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+import psutil
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TOOL_CLASSES = {
+    'libreoffice': 'heavy',
+    'libreoffice_batch': 'heavy',
+    'nbconvert': 'heavy',
+    'pandoc': 'heavy',
+    'pdftoppm': 'medium',
+    '7z': 'medium',
+    'pdftotext': 'light',
+    'pdfimages': 'light',
+    'pdfinfo': 'light',
+}
+# Tools without a class are treated as medium
+DEFAULT_CLASS = 'medium'
+
+# How long resource readings are reused, and how often a held-back queue rechecks them
+RESOURCE_POLL_SECONDS = 0.25
+
+MB = 1024 * 1024
+
+
+class ResourceClass:
+    """Slots and admission thresholds of one class of tools."""
+
+    def __init__(self, name: str, slots: int, min_free_mb: int = 0, max_load: Optional[float] = None):
+        self.name = name
+        self.slots = slots
+        self.min_free_mb = min_free_mb
+        # Load average per CPU above which no further process is admitted (None: no limit)
+        self.max_load = max_load
+        self.running = 0
+        self.queue = deque()
+        self.admitted = 0
+        self.held_back = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_queued = 0
+
+
+class Admission:
+    """A granted slot; returned to the scheduler by release()."""
+
+    def __init__(self, resource_class: ResourceClass, wait_seconds: float):
+        self.resource_class = resource_class
+        self.wait_seconds = wait_seconds
+
+
+def default_classes(heavy_slots: int = 0, medium_slots: int = 0, light_slots: int = 0) -> Dict[str, ResourceClass]:
+    """Resource classes sized to this machine; a slot count of 0 selects the default."""
+    cpus = os.cpu_count() or 1
+    total_mb = psutil.virtual_memory().total // MB
+    # A LibreOffice or LaTeX run peaks at several hundred MB: one per GB of RAM, one per two CPUs
+    heavy = heavy_slots or max(1, min(cpus // 2, total_mb // 1024))
+    medium = medium_slots or max(1, cpus)
+    light = light_slots or max(2, 2 * cpus)
+    return {
+        'heavy': ResourceClass('heavy', heavy, min_free_mb=1024, max_load=1.0),
+        'medium': ResourceClass('medium', medium, min_free_mb=256, max_load=1.5),
+        'light': ResourceClass('light', light),
+    }
+
+
+class SubprocessScheduler:
+    """Admits converter processes per resource class, with memory and load admission control."""
+
+    def __init__(self, classes: Dict[str, ResourceClass]):
+        self.classes = classes
+        self._condition = threading.Condition()
+        self._readings = (0.0, 0, 0.0)
+
+    def _resources(self):
+        """(available memory in MB, 1-minute load average per CPU), refreshed every poll interval."""
+        now = time.monotonic()
+        checked, available_mb, load = self._readings
+        if now - checked >= RESOURCE_POLL_SECONDS:
+            available_mb = psutil.virtual_memory().available // MB
+            load = psutil.getloadavg()[0] / (os.cpu_count() or 1)
+            self._readings = (now, available_mb, load)
+        return available_mb, load
+
+    def _resources_allow(self, resource_class: ResourceClass) -> bool:
+        if resource_class.running == 0:
+            return True
+        available_mb, load = self._resources()
+        if available_mb < resource_class.min_free_mb:
+            return False
+        return resource_class.max_load is None or load <= resource_class.max_load
+
+    def acquire(self, tool: str) -> Admission:
+        """Wait for a slot of the tool's class and take it."""
+        resource_class = self.classes[TOOL_CLASSES.get(tool, DEFAULT_CLASS)]
+        ticket = object()
+        start = time.monotonic()
+        held_back = False
+        with self._condition:
+            resource_class.queue.append(ticket)
+            resource_class.max_queued = max(resource_class.max_queued, len(resource_class.queue))
+            metrics.CONVERTERS_QUEUED.labels(resource_class=resource_class.name).inc()
+            while True:
+                if resource_class.queue[0] is ticket and resource_class.running < resource_class.slots:
+                    if self._resources_allow(resource_class):
+                        break
+                    if not held_back:
+                        held_back = True
+                        resource_class.held_back += 1
+                        logger.debug(f"Holding back {tool}: low memory or high load")
+                    # Resources free up without a release, so poll
+                    self._condition.wait(RESOURCE_POLL_SECONDS)
+                else:
+                    self._condition.wait()
+            resource_class.queue.popleft()
+            resource_class.running += 1
+            wait_seconds = time.monotonic() - start
+            resource_class.admitted += 1
+            resource_class.wait_seconds += wait_seconds
+            resource_class.max_wait_seconds = max(resource_class.max_wait_seconds, wait_seconds)
+            # The next in line may fit too
+            self._condition.notify_all()
+        metrics.CONVERTERS_QUEUED.labels(resource_class=resource_class.name).dec()
+        metrics.CONVERTERS_RUNNING.labels(resource_class=resource_class.name).inc()
+        metrics.CONVERTER_QUEUE_SECONDS.labels(resource_class=resource_class.name).observe(wait_seconds)
+        return Admission(resource_class, wait_seconds)
+
+    def release(self, admission: Admission):
+        with self._condition:
+            admission.resource_class.running -= 1
+            self._condition.notify_all()
+        metrics.CONVERTERS_RUNNING.labels(resource_class=admission.resource_class.name).dec()
+
+    def summary(self) -> Dict:
+        """Slots, admissions and queueing time per class."""
+        with self._condition:
+            return {
+                name: {
+                    'slots': c.slots,
+                    'admitted': c.admitted,
+                    'held_back_by_resources': c.held_back,
+                    'queue_seconds_total': round(c.wait_seconds, 3),
+                    'queue_seconds_max': round(c.max_wait_seconds, 3),
+                    'max_queued': c.max_queued
+                }
+                for name, c in self.classes.items()
+            }
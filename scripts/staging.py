@@ -0,0 +1,118 @@
+"""
+Zero-copy staging of submission files.
+
+Preprocessing places input files several times: into the temporary flattening
+directory, into processed/textual or processed/visual, and into
+#failed_preprocessing when they fail. Stager does this without copying data
+where the filesystem allows it, trying in order:
+
+- reflink (FICLONE ioctl): a copy-on-write clone (btrfs, XFS, bcachefs, ...)
+  that shares data blocks but is independent once either side is written,
+- hardlink: the same inode, only for targets the pipeline never writes in
+  place (it replaces files instead of editing them),
+- copy: shutil.copy2, e.g. across filesystems.
+
+A filesystem pair that refuses reflinks is remembered, so the ioctl is tried
+once per pair. In reference mode, inputs are not staged into the flattening
+directory at all; converters read them where they are. The method used for
+every file is counted and reported per run.
+"""
+
+import os
+import errno
+import shutil
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+STAGING_MODES = ['auto', 'reflink', 'hardlink', 'copy', 'reference']
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+
+class Stager:
+    """Places files by reflink, hardlink or copy, and counts the method used for each."""
+
+    def __init__(self, mode: str = 'auto'):
+        if mode not in STAGING_MODES:
+            raise ValueError(f"Unknown staging mode: {mode}")
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._no_reflink: Set[Tuple[int, int]] = set()
+        self.files: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+
+    @property
+    def references(self) -> bool:
+        """Inputs are read in place instead of being staged."""
+        return self.mode == 'reference'
+
+    def _methods(self, shared: bool):
+        if self.mode == 'copy':
+            return ['copy']
+        if self.mode == 'reflink':
+            return ['reflink', 'copy']
+        methods = ['hardlink', 'reflink', 'copy'] if self.mode == 'hardlink' else ['reflink', 'hardlink', 'copy']
+        if not shared:
+            methods.remove('hardlink')
+        return methods
+
+    def _record(self, method: str, size: int):
+        with self._lock:
+            self.files[method] = self.files.get(method, 0) + 1
+            self.bytes[method] = self.bytes.get(method, 0) + size
+
+    def reference(self, source: Path):
+        """Count an input that is read in place."""
+        self._record('reference', source.stat().st_size)
+
+    def _reflink(self, source: Path, target: Path):
+        devices = (os.stat(source).st_dev, os.stat(target.parent).st_dev)
+        if devices in self._no_reflink:
+            raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+        try:
+            import fcntl
+        except ImportError:
+            self._no_reflink.add(devices)
+            raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError as e:
+            target.unlink(missing_ok=True)
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS):
+                with self._lock:
+                    self._no_reflink.add(devices)
+            raise
+        shutil.copystat(source, target)
+
+    def stage(self, source: Path, target: Path, shared: bool = True) -> str:
+        """
+        Make target a copy of source and return the method used. With shared, target may be
+        a hardlink of source, so it must never be written in place.
+        """
+        # Like copy2, replace an existing target (never write through a link)
+        target.unlink(missing_ok=True)
+        for method in self._methods(shared):
+            try:
+                if method == 'reflink':
+                    self._reflink(source, target)
+                elif method == 'hardlink':
+                    os.link(source, target)
+                else:
+                    shutil.copy2(source, target)
+            except OSError as e:
+                if method == 'copy':
+                    raise
+                logger.debug(f"{method} of {source.name} failed: {e}")
+                continue
+            self._record(method, target.stat().st_size)
+            return method
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {'mode': self.mode, 'files': dict(self.files), 'bytes': dict(self.bytes)}
@@ -0,0 +1,128 @@
+"""
+Lightweight span tracing exported in the Chrome trace-event format.
+
+Spans are recorded as complete ('X') events with the thread that ran them and
+the attributes of the surrounding context (submission, stage, ...). The
+resulting JSON file can be opened in chrome://tracing or https://ui.perfetto.dev
+to inspect where the wall-clock time of a run went across worker threads.
+
+Tracing is disabled by default; a disabled tracer costs one attribute check
+per span.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any
+
+
+class Tracer:
+    """Collects spans from all threads of the process."""
+
+    def __init__(self):
+        self.enabled = False
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._named_threads = set()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self._origin = time.perf_counter()
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1_000_000
+
+    def _context(self) -> Dict[str, Any]:
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else {}
+
+    @contextmanager
+    def context(self, **attrs):
+        """Attach attributes to every span opened by this thread inside the block."""
+        if not self.enabled:
+            yield
+            return
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        merged = dict(stack[-1]) if stack else {}
+        merged.update(attrs)
+        stack.append(merged)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    @contextmanager
+    def span(self, name: str, cat: str = 'pipeline', **attrs):
+        """Record the duration of the block as a span."""
+        if not self.enabled:
+            yield
+            return
+        start = self._now_us()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            args = dict(self._context())
+            args.update(attrs)
+            if error:
+                args['error'] = error
+            self._add({
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': start,
+                'dur': self._now_us() - start,
+                'args': {key: str(value) for key, value in args.items()}
+            })
+
+    def instant(self, name: str, cat: str = 'pipeline', **attrs):
+        """Record a point-in-time event."""
+        if not self.enabled:
+            return
+        args = dict(self._context())
+        args.update(attrs)
+        self._add({
+            'name': name,
+            'cat': cat,
+            'ph': 'i',
+            's': 't',
+            'ts': self._now_us(),
+            'args': {key: str(value) for key, value in args.items()}
+        })
+
+    def _add(self, event: Dict[str, Any]):
+        thread = threading.current_thread()
+        event['pid'] = os.getpid()
+        event['tid'] = thread.ident
+        with self._lock:
+            if thread.ident not in self._named_threads:
+                self._named_threads.add(thread.ident)
+                self._events.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': event['pid'], 'tid': thread.ident,
+                    'args': {'name': thread.name}
+                })
+            self._events.append(event)
+
+    def export_chrome_trace(self, path: Path) -> int:
+        """Write all recorded events as a Chrome trace-event JSON file. Returns the event count."""
+        with self._lock:
+            events = list(self._events)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+# Process-wide tracer used by all scripts
+tracer = Tracer()
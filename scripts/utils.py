@@ -1,3 +1,7 @@
+import re
+from pathlib import Path
+from typing import List, Optional
+
 def calculate_gemini_cost(
     model: str,
     prompt_token_count: int,
@@ -31,3 +35,23 @@ def calculate_gemini_cost(
     output_cost = (candidates_token_count / 1_000_000) * output_price
     total_cost = input_cost + output_cost
     return total_cost
+
+
+def _natural_key(text: str):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', text)]
+
+
+def page_order_key(file_path: str, pages: Optional[List[int]] = None):
+    """
+    Sort key that keeps the outputs of a document together and in page order: the <stem>_page_N
+    images by N, <stem>_pages.txt (typed pages) at the first of its pages when they are given,
+    otherwise first.
+    """
+    name = Path(file_path).name
+    match = re.match(r'(.+)_pages\.txt$', name)
+    if match:
+        return _natural_key(match.group(1)), min(pages) if pages else 0, name
+    match = re.match(r'(.+)_page_(\d+)\.\w+$', name)
+    if match:
+        return _natural_key(match.group(1)), int(match.group(2)), name
+    return _natural_key(Path(name).stem), 0, name
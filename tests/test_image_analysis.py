@@ -0,0 +1,39 @@
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from image_analysis import image_signature, optimize_image, select_redundant
+
+DPI = 300
+
+
+def scanned_page(path, text=None):
+    """A letter-size page scanned at 300 DPI, optionally with one line of 12pt text."""
+    page = Image.new('L', (int(8.5 * DPI), 11 * DPI), 245)
+    if text:
+        try:
+            font = ImageFont.load_default(size=DPI * 12 // 72)
+        except TypeError:
+            pytest.skip("Pillow without scalable default font")
+        ImageDraw.Draw(page).text((DPI, DPI), text, fill=20, font=font)
+    page.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('text', ["x = 42", "f(x) = 3x^2 + 2x - 5, so f(1) = 0"])
+def test_single_short_line_is_not_blank(tmp_path, text):
+    signature = image_signature(scanned_page(tmp_path / 'answer.png', text))
+    assert select_redundant([('answer.png', signature)]) == []
+
+
+def test_empty_page_is_blank(tmp_path):
+    signature = image_signature(scanned_page(tmp_path / 'backside.png'))
+    assert [record['reason'] for record in select_redundant([('backside.png', signature)])] == ['blank']
+
+
+def test_optimized_image_keeps_file_with_same_stem(tmp_path):
+    # A bilevel scan is re-encoded as PNG, where the export of the same page already is
+    scanned_page(tmp_path / 'page1.png', "page one")
+    scanned_page(tmp_path / 'page1.jpg', "x = 42")
+    record = optimize_image(str(tmp_path / 'page1.jpg'), 1032, 2048)
+    assert record['filename'] == 'page1_1.png'
+    assert (tmp_path / 'page1.png').exists() and (tmp_path / 'page1_1.png').exists()